@@ -0,0 +1,178 @@
+"""Benchmarks for sidecar matching and end-to-end merging, written as JSON so runs can be compared.
+
+    python bench/benchmark.py --output results.json
+    python bench/benchmark.py --output new.json --compare results.json
+
+Merging runs against a synthetic Takeout folder with the fake exiftool from the tests, slowed down by
+--exiftoolLatency seconds per call, so the numbers don't depend on the exiftool installed.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+sys.path.append(ROOT)
+FAKE_EXIFTOOL = os.path.join(ROOT, "test", "fake_exiftool.py")
+
+# higher is better for rates, lower is better for everything else
+_HIGHER_IS_BETTER = ("files_per_second", "mb_per_second")
+_COMPARED = ("seconds", "peak_mb", "files_per_second", "mb_per_second")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=ROOT).stdout.strip()
+    except OSError:
+        return None
+
+
+def bench_matcher(count: int, seed: int = 0) -> dict:
+    """Time `match_files_from_file_list` on a synthetic listing, then measure its peak memory in a second run."""
+    from match_files import match_files_from_file_list
+    from synthetic_takeout import generate_listing
+
+    listing, expected = generate_listing(count, seed)
+    gc.collect()
+    start = time.perf_counter()
+    matched, missing, ambiguous = match_files_from_file_list(listing, show_progress=False)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    match_files_from_file_list(listing, show_progress=False)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    correct = sum(1 for media, sidecar in matched if expected.get(media) == sidecar)
+    return {"name": f"match_{count}", "files": len(expected), "seconds": round(seconds, 4),
+            "files_per_second": round(len(expected) / seconds, 1), "peak_mb": round(peak / 2**20, 2),
+            "matched": len(matched), "missing": len(missing), "ambiguous": len(ambiguous), "correct": correct}
+
+
+def _scan_tuples(directory: str) -> list:
+    # what a listing costs kept as a list of (name, size, mtime, inode) tuples, to compare the catalog against
+    with os.scandir(directory) as entries:
+        return [(entry.name, stat.st_size, stat.st_mtime_ns, stat.st_ino) for entry in entries for stat in [entry.stat()]]
+
+
+def bench_catalog(count: int, seed: int = 0) -> dict:
+    """Scan a directory of `count` empty media files and their sidecars into a FileCatalog, and compare its
+    peak memory with keeping the same listing as a list of tuples."""
+    from catalog import FileCatalog
+    from synthetic_takeout import generate_photos
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        photos = generate_photos(count, seed)
+        for name in {name for media, sidecar, _ in photos for name in (media, sidecar)}:
+            open(os.path.join(tmpdir, name), "wb").close()
+        peaks = {}
+        for label, scan in (("catalog", lambda: FileCatalog.scan(tmpdir)), ("tuples", lambda: _scan_tuples(tmpdir))):
+            gc.collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            listing = scan()
+            peaks[label] = (time.perf_counter() - start, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            del listing
+    seconds, peak = peaks["catalog"]
+    return {"name": f"catalog_{count}", "files": count, "seconds": round(seconds, 4),
+            "files_per_second": round(count / seconds, 1), "peak_mb": round(peak / 2**20, 2),
+            "tuples_peak_mb": round(peaks["tuples"][1] / 2**20, 2)}
+
+
+def bench_merge(count: int, albums: int, media_bytes: int, latency: float, seed: int = 0, **options) -> dict:
+    """Merge a synthetic Takeout folder end to end and report files/sec and MB/sec of source media."""
+    from synthetic_takeout import write_takeout
+    from main import merge_metadata
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_dir, output_dir = os.path.join(tmpdir, "in"), os.path.join(tmpdir, "out")
+        expected = write_takeout(input_dir, count, albums, media_bytes, seed)
+        total_bytes = sum(os.path.getsize(os.path.join(input_dir, media)) for media in expected)
+        start = time.perf_counter()
+        ok = merge_metadata(input_dir, output_dir, recursive=albums > 1, show_progress=False, **options)
+        seconds = time.perf_counter() - start
+    return {"name": f"merge_{count}", "files": len(expected), "bytes": total_bytes, "ok": ok,
+            "exiftool_latency": latency, "seconds": round(seconds, 4),
+            "files_per_second": round(len(expected) / seconds, 1),
+            "mb_per_second": round(total_bytes / 2**20 / seconds, 2), "options": options}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return a line for every compared metric that got worse than `baseline` by more than `threshold`."""
+    regressions = []
+    old = {bench["name"]: bench for bench in baseline["results"]}
+    for bench in results["results"]:
+        if bench["name"] not in old:
+            continue
+        for metric in _COMPARED:
+            if metric not in bench or not old[bench["name"]].get(metric):
+                continue
+            change = bench[metric] / old[bench["name"]][metric] - 1
+            worse = -change if metric in _HIGHER_IS_BETTER else change
+            line = f"{bench['name']}.{metric}: {old[bench['name']][metric]} -> {bench[metric]} ({change:+.1%})"
+            print(line)
+            if worse > threshold:
+                regressions.append(line)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sidecar matching and merging")
+    parser.add_argument("--matchSizes", type=int, nargs="*", default=[1_000, 10_000, 100_000],
+                        help="Listing sizes to match. Add 1000000 for the full run")
+    parser.add_argument("--catalogFiles", type=int, nargs="*", default=[100_000],
+                        help="Media files in the directory scanned into a catalog")
+    parser.add_argument("--mergeFiles", type=int, nargs="*", default=[1_000], help="Media files to merge end to end")
+    parser.add_argument("--albums", type=int, default=10, help="Album folders the merged files are spread over")
+    parser.add_argument("--mediaBytes", type=int, default=256 * 1024, help="Size of every photo (videos are 4 times bigger)")
+    parser.add_argument("--exiftoolLatency", type=float, default=0.005, help="Seconds the fake exiftool takes per call")
+    parser.add_argument("--jobs", type=int, default=None, help="Passed to merge_metadata")
+    parser.add_argument("--singleWrite", action="store_true", help="Passed to merge_metadata")
+    parser.add_argument("--nativeExif", action="store_true", help="Passed to merge_metadata")
+    parser.add_argument("--nativeVideo", action="store_true", help="Passed to merge_metadata")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file instead of stdout")
+    parser.add_argument("--compare", type=str, default=None, help="Results from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    # exiftool is picked when the project is imported, so this has to come first
+    os.environ["EXIFTOOL"] = FAKE_EXIFTOOL
+    os.environ["FAKE_EXIFTOOL_LATENCY"] = str(args.exiftoolLatency)
+    logging.disable(logging.WARNING)
+
+    options = {"single_write": args.singleWrite, "native_exif": args.nativeExif, "native_video": args.nativeVideo}
+    if args.jobs:
+        options["jobs"] = options["exiftool_procs"] = args.jobs
+    results = {"commit": _git_commit(), "python": platform.python_version(), "cpu_count": os.cpu_count(),
+               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": []}
+    for count in args.matchSizes:
+        results["results"].append(bench_matcher(count))
+        print(json.dumps(results["results"][-1]), file=sys.stderr)
+    for count in args.catalogFiles:
+        results["results"].append(bench_catalog(count))
+        print(json.dumps(results["results"][-1]), file=sys.stderr)
+    for count in args.mergeFiles:
+        results["results"].append(bench_merge(count, args.albums, args.mediaBytes, args.exiftoolLatency, **options))
+        print(json.dumps(results["results"][-1]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}:\n" + "\n".join(regressions), file=sys.stderr)
+            sys.exit(1)
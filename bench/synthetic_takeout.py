@@ -0,0 +1,157 @@
+"""Generate synthetic Google Takeout listings and directories for tests and benchmarks.
+
+The names follow the patterns Takeout produces: `.supplemental-metadata.json` and older `.json`
+sidecars, `(n)` counters, `-edited` copies sharing their original's sidecar, names cut off at 46
+characters, live photos (a HEIC and an MP4 sharing one sidecar) and files saved with the wrong
+extension. Every media name comes with the sidecar it should be matched to.
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+TRUNCATED_LENGTH = 46
+# share of photos generated with each naming pattern
+KINDS = {
+    "plain": 0.45,
+    "legacy": 0.10,
+    "counter": 0.08,
+    "edited": 0.10,
+    "long": 0.05,
+    "live": 0.17,
+    "wrong_extension": 0.05,
+}
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+PLACES = [(40.7128, -74.0060), (48.8566, 2.3522), (35.6762, 139.6503), (-33.8688, 151.2093), (19.4326, -99.1332)]
+
+_JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00"
+_PNG = b"\x89PNG\r\n\x1a\n"
+_HEIC = b"\x00\x00\x00\x18ftypheic\x00\x00\x00\x00mif1heic"
+_MP4 = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00isommp42"
+
+
+def _sidecar_name(media_name: str, counter: str = "", legacy: bool = False) -> str:
+    if legacy:
+        stem = media_name
+    else:
+        stem = (media_name + ".supplemental-metadata")[:TRUNCATED_LENGTH]
+    return f"{stem}{counter}.json"
+
+
+def _photo(i: int, kind: str) -> List[Tuple[str, str, str]]:
+    """Return (media name, sidecar name, content type) for every media file of photo `i`."""
+    name = f"IMG_{i:07d}"
+    if kind == "plain":
+        return [(f"{name}.jpg", _sidecar_name(f"{name}.jpg"), "jpeg")]
+    if kind == "legacy":
+        return [(f"{name}.jpg", _sidecar_name(f"{name}.jpg", legacy=True), "jpeg")]
+    if kind == "counter":
+        return [(f"{name}.jpg", _sidecar_name(f"{name}.jpg"), "jpeg"),
+                (f"{name}(1).jpg", _sidecar_name(f"{name}.jpg", "(1)"), "jpeg")]
+    if kind == "edited":
+        sidecar = _sidecar_name(f"{name}.jpg")
+        return [(f"{name}.jpg", sidecar, "jpeg"), (f"{name}-edited.jpg", sidecar, "jpeg")]
+    if kind == "long":
+        media = f"{i:07d}_Screenshot_20190405-101112_A Really Long App Name.jpg"
+        return [(media, media[:TRUNCATED_LENGTH] + ".json", "png")]
+    if kind == "live":
+        sidecar = _sidecar_name(f"{name}.HEIC")
+        return [(f"{name}.HEIC", sidecar, "heic"), (f"{name}.MP4", sidecar, "mp4")]
+    if kind == "wrong_extension":
+        return [(f"{name}.jpg", _sidecar_name(f"{name}.jpg"), "png")]
+    raise ValueError(f"Unknown kind {kind}")
+
+
+def generate_photos(count: int, seed: int = 0) -> List[Tuple[str, str, str]]:
+    """Return (media name, sidecar name, content type) for about `count` media files in one directory."""
+    rng = random.Random(seed)
+    kinds, weights = list(KINDS), list(KINDS.values())
+    photos = []
+    i = 0
+    while len(photos) < count:
+        photos += _photo(i, rng.choices(kinds, weights)[0])
+        i += 1
+    return photos[:count]
+
+
+def generate_listing(count: int, seed: int = 0) -> Tuple[List[str], Dict[str, str]]:
+    """Return a shuffled directory listing with about `count` media files and their sidecars, and the
+    sidecar every media file should be matched to."""
+    photos = generate_photos(count, seed)
+    expected = {media: sidecar for media, sidecar, _ in photos}
+    listing = list(expected) + sorted(set(expected.values()))
+    random.Random(seed).shuffle(listing)
+    return listing, expected
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _mp4_box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def _content(content_type: str, size: int) -> bytes:
+    """`size` bytes of a file of `content_type`. JPEGs, PNGs and MP4s are laid out like real ones, so
+    their metadata can be written, with zeros for image data."""
+    if content_type == "jpeg":
+        return _JPEG + b"\x00" * max(size - len(_JPEG) - 2, 0) + b"\xff\xd9"
+    if content_type == "png":
+        head = _PNG + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+        tail = _png_chunk(b"IEND", b"")
+        return head + _png_chunk(b"IDAT", b"\x00" * max(size - len(head) - len(tail) - 12, 0)) + tail
+    if content_type == "mp4":
+        mvhd = _mp4_box(b"mvhd", bytes(12) + struct.pack(">II", 1000, 0) + bytes(80))
+        tkhd = _mp4_box(b"tkhd", bytes(84))
+        mdhd = _mp4_box(b"mdhd", bytes(12) + struct.pack(">II", 1000, 0) + bytes(4))
+        head = _MP4 + _mp4_box(b"moov", mvhd + _mp4_box(b"trak", tkhd + _mp4_box(b"mdia", mdhd)))
+        return head + _mp4_box(b"mdat", bytes(max(size - len(head) - 8, 0)))
+    return _HEIC + b"\x00" * max(size - len(_HEIC), 0)
+
+
+def write_takeout(root: str, count: int, albums: int = 1, media_bytes: int = 64 * 1024, seed: int = 0) -> Dict[str, str]:
+    """Write a synthetic Takeout folder with about `count` media files spread over `albums` folders.
+
+    Media files start with the magic bytes of their real type (so wrong extensions are really wrong)
+    and are padded to `media_bytes`, videos to four times that. Sidecars carry timestamps and a location.
+
+    Returns:
+        Dict[str, str]: the sidecar every media file should be matched to, as paths relative to `root`
+    """
+    rng = random.Random(seed)
+    expected = {}
+    photos = generate_photos(count, seed)
+    per_album = -(-len(photos) // albums)
+    for a in range(albums):
+        album = f"Photos from {2000 + a}" if albums > 1 else ""
+        os.makedirs(os.path.join(root, album), exist_ok=True)
+        for media, sidecar, content_type in photos[a * per_album:(a + 1) * per_album]:
+            size = media_bytes * 4 if content_type == "mp4" else media_bytes
+            with open(os.path.join(root, album, media), "wb") as f:
+                f.write(_content(content_type, size))
+            sidecar_path = os.path.join(root, album, sidecar)
+            if not os.path.exists(sidecar_path):
+                latitude, longitude = rng.choice(PLACES) if rng.random() < 0.8 else (0.0, 0.0)
+                taken = rng.randrange(1_200_000_000, 1_700_000_000)
+                with open(sidecar_path, "w") as f:
+                    json.dump({"title": media, "photoTakenTime": {"timestamp": str(taken)},
+                               "creationTime": {"timestamp": str(taken + rng.randrange(0, 86400 * 30))},
+                               "geoData": {"latitude": latitude, "longitude": longitude, "altitude": 0.0}}, f)
+            expected[os.path.join(album, media)] = os.path.join(album, sidecar)
+    return expected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic Google Takeout folder")
+    parser.add_argument("--outputDir", type=str, required=True, help="Directory to write the Takeout folder into")
+    parser.add_argument("--files", type=int, default=1000, help="Number of media files")
+    parser.add_argument("--albums", type=int, default=1, help="Number of album folders to spread them over")
+    parser.add_argument("--mediaBytes", type=int, default=64 * 1024, help="Size of every photo (videos are 4 times bigger)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    expected = write_takeout(args.outputDir, args.files, args.albums, args.mediaBytes, args.seed)
+    print(f"Wrote {len(expected)} media files to {args.outputDir}")
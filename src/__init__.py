@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 ## File extensions
 MEDIA_EXTENSIONS = [".jpg", ".jpeg", ".png", ".heic", ".heif", 
                     ".mp4", ".m4v", ".mov", ".avi", ".mkv", 
@@ -10,4 +13,43 @@ JSON_EXTENSION = ".json" # do not change this
 IN_PKL_NAME = "in.pkl"
 OUT_PKL_NAME = "out.pkl"
 PROPS_JSON_NAME = "props.json"
-LEAVE_TQDM = False
\ No newline at end of file
+LEAVE_TQDM = False
+MATCH_WORKERS = os.cpu_count() or 1 # processes used to match sidecars in recursive mode
+COPY_WORKERS = 2 # threads copying media files into the output dir
+PIPELINE_QUEUE_SIZE = 64 # items waiting in front of each merge stage
+PIPELINE_STOP_TIMEOUT = 5 # seconds stopping a pipeline waits for its input, which may be stuck reading a directory
+COPY_BUFFER_SIZE = 8 * 1024 * 1024 # read size when copying through userspace
+SNIFF_BYTES = 512 # bytes read to recognise a file's real type
+JOURNAL_BATCH_SIZE = 500 # journal state changes written per transaction
+JOURNAL_FLUSH_SECONDS = 2 # longest time a journal state change waits to be written
+SHARD_FILE_OVERHEAD_BYTES = 4 * 1024 * 1024 # bytes a file counts as on top of its size when balancing shards
+SHARD_LEASE_SECONDS = 60 # a shard goes to another worker when its worker is silent this long
+SHARD_HEARTBEAT_SECONDS = 5 # how often a worker renews its shard lease
+SHARD_MAX_ATTEMPTS = 3 # workers a shard may be handed to before it is given up on
+DEDUPE_PARTIAL_BYTES = 64 * 1024 # bytes hashed from each end of a file before hashing all of it
+DEDUPE_CACHE_PATH = os.environ.get("DEDUPE_CACHE", os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                                                                "google-photos-exif-merger", "hashes.sqlite")) # content hashes of input files
+
+## exiftool
+EXIFTOOL_BINARY = os.environ.get("EXIFTOOL", "exiftool") # override to use a different exiftool build
+EXIFTOOL_POOL_SIZE = min(4, os.cpu_count() or 1) # number of stay_open exiftool processes
+EXIFTOOL_TIMEOUT = 600 # seconds one exiftool command may take before its worker is killed and restarted
+VERIFY_BATCH_SIZE = 1000 # files whose tags are read back per exiftool command when verifying
+
+## timezones
+# timezone boundaries from https://github.com/evansiroky/timezone-boundary-builder/releases
+TZ_DATA_PATH = os.environ.get("TZ_DATA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "timezones-with-oceans.geojson.zip"))
+TZ_CELL_DEGREES = 1.0 # size of the grid cells the boundaries are indexed into
+TZ_LOOKUP_CACHE_SIZE = 65536 # coordinates whose timezone is remembered
+
+## web
+WEB_MAX_JOBS = 1 # jobs running at the same time, the rest wait in the queue
+WEB_JOB_HISTORY = 50 # finished jobs kept for the job list
+WEB_JOB_LOG_LINES = 5000 # log lines kept in memory per job, all of them are in its log file
+WEB_LOG_DIR = os.environ.get("WEB_LOG_DIR", os.path.join(tempfile.gettempdir(), "google-photos-exif-merger-logs")) # job log files
+WEB_FLUSH_SECONDS = 0.25 # logs and progress are sent to the browser in batches this often
+WEB_LOG_BATCH = 500 # log lines that are sent early as a batch
+WEB_BROWSE_PAGE_SIZE = 200 # directory entries per page of the directory picker
+WEB_BROWSE_CACHE_SIZE = 64 # directory listings kept for the directory picker
+WEB_POLL_SECONDS = 0.1 # how often job workers are checked for progress, logs and exits
+WEB_METRICS_SECONDS = 2 # how often a job worker sends its metrics to the web app
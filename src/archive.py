@@ -0,0 +1,219 @@
+import logging
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple
+from catalog import FileCatalog, MEDIA, extension_class
+from filetype import sniff_bytes
+from __init__ import COPY_BUFFER_SIZE, SNIFF_BYTES
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = (".zip", ".tgz", ".tar.gz", ".tar")
+_PART = re.compile(r"^(?P<prefix>.+)-(?P<part>\d{3})(?P<extension>\.zip|\.tgz|\.tar\.gz|\.tar)$", re.IGNORECASE)
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _unsafe_name(name: str) -> bool:
+    """Whether a member name is absolute or climbs out of the directory it is extracted to."""
+    normalized = name.replace("\\", "/")
+    return normalized.startswith("/") or re.match(r"^[A-Za-z]:", normalized) is not None or ".." in normalized.split("/")
+
+
+def archive_parts(path: str) -> List[str]:
+    """Every part of the multi-part Takeout export `path` belongs to (`takeout-...-001.zip` to `-0NN.zip`),
+    in order, or just `path` when it isn't named like a part."""
+    match = _PART.match(os.path.basename(path))
+    if match is None:
+        return [path]
+    directory = os.path.dirname(path)
+    parts = []
+    for name in os.listdir(directory or "."):
+        other = _PART.match(name)
+        if other and other["prefix"] == match["prefix"] and other["extension"].lower() == match["extension"].lower():
+            parts.append((int(other["part"]), os.path.join(directory, name)))
+    return [part for _, part in sorted(parts)]
+
+
+@dataclass(slots=True)
+class Member:
+    """A file inside one part of an archive."""
+    part: int  # index into the archive's parts
+    position: int  # order in its part
+    size: int
+    mtime_ns: int
+
+
+class TakeoutArchive(ABC):
+    """
+    The files of a Takeout export in one or more archive parts, read without extracting them to disk
+    first. Parts are indexed when the archive is opened, and a media file and its sidecar may be in
+    different parts.
+
+    Members are read through fixed-size buffers, so memory doesn't depend on how big a video is.
+    Subclasses implement `read`, `file_type` and `extract` for their kind of part.
+    """
+
+    sequential = False  # whether members are read in one pass over the parts, with `stream`
+
+    def __init__(self, parts: List[str]):
+        self.parts = parts
+        self.members: Dict[str, Member] = {}
+
+    def catalogs(self) -> Iterator[Tuple[str, FileCatalog]]:
+        """Yield (directory inside the archive, catalog of its files) for every directory with files in it."""
+        directories = defaultdict(list)
+        for name in self.members:
+            directories[os.path.dirname(name)].append(name)
+        for directory in sorted(directories):
+            catalog = FileCatalog(directory)
+            for name in directories[directory]:
+                member = self.members[name]
+                catalog.add(os.path.basename(name), extension_class(name), member.size, member.mtime_ns)
+            yield directory, catalog
+
+    def order(self, name: str) -> Tuple[int, int]:
+        member = self.members[name]
+        return member.part, member.position
+
+    @abstractmethod
+    def read(self, name: str) -> bytes:
+        """The contents of a small member, such as a sidecar."""
+
+    @abstractmethod
+    def file_type(self, name: str) -> str:
+        """The type of a media member, recognised from its first bytes."""
+
+    @abstractmethod
+    def extract(self, name: str, dst: str) -> int:
+        """Write a member to `dst` and return its size."""
+
+    def close(self):
+        pass
+
+
+class ZipTakeoutArchive(TakeoutArchive):
+    """Zip parts, indexed from their central directories without reading any member."""
+
+    def __init__(self, parts: List[str]):
+        super().__init__(parts)
+        self._zips = [zipfile.ZipFile(part) for part in parts]  # reading members from several threads is safe
+        for index, archive in enumerate(self._zips):
+            for position, info in enumerate(archive.infolist()):
+                if not info.is_dir() and _unsafe_name(info.filename):
+                    logger.warning(f"Skipping {info.filename} in {parts[index]}, its path leads outside the output directory")
+                elif not info.is_dir():
+                    mtime_ns = int(time.mktime(info.date_time + (0, 0, -1)) * 1_000_000_000)
+                    self.members[info.filename] = Member(index, position, info.file_size, mtime_ns)
+
+    def _open(self, name: str):
+        return self._zips[self.members[name].part].open(name)
+
+    def read(self, name: str) -> bytes:
+        with self._open(name) as f:
+            return f.read()
+
+    def file_type(self, name: str) -> str:
+        with self._open(name) as f:
+            return sniff_bytes(f.read(SNIFF_BYTES))
+
+    def extract(self, name: str, dst: str) -> int:
+        with self._open(name) as fsrc, open(dst, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+        return self.members[name].size
+
+    def close(self):
+        for archive in self._zips:
+            archive.close()
+
+
+class TarTakeoutArchive(TakeoutArchive):
+    """
+    Tar parts, plain or gzipped. A tar has no central directory, so opening it streams every part once
+    to list its members, without keeping any of their contents. `stream` then reads the members in
+    archive order in a second pass, which is how the merge extracts them. `read` and `extract` still
+    get at a single member, by streaming its part up to it.
+    """
+
+    sequential = True
+
+    def __init__(self, parts: List[str]):
+        super().__init__(parts)
+        self._lock = threading.Lock()
+        self._stream = None  # [part index, open tarfile, members read from it so far]
+        for index, part in enumerate(parts):
+            with tarfile.open(part, "r|*") as archive:
+                for position, info in enumerate(archive):
+                    if not info.isfile():
+                        continue
+                    if _unsafe_name(info.name):
+                        logger.warning(f"Skipping {info.name} in {part}, its path leads outside the output directory")
+                        continue
+                    self.members[info.name] = Member(index, position, info.size, int(info.mtime * 1_000_000_000))
+            logger.info(f"Indexed {part}")
+
+    def stream(self) -> Iterator[Tuple[str, BinaryIO]]:
+        """Yield (name, open member) for every member, part by part in archive order. A member can only
+        be read until the next one is asked for."""
+        for index, part in enumerate(self.parts):
+            with tarfile.open(part, "r|*") as archive:
+                for position, info in enumerate(archive):
+                    member = self.members.get(info.name)
+                    if member is not None and (member.part, member.position) == (index, position):
+                        with archive.extractfile(info) as f:
+                            yield info.name, f
+
+    def _with_member(self, name: str, func: Callable[[BinaryIO], object]):
+        member = self.members[name]
+        with self._lock:
+            if self._stream is None or self._stream[0] != member.part or self._stream[2] > member.position:
+                if self._stream is not None:
+                    if self._stream[0] == member.part:
+                        logger.debug(f"Reading {self.parts[member.part]} again for {name}, it was asked for out of order")
+                    self._stream[1].close()
+                self._stream = [member.part, tarfile.open(self.parts[member.part], "r|*"), 0]
+            stream = self._stream
+            while (info := stream[1].next()) is not None:
+                stream[2] += 1
+                if stream[2] - 1 == member.position:
+                    with stream[1].extractfile(info) as f:
+                        return func(f)
+        raise KeyError(name)
+
+    def read(self, name: str) -> bytes:
+        return self._with_member(name, lambda f: f.read())
+
+    def file_type(self, name: str) -> str:
+        return self._with_member(name, lambda f: sniff_bytes(f.read(SNIFF_BYTES)))
+
+    def extract(self, name: str, dst: str) -> int:
+        def copy(fsrc: BinaryIO) -> int:
+            with open(dst, "wb") as fdst:
+                shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+            return self.members[name].size
+        return self._with_member(name, copy)
+
+    def close(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream[1].close()
+                self._stream = None
+
+
+def open_archive(path: str) -> TakeoutArchive:
+    """Open the Takeout export `path` is (a part of)."""
+    parts = archive_parts(path)
+    logger.info(f"Reading {len(parts)} archive part{'s' if len(parts) != 1 else ''}: {', '.join(os.path.basename(part) for part in parts)}")
+    if path.lower().endswith(".zip"):
+        return ZipTakeoutArchive(parts)
+    return TarTakeoutArchive(parts)
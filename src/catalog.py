@@ -0,0 +1,187 @@
+import logging
+import os
+from array import array
+from bisect import bisect_left
+from typing import Iterator, List, Tuple
+from __init__ import JSON_EXTENSION, MEDIA_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# extension classes
+MEDIA = 0
+SIDECAR = 1
+OTHER = 2
+
+_MEDIA_EXTENSIONS = frozenset(MEDIA_EXTENSIONS)
+_CHUNK_NAMES = 4096  # names collected before they are joined onto the string table
+
+
+def extension_class(name: str) -> int:
+    extension = os.path.splitext(name)[1].lower()
+    if extension in _MEDIA_EXTENSIONS:
+        return MEDIA
+    return SIDECAR if extension == JSON_EXTENSION else OTHER
+
+
+class FileCatalog:
+    """
+    The files of one directory, from a single `os.scandir` pass.
+
+    Names are kept in listing order in one string table (all names joined, with an array of offsets),
+    next to array-backed columns for the extension class and, for media files, the size, mtime and
+    inode from one stat each. A file takes the length of its name plus 29 bytes, instead of a string
+    object, a tuple and boxed ints. Sidecars and other files aren't stat'ed, `os.scandir` already
+    knows they are files.
+
+    Everything after the scan (matching, checking that matched files exist, sizing the work for the
+    progress and ETA, and the copy) reads from the catalog instead of going back to the filesystem.
+    Catalogs pickle compactly, so they are what recursive matching hands to its worker processes.
+    """
+
+    __slots__ = ("directory", "device", "kinds", "sizes", "mtimes", "inodes", "_table", "_offsets", "_length",
+                 "_pending", "_chunks", "_order")
+
+    def __init__(self, directory: str, device: int = 0):
+        self.directory = directory
+        self.device = device  # of the directory, which its files share
+        self.kinds = array("B")
+        self.sizes = array("q")
+        self.mtimes = array("q")
+        self.inodes = array("Q")
+        self._table = ""
+        self._offsets = array("Q")  # where each name starts in the table
+        self._length = 0  # of the table, once everything pending is joined onto it
+        self._pending: List[str] = []  # names not joined yet
+        self._chunks: List[str] = []  # joined pending names not on the table yet
+        self._order = None  # positions sorted by name, built on the first lookup
+
+    def __getstate__(self):
+        self._compact()
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != "_order"}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._order = None
+
+    @classmethod
+    def scan(cls, directory: str) -> Tuple["FileCatalog", List[str]]:
+        """List `directory` in one pass.
+
+        Returns:
+            Tuple[FileCatalog, List[str]]: the catalog of its files, and the names of its subdirectories
+
+        Raises:
+            OSError: If the directory can't be listed
+        """
+        catalog = cls(directory, os.stat(directory).st_dev)
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    kind = extension_class(entry.name)
+                    stat = entry.stat() if kind == MEDIA else None
+                except OSError as e:
+                    logger.warning(f"Couldn't read '{entry.path}': {e}")
+                    continue
+                catalog.add(entry.name, kind, stat.st_size if stat else 0, stat.st_mtime_ns if stat else 0,
+                            stat.st_ino if stat else 0)
+        return catalog, subdirs
+
+    @classmethod
+    def from_names(cls, directory: str, names: List[str]) -> "FileCatalog":
+        """A catalog of names only, without sizes, for listings that didn't come from the filesystem."""
+        catalog = cls(directory)
+        for name in names:
+            catalog.add(name, extension_class(name))
+        return catalog
+
+    def add(self, name: str, kind: int, size: int = 0, mtime_ns: int = 0, inode: int = 0):
+        self._pending.append(name)
+        if len(self._pending) >= _CHUNK_NAMES:
+            self._chunks.append("".join(self._pending))
+            self._pending.clear()
+        self._offsets.append(self._length)
+        self._length += len(name)
+        self.kinds.append(kind)
+        self.sizes.append(size)
+        self.mtimes.append(mtime_ns)
+        self.inodes.append(inode)
+        self._order = None
+
+    def _compact(self):
+        if self._pending or self._chunks:
+            self._table = "".join([self._table, *self._chunks, "".join(self._pending)])
+            self._chunks.clear()
+            self._pending.clear()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def name(self, i: int) -> str:
+        self._compact()
+        end = self._offsets[i + 1] if i + 1 < len(self._offsets) else self._length
+        return self._table[self._offsets[i]:end]
+
+    @property
+    def names(self) -> List[str]:
+        """Every name, in listing order."""
+        return [self.name(i) for i in range(len(self))]
+
+    def find(self, name: str) -> int:
+        """Return the position of `name`, or -1."""
+        if self._order is None:
+            self._order = array("I", sorted(range(len(self)), key=self.name))
+        i = bisect_left(self._order, name, key=self.name)
+        if i < len(self._order) and self.name(self._order[i]) == name:
+            return self._order[i]
+        return -1
+
+    def __contains__(self, name: str) -> bool:
+        return self.find(name) >= 0
+
+    def stat(self, name: str) -> Tuple[int, int, int]:
+        """Return (size, mtime_ns, inode) of a media file, as seen by the scan.
+
+        Raises:
+            KeyError: If there is no such file
+        """
+        i = self.find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self.sizes[i], self.mtimes[i], self.inodes[i]
+
+    def names_of(self, kind: int) -> List[str]:
+        """Names of one extension class, in listing order."""
+        return [self.name(i) for i, k in enumerate(self.kinds) if k == kind]
+
+    def total_bytes(self) -> int:
+        """Bytes of all the media files."""
+        return sum(self.sizes)
+
+
+def walk_catalogs(directory: str) -> Iterator[Tuple[str, FileCatalog]]:
+    """
+    Walk a directory tree with os.scandir, one directory at a time.
+
+    Args:
+        directory (str): Root of the tree
+
+    Yields:
+        Tuple[str, FileCatalog]: (directory relative to the root, catalog of the files in it)
+    """
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        try:
+            catalog, subdirs = FileCatalog.scan(os.path.join(directory, relative_dir))
+        except OSError as e:
+            logger.warning(f"Couldn't list '{os.path.join(directory, relative_dir)}': {e}")
+            continue
+        yield relative_dir, catalog
+        pending.extend(os.path.join(relative_dir, name) for name in sorted(subdirs, reverse=True))
@@ -0,0 +1,245 @@
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from metrics import REGISTRY
+from __init__ import COPY_BUFFER_SIZE
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409  # linux/fs.h, _IOW(0x94, 9, int)
+
+REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+SENDFILE = "sendfile"
+BUFFERED = "buffered"
+HARDLINK = "hardlink"
+COPY_MODES = ["auto", REFLINK, "kernel", BUFFERED]
+
+# errors that mean "this strategy doesn't work between these two filesystems", not "the copy failed"
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                       errno.EBADF, errno.EPERM, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)}
+
+
+class UnsupportedStrategy(OSError):
+    """A copy strategy can't be used for this source/destination pair."""
+
+
+@dataclass(slots=True)
+class CopyResult:
+    strategy: str
+    bytes_copied: int
+    checksum: str = None
+
+
+def _unlink_destination(src: str, dst: str):
+    """Remove `dst` so it can be written afresh. Opening it for writing in place would truncate `src`
+    too when `dst` is a hardlink of it, as `--hardlinkUnchanged` and `--dedupe hardlink` leave behind.
+
+    Raises:
+        shutil.SameFileError: If `dst` is the path of `src` itself
+    """
+    if not os.path.lexists(dst):
+        return
+    if os.path.realpath(src) == os.path.realpath(dst):
+        raise shutil.SameFileError(f"{src} and {dst} are the same file")
+    os.remove(dst)
+
+
+class CopyEngine:
+    """
+    Copy files with the fastest strategy that works between two devices.
+
+    In "auto" mode the strategies are tried from cheapest to most expensive: a FICLONE reflink
+    (btrfs, XFS), a kernel-side `os.copy_file_range`, `os.sendfile`, and finally a large-buffer
+    read/write loop. The first one that works is remembered for that (source device, destination
+    device) pair. When a checksum is requested the buffered loop is used, since it is the only one that
+    sees the bytes and can hash them without a second read of the source.
+
+    Files that won't be modified after copying can be hardlinked instead when `hardlink_unchanged` is set.
+    """
+
+    def __init__(self, mode: str = "auto", checksum: str = None, hardlink_unchanged: bool = False,
+                 buffer_size: int = COPY_BUFFER_SIZE):
+        if mode not in COPY_MODES:
+            raise ValueError(f"Unknown copy mode {mode!r}, expected one of {COPY_MODES}")
+        self.mode = mode
+        self.checksum = checksum
+        self.hardlink_unchanged = hardlink_unchanged
+        self.buffer_size = buffer_size
+        self.strategy_counts = Counter()
+        self._pair_strategies: Dict[Tuple[int, int], str] = {}
+        self._dir_devices: Dict[str, int] = {}  # output directories are few, and don't move between devices
+        self._lock = threading.Lock()
+
+    def _candidates(self) -> List[str]:
+        if self.checksum:
+            return [BUFFERED]
+        if self.mode == REFLINK:
+            return [REFLINK]
+        if self.mode == "kernel":
+            return [COPY_FILE_RANGE, SENDFILE]
+        if self.mode == BUFFERED:
+            return [BUFFERED]
+        return [REFLINK, COPY_FILE_RANGE, SENDFILE, BUFFERED]
+
+    def copy(self, src: str, dst: str, modified: bool = True, src_dev: int = None) -> CopyResult:
+        """Copy `src` to `dst`, replacing `dst`, and copy the permission bits like `shutil.copy`.
+        An existing `dst` is removed first rather than written over, so a hardlink of `src` left there
+        by an earlier run doesn't take the source with it.
+
+        Args:
+            src: File to copy
+            dst: Destination file path
+            modified: Whether `dst` will be changed after the copy. Unchanged files may be hardlinked
+            src_dev: Device of `src` if the caller already knows it, saving a stat
+
+        Returns:
+            CopyResult: the strategy used, the bytes copied and the checksum if one was requested
+        """
+        _unlink_destination(src, dst)
+        if not modified and self.hardlink_unchanged and not self.checksum:
+            try:
+                os.link(src, dst)
+                return self._record(CopyResult(HARDLINK, 0))
+            except OSError as e:
+                logger.debug(f"Couldn't hardlink {src} -> {dst} ({e}), copying instead")
+
+        if src_dev is None:
+            src_dev = os.stat(src).st_dev
+        dst_dir = os.path.dirname(os.path.abspath(dst))
+        dst_dev = self._dir_devices.get(dst_dir)
+        if dst_dev is None:
+            dst_dev = self._dir_devices[dst_dir] = os.stat(dst_dir).st_dev
+        pair = (src_dev, dst_dev)
+        candidates = self._candidates()
+        known = self._pair_strategies.get(pair)
+        if known in candidates:
+            candidates = candidates[candidates.index(known):]
+
+        for strategy in candidates:
+            try:
+                result = self._copy_with(strategy, src, dst)
+            except UnsupportedStrategy as e:
+                logger.debug(f"{strategy} isn't available from device {src_dev} to {dst_dev}: {e}")
+                continue
+            if self._pair_strategies.get(pair) != strategy:
+                self._pair_strategies[pair] = strategy
+                logger.debug(f"Copying from device {src_dev} to {dst_dev} with {strategy}")
+            shutil.copymode(src, dst)
+            return self._record(result)
+        raise OSError(f"No copy strategy in {self._candidates()} works for {src} -> {dst}")
+
+    def clone(self, src: str, dst: str, strategy: str = HARDLINK) -> CopyResult:
+        """Make `dst` a hardlink or a reflink of `src`, replacing `dst`. Falls back to `copy` where the
+        filesystem can't do either.
+
+        Args:
+            src: File to clone
+            dst: Destination file path
+            strategy: HARDLINK or REFLINK
+
+        Raises:
+            shutil.SameFileError: If `dst` is the path of `src` itself
+        """
+        _unlink_destination(src, dst)
+        try:
+            if strategy == HARDLINK:
+                os.link(src, dst)
+                return self._record(CopyResult(HARDLINK, 0))
+            result = self._copy_with(REFLINK, src, dst)
+            shutil.copymode(src, dst)
+            return self._record(result)
+        except OSError as e:
+            logger.debug(f"Couldn't {strategy} {src} -> {dst} ({e}), copying instead")
+        return self.copy(src, dst, modified=False)
+
+    def _record(self, result: CopyResult) -> CopyResult:
+        with self._lock:
+            self.strategy_counts[result.strategy] += 1
+        REGISTRY.inc("copied_bytes_total", result.bytes_copied, strategy=result.strategy)
+        return result
+
+    def _copy_with(self, strategy: str, src: str, dst: str) -> CopyResult:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                if strategy == REFLINK:
+                    return self._reflink(fsrc, fdst)
+                if strategy == COPY_FILE_RANGE:
+                    return self._copy_file_range(fsrc, fdst)
+                if strategy == SENDFILE:
+                    return self._sendfile(fsrc, fdst)
+                return self._buffered(fsrc, fdst)
+            except UnsupportedStrategy:
+                fdst.truncate(0)
+                raise
+
+    def _reflink(self, fsrc, fdst) -> CopyResult:
+        if fcntl is None:
+            raise UnsupportedStrategy("no fcntl")
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as e:
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                raise UnsupportedStrategy(e.errno, str(e))
+            raise
+        return CopyResult(REFLINK, os.fstat(fsrc.fileno()).st_size)
+
+    def _copy_file_range(self, fsrc, fdst) -> CopyResult:
+        if not hasattr(os, "copy_file_range"):
+            raise UnsupportedStrategy("os.copy_file_range isn't available")
+        return CopyResult(COPY_FILE_RANGE, self._kernel_loop(
+            lambda count: os.copy_file_range(fsrc.fileno(), fdst.fileno(), count), fsrc))
+
+    def _sendfile(self, fsrc, fdst) -> CopyResult:
+        if not hasattr(os, "sendfile"):
+            raise UnsupportedStrategy("os.sendfile isn't available")
+        offset = [0]
+        def send(count):
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset[0], count)
+            offset[0] += sent
+            return sent
+        return CopyResult(SENDFILE, self._kernel_loop(send, fsrc))
+
+    def _kernel_loop(self, copy_chunk, fsrc) -> int:
+        total = 0
+        size = os.fstat(fsrc.fileno()).st_size
+        while True:  # copy_file_range and sendfile may stop short, so loop until EOF
+            try:
+                copied = copy_chunk(1 << 30)
+            except OSError as e:
+                if total == 0 and e.errno in _UNSUPPORTED_ERRNOS:
+                    raise UnsupportedStrategy(e.errno, str(e))
+                raise
+            if copied == 0:
+                if total == 0 and size > 0:
+                    # some filesystems (procfs, some FUSE mounts) report success but copy nothing
+                    raise UnsupportedStrategy("copied 0 bytes")
+                return total
+            total += copied
+
+    def _buffered(self, fsrc, fdst) -> CopyResult:
+        digest = hashlib.new(self.checksum) if self.checksum else None
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        total = 0
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                break
+            chunk = view[:n]
+            if digest is not None:
+                digest.update(chunk)
+            fdst.write(chunk)
+            total += n
+        return CopyResult(BUFFERED, total, digest.hexdigest() if digest is not None else None)
@@ -0,0 +1,247 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from copy_engine import CopyEngine, HARDLINK, REFLINK
+from metrics import REGISTRY
+from pipeline import MergeItem
+from util import _hash_ends
+from __init__ import COPY_BUFFER_SIZE, DEDUPE_CACHE_PATH, DEDUPE_PARTIAL_BYTES, JOURNAL_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+SKIP = "skip"
+DEDUPE_POLICIES = [HARDLINK, REFLINK, SKIP]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,  -- absolute path of the source file
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial TEXT,
+    full TEXT
+)
+"""
+_UPSERT = """
+INSERT INTO hashes (path, size, mtime_ns, partial, full) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(path) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, partial=excluded.partial, full=excluded.full
+"""
+
+
+def partial_hash(path: str, size: int, block: int = DEDUPE_PARTIAL_BYTES) -> str:
+    """Hash of the first and last `block` bytes of a file, which tells apart almost all files of the same size."""
+    REGISTRY.inc("dedupe_hashed_bytes_total", min(size, 2 * block), kind="partial")
+    return _hash_ends(path, size, block)
+
+
+def full_hash(path: str, buffer_size: int = COPY_BUFFER_SIZE) -> str:
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    total = 0
+    with open(path, "rb") as f:
+        while n := f.readinto(buffer):
+            digest.update(view[:n])
+            total += n
+    REGISTRY.inc("dedupe_hashed_bytes_total", total, kind="full")
+    return digest.hexdigest()
+
+
+class HashCache:
+    """
+    Content hashes of input files, kept across runs in SQLite and keyed by absolute path. An entry is
+    only used while the file's size and mtime are the ones it was hashed at, so a rerun over the same
+    Takeout doesn't read anything again, and a changed file is hashed afresh.
+    """
+
+    def __init__(self, path: str = DEDUPE_CACHE_PATH, batch_size: int = JOURNAL_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(_SCHEMA)
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def get(self, path: str, size: int, mtime_ns: int) -> Tuple[str, str]:
+        """Return the cached (partial, full) hashes of `path`, None for the ones that aren't known."""
+        with self._lock:
+            row = self._connection.execute("SELECT size, mtime_ns, partial, full FROM hashes WHERE path = ?",
+                                           (os.path.abspath(path),)).fetchone()
+        if row is None or row[:2] != (size, mtime_ns):
+            return None, None
+        REGISTRY.inc("dedupe_cache_hits_total")
+        return row[2], row[3]
+
+    def put(self, path: str, size: int, mtime_ns: int, partial: str, full: str = None):
+        with self._lock:
+            self._pending.append((os.path.abspath(path), size, mtime_ns, partial, full))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.executemany(_UPSERT, pending)
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._connection is None:
+                return
+            self._flush()
+            self._connection.close()
+            self._connection = None
+
+
+@dataclass(slots=True)
+class Content:
+    """File contents seen during a run, and what became of the first file that had them."""
+    file: str  # the first file, relative to the input dir
+    path: str
+    size: int
+    mtime_ns: int
+    device: int = None
+    inode: int = 0
+    tags: dict = None  # parsed from the first file's sidecar
+    partial: str = None
+    full: str = None
+    output: str = None  # where the first file was written
+    done: bool = False
+    failed: bool = False
+
+
+class Deduplicator:
+    """
+    Process every distinct content once. Takeout puts a photo into its "Photos from" folder and into
+    every album it is in, so the same bytes show up many times.
+
+    Only files whose sidecars give the same tags count as duplicates: a copy in an album can come with
+    a sidecar of its own, with other dates, and is then copied and tagged like any other file. Files
+    are compared by size first, which rules out almost everything without reading a byte, then by a
+    hash of their first and last blocks, and only then by a hash of the whole file. Files that are
+    hardlinks of each other in the input are duplicates without reading them at all. Hashes are kept
+    in a `HashCache`, so later runs don't read them again.
+
+    The first file with some content goes through the pipeline as usual. `mark` runs as a stage of its
+    own once the sidecar is parsed, so files are hashed by a worker rather than while the input is
+    listed. It flags the later ones so the remaining stages pass them through untouched, and once the
+    first one is done `resolve` makes them hardlinks or reflinks of its output, or skips them,
+    depending on `policy`. The choices end up in `decisions` for the run report.
+    """
+
+    def __init__(self, policy: str, copier: CopyEngine, cache: HashCache = None, dryRun: bool = False):
+        if policy not in DEDUPE_POLICIES:
+            raise ValueError(f"Unknown dedupe policy {policy!r}, expected one of {DEDUPE_POLICIES}")
+        self.policy = policy
+        self.copier = copier
+        self.cache = cache
+        self.dryRun = dryRun
+        self.decisions: Dict[str, str] = {}  # duplicate -> first file with the same contents
+        self.saved_bytes = 0
+        self._by_size: Dict[int, List[Content]] = {}
+        self._waiting: Dict[int, List[MergeItem]] = {}  # duplicates by id() of the content they wait on
+
+    def mark(self, item: MergeItem):
+        """Record the contents of `item`, or mark it as a duplicate of an earlier item with the same tags."""
+        content = Content(item.file, item.input_file, item.size, item.mtime_ns, item.device, item.inode, item.exif_data)
+        candidates = self._by_size.setdefault(item.size, [])
+        for earlier in candidates:
+            if earlier.tags != content.tags:
+                continue
+            try:
+                same = self._same(earlier, content)
+            except OSError as e:
+                logger.warning(f"Couldn't compare {item.file} with {earlier.file}: {e}")
+                break
+            if same:
+                logger.debug(f"{item.file} has the same contents as {earlier.file}")
+                item.duplicate_of = earlier
+                return
+        candidates.append(content)
+        item.content = content
+
+    def resolve(self, item: MergeItem) -> List[MergeItem]:
+        """Take an item that left the pipeline and return the items that are now finished: the item
+        itself, unless it is a duplicate whose first file isn't done yet, and any duplicates that
+        were waiting on it.
+        """
+        if item.duplicate_of is None:
+            content = item.content
+            if content is None:
+                return [item]
+            content.done, content.failed, content.output = True, item.error is not None, item.output_file
+            return [item] + [self._apply(duplicate) for duplicate in self._waiting.pop(id(content), [])]
+        if item.error is not None:
+            return [item]
+        if not item.duplicate_of.done:
+            self._waiting.setdefault(id(item.duplicate_of), []).append(item)
+            return []
+        return [self._apply(item)]
+
+    def _same(self, a: Content, b: Content) -> bool:
+        if a.inode and a.inode == b.inode and a.device == b.device:
+            return True  # hardlinks of each other already
+        if self._hash(a, full=False) != self._hash(b, full=False):
+            return False
+        return self._hash(a, full=True) == self._hash(b, full=True)
+
+    def _hash(self, content: Content, full: bool) -> str:
+        if content.partial is None and self.cache is not None:
+            content.partial, content.full = self.cache.get(content.path, content.size, content.mtime_ns)
+        known = content.full if full else content.partial
+        if known is not None:
+            return known
+        if content.partial is None:
+            content.partial = partial_hash(content.path, content.size)
+        if full:
+            content.full = full_hash(content.path)
+        if self.cache is not None:
+            self.cache.put(content.path, content.size, content.mtime_ns, content.partial, content.full)
+        return content.full if full else content.partial
+
+    def _apply(self, item: MergeItem) -> MergeItem:
+        content = item.duplicate_of
+        if content.failed:
+            item.error = RuntimeError(f"Duplicate of {content.file}, which failed")
+            item.stage = "dedupe"
+            return item
+        # the first file may have been written with a corrected extension
+        item.output_file = os.path.splitext(item.output_file)[0] + os.path.splitext(content.output)[1]
+        saved = True
+        if self.policy == SKIP:
+            logger.info(f"Skipped {item.file}, a duplicate of {content.file}")
+            item.output_file = content.output
+        elif self.dryRun:
+            logger.info(f"Would have made {item.output_file} a {self.policy} of {content.output}")
+        else:
+            try:
+                result = self.copier.clone(content.output, item.output_file, self.policy)
+            except OSError as e:
+                item.error, item.stage = e, "dedupe"
+                return item
+            item.copy_strategy = result.strategy
+            item.bytes_written += result.bytes_copied
+            saved = result.strategy in (HARDLINK, REFLINK)  # not when it had to be copied after all
+            logger.info(f"Made {item.output_file} a {result.strategy} of {content.output}, a duplicate of {content.file}")
+        self.decisions[item.file] = content.file
+        REGISTRY.inc("dedupe_files_total", policy=self.policy)
+        if saved:
+            self.saved_bytes += item.size
+            REGISTRY.inc("dedupe_saved_bytes_total", item.size)
+        return item
+
+    def report(self) -> dict:
+        return {"policy": self.policy, "duplicates": len(self.decisions), "saved_bytes": self.saved_bytes,
+                "decisions": self.decisions}
@@ -2,18 +2,47 @@ import subprocess
 import os
 import json
 from datetime import datetime, timezone, timedelta
-from util import run_command, is_dst
+from typing import List
+from timezones import TimezoneResolver, format_offset, local_time
+from exiftool_pool import ExifToolPool
+from metrics import REGISTRY
+from __init__ import EXIFTOOL_BINARY
 import dateutil
 import pdb
 import logging
 import traceback
 logger = logging.getLogger(__name__)
 
-def read_exif_data_on_file(file_path:str) -> dict:
+def _run_exiftool(args: List[str], pool: ExifToolPool = None, verbose: bool = False):
+    """Run exiftool with an argument list, through `pool` when one is given.
+
+    Arguments that the stay_open argfile can't carry (like names with newlines)
+    fall back to a one-off exiftool process. Neither path goes through a shell.
+
+    Returns:
+        Tuple[str, str, int]: stdout, stderr, return code
+    """
+    if pool is not None:
+        try:
+            with REGISTRY.timer("exiftool_seconds", mode="pool"):
+                result = pool.execute(args, verbose=verbose)
+            REGISTRY.inc("exiftool_calls_total", mode="pool")
+            return result
+        except ValueError:
+            logger.debug(f"Falling back to a one-off exiftool process for {args}")
+    if verbose:
+        logger.info(f"Running exiftool command: {args}")
+    with REGISTRY.timer("exiftool_seconds", mode="process"):
+        result = subprocess.run([EXIFTOOL_BINARY, *args], capture_output=True, text=True)
+    REGISTRY.inc("exiftool_calls_total", mode="process")
+    return result.stdout, result.stderr, result.returncode
+
+def read_exif_data_on_file(file_path:str, pool: ExifToolPool = None) -> dict:
     """Use EXIFTOOL to load a file and return the exif data
 
     Args:
-        file_or_directory (str): _description_
+        file_path (str): file to read
+        pool (ExifToolPool, optional): exiftool workers to run on
 
     Returns:
         dict: {
@@ -27,8 +56,7 @@ def read_exif_data_on_file(file_path:str) -> dict:
             ...
         }
     """
-    command = f"exiftool -a -u -g1 -j {repr(file_path)}"
-    out, err, rc = run_command(command)
+    out, err, rc = _run_exiftool(["-a", "-u", "-g1", "-j", file_path], pool)
     if rc==0:
         parsed = json.loads(out)
         return parsed[0]
@@ -36,12 +64,25 @@ def read_exif_data_on_file(file_path:str) -> dict:
     logger.error(f"Couldn't read exif data for {file_path}: {err}")
     return {}
 
-def parse_exif_data_from_sidecar(supplemental:dict) -> dict:
+def _sidecar_coordinates(supplemental: dict):
+    """Return (latitude, longitude) from a sidecar's geoData, falling back to geoDataExif.
+
+    Google writes 0.0, 0.0 when a photo has no location, so that counts as missing.
+    """
+    for key in ("geoData", "geoDataExif"):
+        geo = supplemental.get(key) or {}
+        latitude, longitude = geo.get("latitude", 0.0), geo.get("longitude", 0.0)
+        if latitude != 0.0 or longitude != 0.0:
+            return latitude, longitude
+    return None
+
+def parse_exif_data_from_sidecar(supplemental:dict, timezones: TimezoneResolver = None) -> dict:
     """Parse the sidecar file and return the exif data
 
     Args:
-        original_metadata (dict): BIG file from exiftool
         supplemental (dict): contains title, creationTime, photoTakenTime, geoData
+        timezones (TimezoneResolver, optional): finds the timezone at the sidecar's location.
+            Without it, or without a location, times are written in UTC
 
     Returns:
         dict: updated data
@@ -52,27 +93,26 @@ def parse_exif_data_from_sidecar(supplemental:dict) -> dict:
         print(supplemental)
         return {}
     
-    # load creationTime and photoTakenTime
-    creationTime = datetime.fromtimestamp(int(supplemental["creationTime"]["timestamp"])).replace(tzinfo=timezone.utc)
-    dateTimeOriginal = datetime.fromtimestamp(int(supplemental["photoTakenTime"]["timestamp"])).replace(tzinfo=timezone.utc)
-    
-    # Set offset
-    offset_hours = 0
-    if is_dst(dateTimeOriginal) and offset_hours != 0:
-        offset_hours -= 1
-    timezone_offset = timezone(timedelta(hours=offset_hours))
-    dateTimeOriginal = dateTimeOriginal.astimezone(timezone_offset)
-    creationTime = creationTime.astimezone(timezone_offset)
-    offset = f"{offset_hours:+03d}:00" # +03d is to ensure 3 digits including sign
+    # find the timezone the photo was taken in
+    zone = None
+    coordinates = _sidecar_coordinates(supplemental)
+    if timezones is not None and coordinates is not None:
+        zone = timezones.zone_at(*coordinates)
+
+    # load creationTime and photoTakenTime as wall-clock times in that zone
+    creationTime = local_time(int(supplemental["creationTime"]["timestamp"]), zone, timezones)
+    dateTimeOriginal = local_time(int(supplemental["photoTakenTime"]["timestamp"]), zone, timezones)
+    offset = format_offset(creationTime.utcoffset())
+    offset_original = format_offset(dateTimeOriginal.utcoffset())
 
     # exifIdStuff
     times_to_update = {
-            "DateTimeOriginal": dateTimeOriginal.strftime("%Y:%m:%d %H:%M:%S")+offset,
+            "DateTimeOriginal": dateTimeOriginal.strftime("%Y:%m:%d %H:%M:%S")+offset_original,
             "CreateDate": creationTime.strftime("%Y:%m:%d %H:%M:%S")+offset,
             "FileCreateDate": creationTime.strftime("%Y:%m:%d %H:%M:%S")+offset,
             "FileModifyDate": creationTime.strftime("%Y:%m:%d %H:%M:%S")+offset,
             "OffsetTime": offset,
-            "OffsetTimeOriginal": offset,
+            "OffsetTimeOriginal": offset_original,
             "OffsetTimeDigitized": offset, 
     }
     return times_to_update
@@ -90,26 +130,50 @@ def _validate_exif_fields(exif_data: dict) -> None:
     if required_fields > exif_data.keys():
         raise ValueError(f"Missing required EXIF fields: {required_fields - exif_data.keys()}")
 
-def _build_exiftool_command(exif_data: dict, file_path: str) -> str:
-    """Build the exiftool command string from EXIF data.
+def _build_exiftool_args(exif_data: dict, file_path: str) -> List[str]:
+    """Build the exiftool argument list from EXIF data.
     
     Args:
         exif_data: Dictionary containing EXIF data
         file_path: Path to the target file
         
     Returns:
-        str: Complete exiftool command
+        List[str]: exiftool arguments, without the executable
     """
-    modstring = " ".join(f"-{key}=\"{value}\"" for key, value in exif_data.items())
-    return f"exiftool -overwrite_original {modstring} {repr(file_path)}"
+    return ["-overwrite_original", *(f"-{key}={value}" for key, value in exif_data.items()), file_path]
+
+def _build_exiftool_copy_args(exif_data: dict, input_file: str, output_file: str) -> List[str]:
+    """Build the exiftool arguments that write a tagged copy of `input_file` to `output_file` in one pass.
+    
+    Args:
+        exif_data: Dictionary containing EXIF data
+        input_file: Path to the source file, which is left untouched
+        output_file: Path of the file to create
+        
+    Returns:
+        List[str]: exiftool arguments, without the executable
+    """
+    return ["-o", output_file, *(f"-{key}={value}" for key, value in exif_data.items()), input_file]
+
+def _detected_extension(file_path: str, pool: ExifToolPool = None) -> str:
+    """Ask exiftool which extension the contents of a file should have.
+    
+    Raises:
+        RuntimeError: If EXIF data cannot be read
+    """
+    exif_data_from_file = read_exif_data_on_file(file_path, pool)
+    if not exif_data_from_file:
+        raise RuntimeError(f"Couldn't read EXIF data for {file_path} to change extension")
+    return "." + exif_data_from_file["File"]["FileTypeExtension"]
 
-def _handle_extension_mismatch(file_path: str, exif_data: dict, verbose: bool) -> str:
+def _handle_extension_mismatch(file_path: str, exif_data: dict, verbose: bool, pool: ExifToolPool = None) -> str:
     """Handle case where file extension doesn't match EXIF data.
     
     Args:
         file_path: Current path of the file
         exif_data: EXIF data to write
         verbose: Whether to enable verbose logging
+        pool: exiftool workers to run on
         
     Returns:
         str: New file path if extension was changed, original path otherwise
@@ -117,26 +181,26 @@ def _handle_extension_mismatch(file_path: str, exif_data: dict, verbose: bool) -
     Raises:
         RuntimeError: If EXIF data cannot be read or extension cannot be changed
     """
-    exif_data_from_file = read_exif_data_on_file(file_path)
-    if not exif_data_from_file:
-        raise RuntimeError(f"Couldn't read EXIF data for {file_path} to change extension")
-        
-    extension = os.path.splitext(file_path)[1]
-    should_be_extension = "." + exif_data_from_file["File"]["FileTypeExtension"]
+    should_be_extension = _detected_extension(file_path, pool)
+    root, extension = os.path.splitext(file_path)
     
     if extension.lower() != should_be_extension.lower():
-        new_file_path = file_path.replace(extension, should_be_extension)
+        new_file_path = root + should_be_extension
         os.rename(file_path, new_file_path)
         return new_file_path
     return file_path
 
-def write_exif_data_to_file(file_path: str, exif_data: dict, verbose: bool = False) -> None:
+def write_exif_data_to_file(file_path: str, exif_data: dict, verbose: bool = False, pool: ExifToolPool = None) -> str:
     """Write EXIF data to a file.
     
     Args:
         file_path: Path to the target file
         exif_data: Dictionary containing EXIF data to write
         verbose: Whether to enable verbose logging
+        pool: exiftool workers to run on
+        
+    Returns:
+        str: Path of the file, which changes if its extension had to be fixed
         
     Raises:
         ValueError: If required EXIF fields are missing
@@ -144,19 +208,64 @@ def write_exif_data_to_file(file_path: str, exif_data: dict, verbose: bool = Fal
     """
     _validate_exif_fields(exif_data)
     
-    command = _build_exiftool_command(exif_data, file_path)
-    _, err, rc = run_command(command, verbose=verbose)
+    args = _build_exiftool_args(exif_data, file_path)
+    _, err, rc = _run_exiftool(args, pool, verbose=verbose)
     if rc != 0:
         if verbose:
             logger.error(f"Error writing EXIF data to {file_path}: {err.strip()}")
         try:
-            new_file_path = _handle_extension_mismatch(file_path, exif_data, verbose)
+            new_file_path = _handle_extension_mismatch(file_path, exif_data, verbose, pool)
             logger.info(f"Automatically changed extension from {file_path} to {new_file_path} due to mismatch")
             if new_file_path != file_path:
-                command = _build_exiftool_command(exif_data, new_file_path)
-                _, err, rc = run_command(command, verbose=verbose)
+                REGISTRY.inc("exiftool_retries_total", reason="extension")
+                args = _build_exiftool_args(exif_data, new_file_path)
+                _, err, rc = _run_exiftool(args, pool, verbose=verbose)
                 if rc != 0:
                     raise RuntimeError(f"Failed to write EXIF data after extension change: {err.strip()}")
+            return new_file_path
         except Exception as e:
             traceback.print_exc()
-            raise RuntimeError(f"Failed to handle EXIF data writing: {str(e)}")
\ No newline at end of file
+            raise RuntimeError(f"Failed to handle EXIF data writing: {str(e)}")
+    return file_path
+
+def write_exif_data_to_new_file(input_file: str, output_file: str, exif_data: dict, verbose: bool = False, pool: ExifToolPool = None) -> str:
+    """Write a copy of a file with EXIF data to a new path in a single pass, using exiftool's -o.
+    
+    Unlike copying first and then running `write_exif_data_to_file`, the output is only written once.
+    
+    Args:
+        input_file: Path to the source file, which is left untouched
+        output_file: Path of the file to create. An existing file there is replaced
+        exif_data: Dictionary containing EXIF data to write
+        verbose: Whether to enable verbose logging
+        pool: exiftool workers to run on
+        
+    Returns:
+        str: Path of the written file, which has a different extension if the original one was wrong
+        
+    Raises:
+        ValueError: If required EXIF fields are missing
+        RuntimeError: If EXIF data cannot be written
+    """
+    _validate_exif_fields(exif_data)
+    
+    if os.path.exists(output_file):
+        os.remove(output_file)  # exiftool won't replace an existing file with -o
+    _, err, rc = _run_exiftool(_build_exiftool_copy_args(exif_data, input_file, output_file), pool, verbose=verbose)
+    if rc == 0:
+        return output_file
+    if verbose:
+        logger.error(f"Error writing EXIF data to {output_file}: {err.strip()}")
+
+    should_be_extension = _detected_extension(input_file, pool)
+    root, extension = os.path.splitext(output_file)
+    if extension.lower() != should_be_extension.lower():
+        new_output_file = root + should_be_extension
+        if os.path.exists(new_output_file):
+            os.remove(new_output_file)
+        REGISTRY.inc("exiftool_retries_total", reason="extension")
+        _, err, rc = _run_exiftool(_build_exiftool_copy_args(exif_data, input_file, new_output_file), pool, verbose=verbose)
+        if rc == 0:
+            logger.info(f"Automatically changed extension from {output_file} to {new_output_file} due to mismatch")
+            return new_output_file
+    raise RuntimeError(f"Failed to write EXIF data to {output_file}: {err.strip()}")
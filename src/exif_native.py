@@ -0,0 +1,360 @@
+import os
+import re
+import struct
+import shutil
+import zlib
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Tuple
+from exif_interface import _validate_exif_fields
+from filetype import sniff_bytes
+from __init__ import COPY_BUFFER_SIZE, SNIFF_BYTES
+
+# still image containers written without exiftool, by the extension `sniff_bytes` gives them
+NATIVE_TYPES = (".jpg", ".png", ".webp")
+
+# Exif IFD tags written for the fields of `parse_exif_data_from_sidecar`, all of them ASCII
+_EXIF_TAGS = {
+    "DateTimeOriginal": 0x9003,
+    "CreateDate": 0x9004,  # DateTimeDigitized in the EXIF spec
+    "OffsetTime": 0x9010,
+    "OffsetTimeOriginal": 0x9011,
+    "OffsetTimeDigitized": 0x9012,
+}
+_DATE_TAGS = {"DateTimeOriginal", "CreateDate"}
+_DATE = re.compile(r"^\d{4}:\d\d:\d\d \d\d:\d\d:\d\d")
+_EXIF_IFD_POINTER = 0x8769
+_EXIF_VERSION = 0x9000
+_ASCII, _LONG, _UNDEFINED = 2, 4, 7
+_EXIF_HEADER = b"Exif\x00\x00"  # in front of the TIFF data in a JPEG APP1 segment
+_EMPTY_TIFF = b"II*\x00\x08\x00\x00\x00" + b"\x00" * 6  # header and an IFD0 without entries
+_MAX_SEGMENT = 0xFFFF - 2
+
+# (tag, type, count, 4-byte value field, value) where `value` is only set for entries that are written
+# anew. Other entries keep their value field, which may point at data in the original TIFF block
+_Entry = Tuple[int, int, int, bytes, bytes]
+
+
+def _read_ifd(tiff: bytes, offset: int, endian: str) -> Tuple[List[_Entry], int]:
+    """The entries of the IFD at `offset` and the offset of the next IFD."""
+    count, = struct.unpack_from(endian + "H", tiff, offset)
+    entries = [struct.unpack_from(endian + "HHI4s", tiff, offset + 2 + 12 * i) + (None,) for i in range(count)]
+    next_ifd, = struct.unpack_from(endian + "I", tiff, offset + 2 + 12 * count)
+    return entries, next_ifd
+
+
+def _append_ifd(tiff: bytearray, entries: List[_Entry], next_ifd: int, endian: str) -> int:
+    """Append an IFD with `entries`, and the values of new entries that don't fit in it, and return its offset."""
+    if len(tiff) % 2:
+        tiff.append(0)
+    start = len(tiff)
+    data_offset = start + 2 + 12 * len(entries) + 4
+    ifd, data = bytearray(struct.pack(endian + "H", len(entries))), bytearray()
+    for tag, kind, count, field, value in sorted(entries):
+        if value is not None:
+            if len(value) <= 4:
+                field = value.ljust(4, b"\x00")
+            else:
+                field = struct.pack(endian + "I", data_offset + len(data))
+                data += value + b"\x00" * (len(value) % 2)
+        ifd += struct.pack(endian + "HHI", tag, kind, count) + field
+    tiff += ifd + struct.pack(endian + "I", next_ifd) + data
+    return start
+
+
+def _tag_values(exif_data: dict) -> Dict[int, bytes]:
+    """The Exif IFD values for the tags of `exif_data`. Dates lose their offset, it goes in the OffsetTime tags."""
+    values = {}
+    for name, tag in _EXIF_TAGS.items():
+        value = exif_data[name]
+        if name in _DATE_TAGS:
+            if not _DATE.match(value):
+                raise ValueError(f"Can't write {name} {value!r} as an EXIF date")
+            value = value[:19]
+        values[tag] = value.encode("ascii") + b"\x00"
+    return values
+
+
+def update_tiff(tiff: bytes, values: Dict[int, bytes]) -> bytes:
+    """Set ASCII `values` in the Exif IFD of a TIFF block, creating the IFD (or the whole block) if needed.
+
+    The original block is kept byte for byte and the rewritten IFDs are appended to it, so offsets
+    into it (like those inside maker notes) stay valid. Only the pointer to the Exif IFD changes.
+
+    Raises:
+        ValueError: If `tiff` isn't a TIFF block this can read
+    """
+    tiff = tiff or _EMPTY_TIFF
+    endian = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if endian is None or tiff[2:4] != struct.pack(endian + "H", 42):
+        raise ValueError("Not a TIFF header")
+    try:
+        ifd0_offset, = struct.unpack_from(endian + "I", tiff, 4)
+        ifd0, ifd1_offset = _read_ifd(tiff, ifd0_offset, endian)
+        pointer = next((i for i, entry in enumerate(ifd0) if entry[0] == _EXIF_IFD_POINTER), None)
+        exif, exif_next = [], 0
+        if pointer is not None:
+            exif, exif_next = _read_ifd(tiff, struct.unpack(endian + "I", ifd0[pointer][3])[0], endian)
+    except struct.error:
+        raise ValueError("Truncated TIFF block")
+
+    entries = {entry[0]: entry for entry in exif}
+    entries.setdefault(_EXIF_VERSION, (_EXIF_VERSION, _UNDEFINED, 4, None, b"0232"))
+    for tag, value in values.items():
+        entries[tag] = (tag, _ASCII, len(value), None, value)
+    out = bytearray(tiff)
+    exif_offset = _append_ifd(out, list(entries.values()), exif_next, endian)
+    if pointer is not None:
+        struct.pack_into(endian + "I", out, ifd0_offset + 2 + 12 * pointer + 8, exif_offset)
+    else:
+        ifd0.append((_EXIF_IFD_POINTER, _LONG, 1, struct.pack(endian + "I", exif_offset), None))
+        struct.pack_into(endian + "I", out, 4, _append_ifd(out, ifd0, ifd1_offset, endian))
+    return bytes(out)
+
+
+def read_tiff_tags(tiff: bytes) -> Dict[str, str]:
+    """The tags of `_EXIF_TAGS` found in the Exif IFD of a TIFF block, as exiftool would print them."""
+    endian = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if endian is None:
+        return {}
+    try:
+        ifd0, _ = _read_ifd(tiff, struct.unpack_from(endian + "I", tiff, 4)[0], endian)
+        pointer = next((entry for entry in ifd0 if entry[0] == _EXIF_IFD_POINTER), None)
+        if pointer is None:
+            return {}
+        exif, _ = _read_ifd(tiff, struct.unpack(endian + "I", pointer[3])[0], endian)
+    except struct.error:
+        raise ValueError("Truncated TIFF block")
+    names = {tag: name for name, tag in _EXIF_TAGS.items()}
+    tags = {}
+    for tag, kind, count, field, _ in exif:
+        if tag in names and kind == _ASCII:
+            raw = field if count <= 4 else tiff[struct.unpack(endian + "I", field)[0]:][:count]
+            tags[names[tag]] = raw[:count].split(b"\x00")[0].decode("ascii", "replace")
+    return tags
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, length: int):
+    while length > 0:
+        chunk = src.read(min(length, COPY_BUFFER_SIZE))
+        if not chunk:
+            raise ValueError("File ends in the middle of a chunk")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def _read_exact(src: BinaryIO, length: int) -> bytes:
+    data = src.read(length)
+    if len(data) != length:
+        raise ValueError("Unexpected end of file")
+    return data
+
+
+def _jpeg_segments(src: BinaryIO) -> Tuple[List[Tuple[int, bytes]], bytes]:
+    """The marker segments in front of the image data, and the marker that starts the image data."""
+    if _read_exact(src, 2) != b"\xff\xd8":
+        raise ValueError("Not a JPEG")
+    segments = []
+    while True:
+        prefix = _read_exact(src, 2)
+        while prefix == b"\xff\xff":  # fill bytes
+            prefix = b"\xff" + _read_exact(src, 1)
+        if prefix[0] != 0xFF:
+            raise ValueError("Corrupt JPEG marker")
+        marker = prefix[1]
+        if marker == 0xDA:  # start of scan, the rest is image data
+            return segments, prefix
+        if marker == 0xD9 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            raise ValueError(f"Unexpected JPEG marker {marker:#x} before the image data")
+        length, = struct.unpack(">H", _read_exact(src, 2))
+        segments.append((marker, _read_exact(src, length - 2)))
+
+
+def _write_jpeg(src: BinaryIO, dst: BinaryIO, values: Dict[int, bytes]):
+    segments, scan = _jpeg_segments(src)
+    exif = next((i for i, (marker, payload) in enumerate(segments) if marker == 0xE1 and payload.startswith(_EXIF_HEADER)), None)
+    tiff = segments[exif][1][len(_EXIF_HEADER):] if exif is not None else None
+    payload = _EXIF_HEADER + update_tiff(tiff, values)
+    if len(payload) > _MAX_SEGMENT:
+        raise ValueError("EXIF data doesn't fit in a JPEG segment")
+    if exif is not None:
+        segments[exif] = (0xE1, payload)
+    else:
+        # EXIF goes first, only a JFIF header may come before it
+        position = next((i for i, (marker, _) in enumerate(segments) if marker != 0xE0), len(segments))
+        segments.insert(position, (0xE1, payload))
+    dst.write(b"\xff\xd8")
+    for marker, data in segments:
+        dst.write(struct.pack(">BBH", 0xFF, marker, len(data) + 2) + data)
+    dst.write(scan)
+    shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _write_png(src: BinaryIO, dst: BinaryIO, values: Dict[int, bytes]):
+    if _read_exact(src, 8) != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("Not a PNG")
+    dst.write(b"\x89PNG\r\n\x1a\n")
+    written = False
+    while True:
+        header = _read_exact(src, 8)
+        length, kind = struct.unpack(">I4s", header)
+        if kind in (b"IDAT", b"IEND"):
+            break
+        body = _read_exact(src, length + 4)
+        if kind == b"eXIf":
+            if not written:
+                tiff = body[:-4]
+                dst.write(_png_chunk(b"eXIf", update_tiff(tiff[len(_EXIF_HEADER):] if tiff.startswith(_EXIF_HEADER) else tiff, values)))
+                written = True
+            continue
+        dst.write(header + body)
+    if not written:  # eXIf has to come before the image data
+        dst.write(_png_chunk(b"eXIf", update_tiff(None, values)))
+    dst.write(header)
+    shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+
+def _webp_canvas(fourcc: bytes, data: bytes) -> Tuple[int, int, bool]:
+    """Width, height and whether there is alpha, from the start of a simple WebP's VP8 or VP8L chunk."""
+    if fourcc == b"VP8 " and len(data) >= 10 and data[3:6] == b"\x9d\x01\x2a":
+        width, height = struct.unpack_from("<HH", data, 6)
+        return width & 0x3FFF, height & 0x3FFF, False
+    if fourcc == b"VP8L" and len(data) >= 5 and data[0] == 0x2F:
+        bits, = struct.unpack_from("<I", data, 1)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool(bits >> 28 & 1)
+    raise ValueError(f"Unexpected WebP chunk {fourcc!r}")
+
+
+def _write_webp(src: BinaryIO, dst: BinaryIO, values: Dict[int, bytes]):
+    riff, riff_size, webp = struct.unpack("<4sI4s", _read_exact(src, 12))
+    if riff != b"RIFF" or webp != b"WEBP":
+        raise ValueError("Not a WebP")
+    chunks, position, end = [], 12, 8 + riff_size  # (fourcc, offset of the data, size)
+    while position + 8 <= end:
+        src.seek(position)
+        fourcc, size = struct.unpack("<4sI", _read_exact(src, 8))
+        chunks.append((fourcc, position + 8, size))
+        position += 8 + size + size % 2
+    if not chunks:
+        raise ValueError("WebP without chunks")
+
+    def read(chunk) -> bytes:
+        src.seek(chunk[1])
+        return _read_exact(src, chunk[2])
+
+    if chunks[0][0] == b"VP8X":
+        vp8x = bytearray(read(chunks[0]))
+        chunks = chunks[1:]
+    else:
+        # a simple WebP can't carry EXIF, it has to become an extended one
+        width, height, alpha = _webp_canvas(chunks[0][0], read(chunks[0])[:10])
+        vp8x = bytearray(struct.pack("<B3x", 0x10 if alpha else 0) + (width - 1).to_bytes(3, "little") + (height - 1).to_bytes(3, "little"))
+    vp8x[0] |= 0x08  # has EXIF
+    exif = next((chunk for chunk in chunks if chunk[0] == b"EXIF"), None)
+    tiff = read(exif) if exif is not None else None
+    if tiff is not None and tiff.startswith(_EXIF_HEADER):
+        tiff = tiff[len(_EXIF_HEADER):]
+    exif_data = update_tiff(tiff, values)
+
+    # EXIF goes after the image data, in front of XMP
+    chunks = [chunk for chunk in chunks if chunk[0] != b"EXIF"]
+    xmp = next((i for i, chunk in enumerate(chunks) if chunk[0] == b"XMP "), len(chunks))
+    layout = [(b"VP8X", bytes(vp8x))] + chunks[:xmp] + [(b"EXIF", exif_data)] + chunks[xmp:]
+    sizes = [len(chunk[1]) if len(chunk) == 2 else chunk[2] for chunk in layout]
+    dst.write(struct.pack("<4sI4s", b"RIFF", 4 + sum(8 + size + size % 2 for size in sizes), b"WEBP"))
+    for chunk, size in zip(layout, sizes):
+        dst.write(struct.pack("<4sI", chunk[0], size))
+        if len(chunk) == 2:
+            dst.write(chunk[1])
+        else:
+            src.seek(chunk[1])
+            _copy_range(src, dst, size)
+        if size % 2:
+            dst.write(b"\x00")
+
+
+_WRITERS = {".jpg": _write_jpeg, ".png": _write_png, ".webp": _write_webp}
+
+
+def parse_date(value: str) -> datetime:
+    """An aware datetime from a date with offset like `parse_exif_data_from_sidecar` makes them."""
+    return datetime.strptime(value, "%Y:%m:%d %H:%M:%S%z")
+
+
+def set_modify_date(file_path: str, exif_data: dict):
+    """Set the mtime of a file to its `FileModifyDate`, like exiftool does when it writes that tag."""
+    if "FileModifyDate" in exif_data:
+        mtime = parse_date(exif_data["FileModifyDate"]).timestamp()
+        os.utime(file_path, (mtime, mtime))
+
+
+def write_exif_native(input_file: str, output_file: str, exif_data: dict) -> str:
+    """Write a copy of a JPEG, PNG or WebP with EXIF data to a new path, without exiftool.
+
+    Only the EXIF block is rebuilt, everything else is streamed from `input_file` to `output_file`
+    unchanged, so the file is read and written once. `FileModifyDate` sets the output's mtime, like
+    exiftool does. The output is written to a temporary file next to it and renamed into place, so an
+    output that is a hardlink of the source, left by `--hardlinkUnchanged`, never truncates the source.
+
+    Args:
+        input_file: Path to the source file, which is left untouched
+        output_file: Path of the file to create. An existing file there is replaced
+        exif_data: Dictionary containing EXIF data to write
+
+    Returns:
+        str: Path of the written file
+
+    Raises:
+        ValueError: If required EXIF fields are missing, or the file isn't a container this can write.
+            `output_file` isn't touched then
+    """
+    _validate_exif_fields(exif_data)
+    values = _tag_values(exif_data)
+    with open(input_file, "rb") as src:
+        kind = sniff_bytes(src.read(SNIFF_BYTES))
+        if kind not in _WRITERS:
+            raise ValueError(f"Can't write EXIF data to {kind or 'an unrecognised file'} without exiftool")
+        src.seek(0)
+        temporary = output_file + ".tmp"
+        try:
+            with open(temporary, "wb") as dst:
+                _WRITERS[kind](src, dst, values)
+            set_modify_date(temporary, exif_data)
+            os.replace(temporary, output_file)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+    return output_file
+
+
+def read_exif_native(file_path: str) -> Dict[str, str]:
+    """The tags `write_exif_native` writes, read back from a JPEG, PNG or WebP, or {} when it has none."""
+    with open(file_path, "rb") as f:
+        kind = sniff_bytes(f.read(SNIFF_BYTES))
+        f.seek(0)
+        tiff = None
+        if kind == ".jpg":
+            segments, _ = _jpeg_segments(f)
+            tiff = next((payload[len(_EXIF_HEADER):] for marker, payload in segments
+                         if marker == 0xE1 and payload.startswith(_EXIF_HEADER)), None)
+        elif kind == ".png":
+            f.seek(8)
+            while tiff is None and (header := f.read(8)) and len(header) == 8:
+                length, chunk = struct.unpack(">I4s", header)
+                body = f.read(length + 4)
+                if chunk == b"eXIf":
+                    tiff = body[:-4]
+        elif kind == ".webp":
+            f.seek(12)
+            while tiff is None and (header := f.read(8)) and len(header) == 8:
+                chunk, size = struct.unpack("<4sI", header)
+                body = f.read(size + size % 2)
+                if chunk == b"EXIF":
+                    tiff = body[:size]
+    if tiff is None:
+        return {}
+    return read_tiff_tags(tiff[len(_EXIF_HEADER):] if tiff.startswith(_EXIF_HEADER) else tiff)
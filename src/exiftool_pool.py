@@ -0,0 +1,212 @@
+import itertools
+import logging
+import queue
+import subprocess
+import threading
+import time
+from typing import List, Tuple
+from metrics import REGISTRY
+from __init__ import EXIFTOOL_BINARY, EXIFTOOL_POOL_SIZE, EXIFTOOL_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class ExifToolError(RuntimeError):
+    """Raised when an exiftool worker dies and can't be brought back."""
+
+
+def _frame_arguments(args: List[str]) -> List[str]:
+    """Check that every argument survives the `-@ -` argfile framing.
+
+    Exiftool reads one argument per line, strips surrounding white space and
+    treats lines starting with '#' as comments, so those arguments can't be sent
+    through a stay_open worker.
+
+    Raises:
+        ValueError: If an argument can't be framed
+    """
+    for arg in args:
+        if "\n" in arg or "\r" in arg or arg.startswith("#") or arg != arg.strip():
+            raise ValueError(f"Argument {arg!r} can't be sent through an exiftool argfile")
+    return args
+
+
+def _pump(stream, lines: queue.Queue):
+    """Move lines from `stream` to `lines` until it closes, then put None."""
+    try:
+        for line in iter(stream.readline, ""):
+            lines.put(line)
+    except (OSError, ValueError):
+        pass  # closed under us by close()
+    lines.put(None)
+
+
+class ExifToolProcess:
+    """
+    A single long-lived `exiftool -stay_open True -@ -` interpreter.
+
+    Its stdout and stderr are drained by a thread each, so exiftool never blocks on a full pipe while
+    we wait on the other one, and a command that takes longer than `timeout` can be given up on.
+    """
+
+    def __init__(self, executable: str = EXIFTOOL_BINARY, timeout: float = EXIFTOOL_TIMEOUT):
+        self.executable = executable
+        self.timeout = timeout
+        self._process = None
+        self._stdout = None
+        self._stderr = None
+        self._sequence = itertools.count(1)
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        logger.debug(f"Starting exiftool worker ({self.executable})")
+        self._process = subprocess.Popen(
+            [self.executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, encoding="utf-8", errors="replace")
+        self._stdout, self._stderr = queue.Queue(), queue.Queue()
+        for stream, lines in ((self._process.stdout, self._stdout), (self._process.stderr, self._stderr)):
+            threading.Thread(target=_pump, args=(stream, lines), name="exiftool-pipe", daemon=True).start()
+
+    def close(self, timeout: float = 5):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            if process.poll() is None:
+                process.stdin.write("-stay_open\nFalse\n")
+                process.stdin.flush()
+                process.wait(timeout=timeout)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        finally:
+            for stream in (process.stdin, process.stdout, process.stderr):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+
+    def restart(self):
+        self.close(timeout=1)
+        self.start()
+
+    def _read_until(self, lines: queue.Queue, sentinel: str, deadline: float) -> Tuple[str, str]:
+        """Take lines from `lines` until one contains `sentinel`.
+
+        Returns:
+            Tuple[str, str]: Everything before the sentinel, and the rest of the sentinel line
+
+        Raises:
+            TimeoutError: If the sentinel hasn't come by `deadline`. The worker is killed
+        """
+        lines_read = []
+        while True:
+            try:
+                line = lines.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                self.close(timeout=0)
+                raise TimeoutError(f"exiftool didn't finish a command within {self.timeout}s")
+            if line is None:
+                raise EOFError("exiftool closed its output")
+            index = line.find(sentinel)
+            if index != -1:
+                lines_read.append(line[:index])
+                return "".join(lines_read), line[index + len(sentinel):].strip()
+            lines_read.append(line)
+
+    def execute(self, args: List[str]) -> Tuple[str, str, int]:
+        """Run one exiftool command on this worker.
+
+        Args:
+            args: Exiftool arguments, without the executable
+
+        Returns:
+            Tuple[str, str, int]: stdout, stderr and exit status, like `util.run_command`
+        """
+        if self._process is None:
+            self.start()
+        elif not self.running:
+            logger.warning("Exiftool worker exited, restarting")
+            self.restart()
+        sequence = next(self._sequence)
+        sentinel = f"{{ready{sequence}}}"
+        payload = _frame_arguments(args) + ["-echo4", f"{sentinel} ${{status}}", f"-execute{sequence}"]
+        self._process.stdin.write("\n".join(payload) + "\n")
+        self._process.stdin.flush()
+
+        deadline = time.monotonic() + self.timeout
+        out, _ = self._read_until(self._stdout, sentinel, deadline)
+        err, status = self._read_until(self._stderr, sentinel, deadline)
+        if status.isdigit():
+            rc = int(status)
+        else:  # exiftool older than 12.10 doesn't know ${status}
+            rc = 1 if "Error" in err else 0
+        return out, err, rc
+
+
+class ExifToolPool:
+    """A fixed-size pool of stay_open exiftool workers that is safe to share between threads.
+
+    Workers are started lazily, so a pool costs nothing until its first command.
+    """
+
+    def __init__(self, size: int = EXIFTOOL_POOL_SIZE, executable: str = EXIFTOOL_BINARY, timeout: float = EXIFTOOL_TIMEOUT):
+        if size < 1:
+            raise ValueError("Exiftool pool size must be at least 1")
+        self.size = size
+        self._workers = [ExifToolProcess(executable, timeout) for _ in range(size)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def execute(self, args: List[str], verbose: bool = False) -> Tuple[str, str, int]:
+        """Run an exiftool command on the next idle worker.
+
+        A worker that crashed mid-command, or didn't finish it within the timeout, is restarted and the
+        command is retried once.
+
+        Raises:
+            ValueError: If an argument can't be framed for the argfile protocol
+            ExifToolError: If the worker keeps failing
+        """
+        _frame_arguments(args)
+        if self._closed:
+            raise ExifToolError("Exiftool pool is closed")
+        if verbose:
+            logger.info(f"Running exiftool command: {args}")
+        worker = self._idle.get()
+        try:
+            for attempt in range(2):
+                try:
+                    return worker.execute(args)
+                except TimeoutError as e:
+                    logger.warning(f"Exiftool worker hung ({e}), restarting")
+                    REGISTRY.inc("exiftool_retries_total", reason="timeout")
+                    worker.restart()
+                except (OSError, EOFError, ValueError) as e:
+                    logger.warning(f"Exiftool worker crashed ({e}), restarting")
+                    REGISTRY.inc("exiftool_retries_total", reason="crash")
+                    worker.restart()
+            raise ExifToolError(f"Exiftool worker failed twice running {args}")
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for worker in self._workers:
+            worker.close()
@@ -0,0 +1,120 @@
+import os
+import logging
+from typing import Union
+from __init__ import SNIFF_BYTES
+
+logger = logging.getLogger(__name__)
+
+# extensions that share a container format. exiftool writes any of them whatever the name says,
+# so a file only needs a new extension when its contents belong to a different family
+_FAMILIES = {
+    ".jpg": "jpeg", ".jpeg": "jpeg", ".jpe": "jpeg",
+    ".png": "png",
+    ".gif": "gif",
+    ".webp": "webp",
+    ".heic": "heif", ".heif": "heif", ".hif": "heif", ".avif": "heif",
+    ".mp4": "quicktime", ".m4v": "quicktime", ".mov": "quicktime", ".qt": "quicktime",
+    ".3gp": "quicktime", ".3g2": "quicktime",
+    ".f4v": "quicktime", ".f4p": "quicktime", ".f4a": "quicktime", ".f4b": "quicktime",
+    ".avi": "avi",
+    ".mkv": "matroska", ".webm": "matroska",
+    ".wmv": "asf", ".asf": "asf",
+    ".flv": "flv",
+}
+
+_HEIC_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"hevm", b"hevs"}
+_HEIF_BRANDS = {b"mif1", b"msf1", b"mif2"}
+_AVIF_BRANDS = {b"avif", b"avis"}
+_M4V_BRANDS = {b"M4V ", b"M4VH", b"M4VP"}
+_QUICKTIME_ATOMS = {b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+_ASF_GUID = bytes.fromhex("3026B2758E66CF11A6D900AA0062CE6C")
+
+
+def _sniff_ftyp(head: bytes) -> Union[str, None]:
+    """Pick an extension from an ISO base media `ftyp` box.
+
+    Still image brands win wherever they appear, since a generic `mif1` major brand is often followed
+    by `heic`. Otherwise the major brand is tried first, then the compatible brands.
+    """
+    box_size = int.from_bytes(head[0:4], "big")
+    major = head[8:12]
+    compatible = [head[i:i + 4] for i in range(16, min(max(box_size, 16), len(head)) - 3, 4)]
+    brands = [major] + compatible
+    for still_brands, extension in ((_HEIC_BRANDS, ".heic"), (_AVIF_BRANDS, ".avif"), (_HEIF_BRANDS, ".heif")):
+        if still_brands.intersection(brands):
+            return extension
+    for brand in brands:
+        if brand == b"qt  ":
+            return ".mov"
+        if brand in _M4V_BRANDS:
+            return ".m4v"
+        if brand.startswith(b"3gp"):
+            return ".3gp"
+        if brand.startswith(b"3g2"):
+            return ".3g2"
+    return ".mp4"
+
+
+def sniff_bytes(head: bytes) -> Union[str, None]:
+    """Recognise a media file from its first bytes.
+
+    Args:
+        head: The first few hundred bytes of the file
+
+    Returns:
+        str: Extension for the detected type (like ".heic"), or None if it isn't recognised
+    """
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return ".avi"
+    if head[4:8] == b"ftyp":
+        return _sniff_ftyp(head)
+    if head[4:8] in _QUICKTIME_ATOMS:
+        return ".mov"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return ".webm" if b"webm" in head[:64] else ".mkv"
+    if head.startswith(_ASF_GUID):
+        return ".wmv"
+    if head.startswith(b"FLV\x01"):
+        return ".flv"
+    return None
+
+
+def sniff_file_type(file_path: str) -> Union[str, None]:
+    """Recognise a media file by reading only its first few hundred bytes.
+
+    Returns:
+        str: Extension for the detected type (like ".heic"), or None if it isn't recognised
+    """
+    try:
+        with open(file_path, "rb") as f:
+            return sniff_bytes(f.read(SNIFF_BYTES))
+    except OSError as e:
+        logger.debug(f"Couldn't sniff {file_path}: {e}")
+        return None
+
+
+def extension_matches(extension: str, detected: str) -> bool:
+    """Whether a file named with `extension` can hold the `detected` type without being renamed."""
+    extension = extension.lower()
+    if extension == detected:
+        return True
+    family = _FAMILIES.get(extension)
+    return family is not None and family == _FAMILIES.get(detected)
+
+
+def corrected_path(file_path: str, detected: str) -> str:
+    """Return `file_path` with its extension replaced by `detected` if the two don't match."""
+    if detected is None:
+        return file_path
+    root, extension = os.path.splitext(file_path)
+    if extension_matches(extension, detected):
+        return file_path
+    return root + detected
@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Tuple, Union
+from util import _hash_ends
+from __init__ import DEDUPE_PARTIAL_BYTES, JOURNAL_BATCH_SIZE, JOURNAL_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PLANNED = "planned"
+COPIED = "copied"
+TAGGED = "tagged"
+VERIFIED = "verified"
+FAILED = "failed"
+STATES = [PLANNED, COPIED, TAGGED, VERIFIED, FAILED]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    source TEXT PRIMARY KEY,  -- media path relative to the input dir
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    output TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    content_hash TEXT  -- of the source as it was verified, see `matches_content`
+)
+"""
+_OUTPUT_INDEX = "CREATE INDEX IF NOT EXISTS files_output ON files (output)"
+_UPSERT = """
+INSERT INTO files (source, size, mtime_ns, state, output, error, updated, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(source) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, state=excluded.state,
+    output=COALESCE(excluded.output, files.output), error=excluded.error, updated=excluded.updated,
+    content_hash=COALESCE(excluded.content_hash, files.content_hash)
+"""
+
+
+def source_hash(path: str, size: int) -> str:
+    """A hash of the first and last 64 KB of a file, the one `--dedupe` compares candidates by."""
+    return _hash_ends(path, size, DEDUPE_PARTIAL_BYTES)
+
+
+def checksum_hash(algorithm: str, checksum: str) -> str:
+    """The content hash to record for a file whose whole contents the copy engine hashed with `algorithm`."""
+    return f"{algorithm}:{checksum}"
+
+
+def matches_content(path: str, size: int, content_hash: str, buffer_size: int = 1 << 20) -> bool:
+    """Whether the file at `path` has the contents `content_hash` was recorded for: a `checksum_hash`,
+    or a `source_hash` when there is no algorithm in front of it.
+
+    Raises:
+        OSError: If the file can't be read
+    """
+    algorithm, _, checksum = content_hash.rpartition(":")
+    if not algorithm:
+        return source_hash(path, size) == checksum
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while chunk := f.read(buffer_size):
+            digest.update(chunk)
+    return digest.hexdigest() == checksum
+
+
+def default_journal_path(outputDir: str) -> str:
+    """The journal lives next to the output dir rather than inside it, so it never ends up in the library."""
+    return os.path.normpath(outputDir) + ".journal.sqlite"
+
+
+class Journal:
+    """
+    On-disk record of every file a run has planned and how far it got, keyed by the source path
+    relative to the input dir together with the file's size and mtime, and for verified files a hash
+    of its contents.
+
+    State changes are buffered and written in one transaction per batch, so recording them costs far
+    less than the copy or exiftool call they describe. A crash loses at most the last unflushed batch,
+    and those files are simply redone on resume.
+    """
+
+    def __init__(self, path: str, batch_size: int = JOURNAL_BATCH_SIZE, flush_seconds: float = JOURNAL_FLUSH_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(_SCHEMA)
+        if "content_hash" not in {row[1] for row in self._connection.execute("PRAGMA table_info(files)")}:
+            self._connection.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")  # a journal from before hashes
+        self._connection.execute(_OUTPUT_INDEX)
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def record(self, source: str, size: int, mtime_ns: int, state: str, output: str = None, error: str = None,
+               content_hash: str = None):
+        """Queue a state change for `source`. It is written with the next batch."""
+        with self._lock:
+            self._pending.append((source, size, mtime_ns, state, output, error, time.time(), content_hash))
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_seconds:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.executemany(_UPSERT, pending)
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def lookup(self, source: str) -> Union[Tuple[int, int, str, str, str], None]:
+        """Return (size, mtime_ns, state, output, content_hash) for `source` as of the last flush, or None if it was never recorded."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT size, mtime_ns, state, output, content_hash FROM files WHERE source = ?", (source,)).fetchone()
+
+    def owner_of(self, output: str) -> Union[str, None]:
+        """Return the source whose output was recorded at `output` as of the last flush, or None."""
+        with self._lock:
+            row = self._connection.execute("SELECT source FROM files WHERE output = ? LIMIT 1", (output,)).fetchone()
+        return row[0] if row is not None else None
+
+    def is_done(self, source: str, size: int, mtime_ns: int, path: str = None) -> bool:
+        """Whether `source` was fully processed, unchanged since, and its output is still there.
+
+        A file with a different mtime is unchanged if it has the same size and contents as when it was
+        verified, when the run that verified it had a hash of them (`--checksum`, `--dedupe`). Only then
+        is the file at `path` read; without `path` or a hash only the mtime counts.
+        """
+        row = self.lookup(source)
+        if row is None:
+            return False
+        done_size, done_mtime_ns, state, output, content_hash = row
+        if state != VERIFIED or done_size != size or output is None or not os.path.exists(output):
+            return False
+        if done_mtime_ns == mtime_ns:
+            return True
+        if path is None or content_hash is None:
+            return False
+        try:
+            return matches_content(path, size, content_hash)
+        except (OSError, ValueError):  # ValueError for an algorithm hashlib doesn't have
+            return False
+
+    def failures(self) -> dict:
+        """Return {source: error} for every file whose last recorded state is failed."""
+        with self._lock:
+            self._flush()
+            return dict(self._connection.execute("SELECT source, error FROM files WHERE state = ?", (FAILED,)).fetchall())
+
+    def counts(self) -> dict:
+        with self._lock:
+            self._flush()
+            return dict(self._connection.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall())
+
+    def close(self):
+        with self._lock:
+            if self._connection is None:
+                return
+            self._flush()
+            self._connection.close()
+            self._connection = None
@@ -1,14 +1,35 @@
 # will call exiftool directly
 import argparse
 import pdb
-from match_files import find_sidecar_files, turn_tuple_list_into_dict
-from exif_interface import parse_exif_data_from_sidecar, write_exif_data_to_file
-from util import run_command
+from match_files import find_sidecar_files, iter_sidecar_files, match_files_from_catalog, turn_tuple_list_into_dict
+from exif_interface import parse_exif_data_from_sidecar, write_exif_data_to_file, write_exif_data_to_new_file
+from exif_native import NATIVE_TYPES, write_exif_native
+from quicktime import QUICKTIME_TYPES, plan_date_patches, apply_date_patches
+from util import _format_bytes, _is_inside
+from exiftool_pool import ExifToolPool
+from copy_engine import CopyEngine, COPY_MODES
+from dedupe import Deduplicator, HashCache, DEDUPE_POLICIES
+from archive import TakeoutArchive, is_archive, open_archive
+from catalog import MEDIA
+from xmp import XmpWriter, XMP_EXTENSION, xmp_path
+from verify import Verifier, expected_tags
+from filetype import sniff_bytes, sniff_file_type, corrected_path
+from timezones import TimezoneResolver, load_timezones
+from plan import write_plan, read_plan_header, iter_plan
+from shard import run_sharded, run_worker
+from journal import Journal, default_journal_path, checksum_hash, PLANNED, COPIED, TAGGED, VERIFIED, FAILED
+from pipeline import MergeItem, Pipeline, Stage
+from results import MergeResult, FailureLog
+from metrics import REGISTRY, eta_seconds
+from typing import Callable, Iterator, List, Union
 from __init__ import *
 import logging
 import os
 import json
 import shutil
+import time
+import zlib
+from collections import Counter, defaultdict
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 import eventlet
@@ -21,120 +42,741 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _iter_merge_items(inputDir: str, outputDir: str, dryRun: bool, recursive: bool, match_jobs: int, summary: dict) -> Iterator[MergeItem]:
+    """Turn the matched sidecars of every directory into pipeline items, counting the totals in `summary` as it goes.
+
+    The type of every media file is recognised from its first bytes here, so a file with the wrong
+    extension gets the right one in the output before anything is written.
+    """
+    for relative_dir, matched_files, missing_files, ambiguous_files, catalog in iter_sidecar_files(inputDir, recursive, match_jobs):
+        summary["missing"] += len(missing_files)
+        summary["ambiguous"] += len(ambiguous_files)
+
+        # turn matched_files into a dict
+        matched_files_dict = turn_tuple_list_into_dict(
+            matched_files)  # {file: json_file}
+        # only the dict is needed while the items of this directory go through the pipeline
+        del matched_files, missing_files, ambiguous_files
+        summary["total"] += len(matched_files_dict)
+        if not dryRun and relative_dir:
+            os.makedirs(os.path.join(outputDir, relative_dir), exist_ok=True)
+
+        for file, json_name in matched_files_dict.items():
+            item = MergeItem(
+                file=file,
+                json_name=json_name,
+                input_file=os.path.join(inputDir, file),  # input file with path
+                json_file=os.path.join(inputDir, json_name),  # json file with path
+                output_file=os.path.join(outputDir, file),  # output file with path
+            )
+            item.file_type = sniff_file_type(item.input_file)
+            corrected_file = corrected_path(file, item.file_type)
+            if corrected_file != file and corrected_file not in matched_files_dict:
+                item.output_file = os.path.join(outputDir, corrected_file)
+                logger.info(f"Automatically changed extension from {file} to {corrected_file} due to mismatch")
+            item.size, item.mtime_ns, item.inode = catalog.stat(os.path.basename(file))  # as seen when the directory was listed
+            item.device = catalog.device
+            yield item
+
+def _archive_item(directory: str, relative_dir: str, file: str, json_name: str, outputDir: str, file_type: str,
+                  taken: Callable[[str], bool]) -> MergeItem:
+    """The item for media member `file` of `directory` in an archive, or None if its output would end
+    up outside `outputDir`. The extension isn't corrected to a name `taken` is true for."""
+    item = MergeItem(
+        file=os.path.join(relative_dir, file),
+        json_name=os.path.join(relative_dir, json_name),
+        input_file=os.path.join(directory, file),  # member in the archive
+        json_file=os.path.join(directory, json_name),  # member in the archive
+        output_file=os.path.join(outputDir, relative_dir, file),
+    )
+    item.file_type = file_type
+    corrected_file = corrected_path(file, item.file_type)
+    if corrected_file != file and not taken(corrected_file):
+        item.output_file = os.path.join(outputDir, relative_dir, corrected_file)
+        logger.info(f"Automatically changed extension from {file} to {corrected_file} due to mismatch")
+    if not _is_inside(item.output_file, outputDir):
+        logger.warning(f"Skipping {item.input_file}, it would be extracted outside {outputDir}")
+        return None
+    return item
+
+def _iter_archive_items(archive: TakeoutArchive, outputDir: str, dryRun: bool, summary: dict, skip=None) -> Iterator[MergeItem]:
+    """Like `_iter_merge_items`, for the members of a Takeout archive. `input_file` and `json_file` are
+    the paths of the members inside the archive.
+
+    Paths in the output are relative to the deepest directory holding all the media files, usually
+    `Takeout/Google Photos`.
+
+    An archive that has to be read in order is streamed once here: each media file is extracted as
+    the stream goes past it and carries its sidecar, so the items come in archive order and have been
+    copied already. Only sidecars whose media file hasn't come yet, and items whose sidecar hasn't,
+    are held. Media files `skip(item)` is true for aren't extracted, like the ones a resumed run did.
+    """
+    catalogs = list(archive.catalogs())
+    media_dirs = [directory for directory, catalog in catalogs if catalog.names_of(MEDIA)]
+    root = os.path.commonpath(media_dirs) if media_dirs else ""
+    sidecar_of = {}  # media member -> (sidecar member, relative dir), for an archive read in order
+    for directory, catalog in catalogs:
+        with REGISTRY.timer("match_seconds"):
+            matched_files, missing_files, ambiguous_files = match_files_from_catalog(catalog, show_progress=False)
+        summary["missing"] += len(missing_files)
+        summary["ambiguous"] += len(ambiguous_files)
+        matched_files_dict = turn_tuple_list_into_dict(matched_files)
+        summary["total"] += len(matched_files_dict)
+        relative_dir = os.path.relpath(directory, root) if directory != root else ""
+        if not _is_inside(os.path.join(outputDir, relative_dir), outputDir):
+            logger.warning(f"Skipping {len(matched_files_dict)} files in {directory}, it would be extracted outside {outputDir}")
+            summary["total"] -= len(matched_files_dict)
+            continue
+        if not dryRun and relative_dir and matched_files_dict:
+            os.makedirs(os.path.join(outputDir, relative_dir), exist_ok=True)
+
+        for file, json_name in matched_files_dict.items():
+            if archive.sequential:
+                sidecar_of[os.path.join(directory, file)] = (os.path.join(directory, json_name), relative_dir)
+                continue
+            item = _archive_item(directory, relative_dir, file, json_name, outputDir, archive.file_type(os.path.join(directory, file)),
+                                 matched_files_dict.__contains__)
+            if item is None:
+                summary["total"] -= 1
+                continue
+            item.size, item.mtime_ns, _ = catalog.stat(file)
+            yield item
+    if archive.sequential:
+        del catalogs  # the names are all the stream needs
+        yield from _stream_archive_items(archive, sidecar_of, outputDir, dryRun, summary, skip)
+
+def _stream_archive_items(archive: TakeoutArchive, sidecar_of: dict, outputDir: str, dryRun: bool, summary: dict,
+                          skip=None) -> Iterator[MergeItem]:
+    remaining = Counter(sidecar for sidecar, _ in sidecar_of.values())  # media members still to come per sidecar
+    waiting_sidecars = {}  # sidecar member -> its compressed contents, until all its media files are out
+    waiting_items = defaultdict(list)  # sidecar member -> items extracted before it came
+    for name, member in archive.stream():
+        if name in sidecar_of:
+            sidecar, relative_dir = sidecar_of.pop(name)
+            directory = os.path.dirname(name)
+            head = member.read(SNIFF_BYTES)
+            item = _archive_item(directory, relative_dir, os.path.basename(name), os.path.basename(sidecar), outputDir,
+                                 sniff_bytes(head), lambda other: os.path.join(directory, other) in archive.members)
+            remaining[sidecar] -= 1
+            if item is None:
+                summary["total"] -= 1
+                continue
+            info = archive.members[name]
+            item.size, item.mtime_ns = info.size, info.mtime_ns
+            if not dryRun and (skip is None or not skip(item)):
+                logger.debug(f"Extracting {item.input_file} -> {item.output_file}")
+                item.written = True
+                with open(item.output_file, "wb") as f:
+                    f.write(head)
+                    shutil.copyfileobj(member, f, COPY_BUFFER_SIZE)
+                item.bytes_written += item.size
+                item.copy_strategy = "archive"
+            if sidecar in waiting_sidecars:
+                item.sidecar = waiting_sidecars[sidecar]
+                if remaining[sidecar] == 0:
+                    del waiting_sidecars[sidecar], remaining[sidecar]
+                yield item
+            else:
+                waiting_items[sidecar].append(item)
+        elif name in remaining:
+            contents = zlib.compress(member.read(), 1)
+            for item in waiting_items.pop(name, []):
+                item.sidecar = contents
+                yield item
+            if remaining[name] > 0:
+                waiting_sidecars[name] = contents
+            else:
+                del remaining[name]
+    for items in waiting_items.values():
+        yield from items  # their sidecar is read from the archive by the parse stage
+
+def _iter_plan_items(plan_path: str, inputDir: str, outputDir: str, dryRun: bool, summary: dict) -> Iterator[MergeItem]:
+    """Stream the items of a merge plan, creating the output directories they need as they come."""
+    created_dirs = set()
+    for item in iter_plan(plan_path, inputDir, outputDir, summary):
+        output_dir = os.path.dirname(item.output_file)
+        if not dryRun and output_dir not in created_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            created_dirs.add(output_dir)
+        yield item
+
+def _track_items(items: Iterator[MergeItem], summary: dict, journal: Journal = None, resume: bool = False,
+                 from_archive: bool = False) -> Iterator[MergeItem]:
+    """Record every item as planned in the journal.
+
+    With `resume`, files the journal has as verified (and unchanged since) are counted as skipped instead.
+    Files on disk whose mtime changed are compared by their contents, the members of an archive keep theirs.
+    """
+    planned_bytes = 0
+    for item in items:
+        if journal is not None:
+            if resume and journal.is_done(item.file, item.size, item.mtime_ns, None if from_archive else item.input_file):
+                summary["skipped"] += 1
+                continue
+            journal.record(item.file, item.size, item.mtime_ns, PLANNED, item.output_file)
+        planned_bytes += item.size
+        REGISTRY.set("planned_bytes", planned_bytes)
+        yield item
+
+def _content_hash(item: MergeItem, checksum: str = None) -> Union[str, None]:
+    """A hash of the source that the run already has, from the copy engine's `checksum` or from dedupe,
+    for the journal to recognise a later, re-extracted copy of the file by. Nothing is read for it."""
+    if item.checksum is not None and checksum is not None:
+        return checksum_hash(checksum, item.checksum)
+    content = item.content if item.content is not None else item.duplicate_of
+    return content.partial if content is not None else None
+
+def _verify_duplicate(item: MergeItem, verify_output: Callable[[MergeItem], None]):
+    """Check the output of a duplicate against the tags of its own sidecar, like the verify stage does
+    for the files that went through the pipeline."""
+    started = time.perf_counter()
+    try:
+        verify_output(item)
+    except Exception as e:
+        item.error, item.stage = e, "verify"
+    item.seconds += time.perf_counter() - started
+
+def _parse_sidecar(item: MergeItem, timezones: TimezoneResolver = None, archive: TakeoutArchive = None):
+    if item.sidecar is not None:
+        json_data = json.loads(zlib.decompress(item.sidecar))
+        item.sidecar = None
+    elif archive is not None:
+        json_data = json.loads(archive.read(item.json_file))
+    else:
+        with open(item.json_file, "r") as f:
+            json_data = json.load(f)
+    item.exif_data = parse_exif_data_from_sidecar(
+        json_data, timezones)
+
+def _log_stage_summary():
+    """Log where the time of a run went, from the latency histograms of its stages."""
+    for stage in ("parse", "dedupe", "copy", "write", "verify"):
+        histogram = REGISTRY.histogram("stage_seconds", stage=stage)
+        if histogram.count:
+            logger.info(f"Stage {stage}: {histogram.count} files, {histogram.sum:.1f}s in total, "
+                        f"p50 {histogram.quantile(0.5) * 1000:.1f}ms, p95 {histogram.quantile(0.95) * 1000:.1f}ms")
+    calls = REGISTRY.counter("exiftool_calls_total", mode="pool") + REGISTRY.counter("exiftool_calls_total", mode="process")
+    if calls:
+        logger.info(f"Ran {int(calls)} exiftool commands, p95 {REGISTRY.histogram('exiftool_seconds', mode='pool').quantile(0.95) * 1000:.1f}ms")
+    native = REGISTRY.histogram("native_exif_seconds")
+    if native.count:
+        logger.info(f"Wrote {native.count} files without exiftool, p95 {native.quantile(0.95) * 1000:.1f}ms")
+
+def _build_stages(dryRun: bool, pool: ExifToolPool, copier: CopyEngine, jobs: int, copy_jobs: int, single_write: bool = False,
+                  journal: Journal = None, timezones: TimezoneResolver = None, archive: TakeoutArchive = None,
+                  xmp_writer: XmpWriter = None, native_exif: bool = False, native_video: bool = False,
+                  verifier: Verifier = None) -> List[Stage]:
+    """The merge stages: parse the sidecar, copy the media file, write the metadata, check the output.
+
+    With `single_write` the copy stage is skipped and the metadata writer creates the output file
+    straight from the source, so every byte reaches the output disk once instead of twice. With an
+    `archive`, the copy stage extracts the media file from it. With an `xmp_writer`, nothing is copied
+    and the metadata is written to an XMP sidecar in the output dir instead. With `native_exif`, JPEGs,
+    PNGs and WebPs are written straight from the source without exiftool, and go to exiftool only if
+    that fails. With `native_video`, the dates in the movie header of MP4 and QuickTime files are
+    patched in place once they are copied. With a `verifier`, the check stage also hands every file
+    to it to have its tags read back.
+    """
+    def record(item: MergeItem, state: str):
+        if journal is not None:
+            journal.record(item.file, item.size, item.mtime_ns, state, item.output_file)
+
+    def parse_sidecar(item: MergeItem):
+        if not item.exif_data:  # items from a plan already have their tags
+            _parse_sidecar(item, timezones, archive)
+
+    def native(item: MergeItem) -> bool:
+        return native_exif and not dryRun and archive is None and xmp_writer is None and item.file_type in NATIVE_TYPES
+
+    def native_movie(item: MergeItem) -> bool:
+        return native_video and not dryRun and xmp_writer is None and item.file_type in QUICKTIME_TYPES
+
+    def copy_file(item: MergeItem):
+        if single_write or xmp_writer is not None or native(item):
+            return
+        copy_to_output(item)
+
+    def copy_to_output(item: MergeItem):
+        if not dryRun and item.copy_strategy == "archive":
+            record(item, COPIED)  # extracted while the archive was streamed
+        elif not dryRun and archive is not None:
+            logger.debug(f"Extracting {item.input_file} -> {item.output_file}")
+            item.written = True
+            item.bytes_written += archive.extract(item.input_file, item.output_file)
+            item.copy_strategy = "archive"
+            record(item, COPIED)
+        elif not dryRun:
+            logger.debug(f"Copying {item.input_file} -> {item.output_file}")
+            item.written = True
+            result = copier.copy(item.input_file, item.output_file, src_dev=item.device)  # copy file to output dir
+            item.copy_strategy, item.checksum = result.strategy, result.checksum
+            item.bytes_written += result.bytes_copied
+            record(item, COPIED)
+        else:
+            logger.info(f"Would have copied {item.input_file} -> {item.output_file}")
+
+    def write_metadata(item: MergeItem):
+        if native(item):
+            try:
+                item.written = True
+                with REGISTRY.timer("native_exif_seconds"):
+                    item.output_file = write_exif_native(item.input_file, item.output_file, item.exif_data)
+            except ValueError as e:
+                logger.info(f"Writing {item.output_file} with exiftool instead: {e}")
+                REGISTRY.inc("native_exif_fallbacks_total", type=item.file_type)
+                if not single_write:
+                    copy_to_output(item)  # the copy stage left this file to the native writer
+            else:
+                item.bytes_written += os.path.getsize(item.output_file)
+                REGISTRY.inc("native_exif_writes_total", type=item.file_type)
+                record(item, TAGGED)
+                logger.info(f"Wrote {item.output_file} with exif data from {item.json_file}")
+                return
+        if native_movie(item):
+            started = time.perf_counter()
+            try:
+                # the copy has the layout of the source, so without a copy yet the source is read
+                patches = plan_date_patches(item.input_file if single_write else item.output_file, item.exif_data)
+            except ValueError as e:
+                logger.info(f"Writing {item.output_file} with exiftool instead: {e}")
+                REGISTRY.inc("native_exif_fallbacks_total", type=item.file_type)
+            else:
+                seconds = time.perf_counter() - started
+                if single_write:
+                    copy_to_output(item)
+                started = time.perf_counter()
+                item.bytes_written += apply_date_patches(item.output_file, patches, item.exif_data)
+                REGISTRY.observe("native_exif_seconds", seconds + time.perf_counter() - started)
+                REGISTRY.inc("native_exif_writes_total", type=item.file_type)
+                record(item, TAGGED)
+                logger.info(f"Patched the dates of {item.output_file} from {item.json_file}")
+                return
+        if dryRun:
+            logger.info(f"Would have written exif data using {item.json_file}")
+        elif xmp_writer is not None:
+            item.written = True
+            item.output_file = xmp_writer.write(item.output_file, item.exif_data, item.file)
+            item.bytes_written += os.path.getsize(item.output_file)
+            record(item, TAGGED)
+            logger.info(f"Wrote {item.output_file} with exif data from {item.json_file}")
+        elif single_write:
+            item.written = True
+            try:
+                item.output_file = write_exif_data_to_new_file(
+                    item.input_file, item.output_file, item.exif_data, pool=pool)  # tagged copy in one pass
+            except Exception:
+                # keep the plain copy the two-pass mode would have left behind
+                logger.debug(f"Copying {item.input_file} -> {item.output_file} without metadata")
+                result = copier.copy(item.input_file, item.output_file, modified=False, src_dev=item.device)
+                item.copy_strategy, item.checksum = result.strategy, result.checksum
+                item.bytes_written += result.bytes_copied
+                raise
+            item.bytes_written += os.path.getsize(item.output_file)
+            record(item, TAGGED)
+            logger.info(f"Wrote {item.output_file} with exif data from {item.json_file}")
+        else:
+            item.output_file = write_exif_data_to_file(
+                item.output_file, item.exif_data, pool=pool)  # update exif data
+            item.bytes_written += os.path.getsize(item.output_file)  # exiftool rewrites the whole file
+            record(item, TAGGED)
+            logger.info(f"Wrote exif data to {item.output_file} using {item.json_file}")
+
+    def verify_output(item: MergeItem):
+        if dryRun:
+            return
+        if not os.path.isfile(item.output_file):
+            raise RuntimeError(f"Output file {item.output_file} is missing after writing")
+        if verifier is not None:
+            verifier.add(item.output_file, expected_tags(item.exif_data, XMP_EXTENSION if xmp_writer is not None else item.file_type))
+        if journal is not None:
+            journal.record(item.file, item.size, item.mtime_ns, VERIFIED, item.output_file,
+                           content_hash=_content_hash(item, copier.checksum))
+
+    return [
+        Stage("parse", parse_sidecar, 1),
+        Stage("copy", copy_file, copy_jobs),
+        Stage("write", write_metadata, jobs),
+        Stage("verify", verify_output, 1),
+    ]
+
 # main function
-def merge_metadata(inputDir: str, outputDir: str, dryRun: bool = False, overwrite_if_exists: bool = False, progress_callback=None) -> bool:
+def merge_progress(result: MergeResult, summary: dict) -> dict:
+    """The progress update to show after `result`, from the `summary` that `iter_merge` keeps."""
+    # in recursive mode the total grows while the tree is still being walked
+    total_files = max(summary["total"] - summary["skipped"], summary["done"])
+    # the ETA goes by bytes, since one video takes as long as hundreds of photos
+    eta = eta_seconds(REGISTRY.gauge("done_bytes"), REGISTRY.gauge("planned_bytes"), time.time() - REGISTRY.started)
+    return {
+        'current': summary["done"],
+        'total': total_files,
+        'percent': int((summary["done"] / total_files) * 100),
+        'file': result.file,
+        'eta_seconds': eta,
+        'mute_in_log': True
+    }
+
+def iter_merge(inputDir: str, outputDir: str, dryRun: bool = False, overwrite_if_exists: bool = False,
+               exiftool_procs: int = EXIFTOOL_POOL_SIZE, recursive: bool = False, match_jobs: int = MATCH_WORKERS,
+               jobs: int = EXIFTOOL_POOL_SIZE, copy_jobs: int = COPY_WORKERS, single_write: bool = False,
+               copy_mode: str = "auto", checksum: str = None, hardlink_unchanged: bool = False,
+               resume: bool = False, journal_path: str = None, timezone_data: str = TZ_DATA_PATH,
+               plan_path: str = None, report_path: str = None, failures_path: str = None,
+               dedupe: str = None, dedupe_cache: str = DEDUPE_CACHE_PATH, xmp_only: bool = False,
+               native_exif: bool = False, native_video: bool = False, verify: bool = False,
+               summary: dict = None) -> Iterator[MergeResult]:
+    """Merge the sidecars of `inputDir` into the media files copied to `outputDir`, yielding a `MergeResult`
+    for every file as soon as it is done.
+
+    Nothing is kept per file once its result is out. Failures are appended to a JSON Lines file at
+    `failures_path`, by default OUTPUTDIR.failures.jsonl, as they happen. A `summary` dict passed in is
+    kept up to date while the run goes on (total, missing, ambiguous, skipped, done, failed). Once the
+    generator is exhausted, it also has the `verification` report and `ok`, whether every file was
+    merged. Closing the generator early stops the pipeline and removes the files it had started writing; outputs of files still waiting for the copy stage, possibly finished by an earlier run, are left alone.
+
+    Raises:
+        FileExistsError: If `outputDir` exists and neither `overwrite_if_exists` nor `resume` is set
+    """
+    journal = None
+    hash_cache = None
+    archive = None
+    verify_pool = None
+    verifier = None
+    failures = None
+    REGISTRY.reset()
+    summary = summary if summary is not None else {}
+    summary.update(total=0, missing=0, ambiguous=0, skipped=0, done=0, failed=0)
+    if report_path is None and not dryRun:
+        report_path = os.path.normpath(outputDir) + ".report.json"
+    if failures_path is None and not dryRun:
+        failures_path = os.path.normpath(outputDir) + ".failures.jsonl"
     try:
         # make output dir if not exists
         # will need to check if empty later
         if not dryRun:
             # delete output dir if it exists
-            if os.path.exists(outputDir) and not overwrite_if_exists:
-                logger.warning(f"Output directory {outputDir} already exists! Exiting.")
-                return False
+            if os.path.exists(outputDir) and not overwrite_if_exists and not resume:
+                raise FileExistsError(f"Output directory {outputDir} already exists! Exiting.")
+            elif os.path.exists(outputDir) and resume:
+                logger.info(f"Resuming into output directory {outputDir}")
             elif os.path.exists(outputDir) and overwrite_if_exists:
                 logger.info(f"Overwriting files in output directory {outputDir}")
             else:
                 logger.info(f"Creating output directory {outputDir}")
                 os.makedirs(outputDir, exist_ok=True)
+            journal = Journal(journal_path or default_journal_path(outputDir))
+            logger.info(f"Keeping track of progress in {journal.path}")
 
-        # first, get sidecar files
-        matched_files, missing_files, ambiguous_files = find_sidecar_files(
-            inputDir)
+        failures = FailureLog(None if dryRun else failures_path)
+        bytes_written = 0
+        copier = CopyEngine(copy_mode, checksum=checksum, hardlink_unchanged=hardlink_unchanged)
+        xmp_writer = None
+        if xmp_only:
+            xmp_writer = XmpWriter(journal.owner_of if journal is not None else None)
+            logger.info(f"Writing XMP sidecars to {outputDir} instead of copying the media files")
+        deduplicator = None
+        if dedupe and is_archive(inputDir):
+            logger.warning("Duplicates aren't looked for in archives, every file is processed")
+        elif dedupe and xmp_only:
+            logger.warning("Duplicates aren't looked for with --xmpOnly, no media is copied anyway")
+        elif dedupe:
+            hash_cache = HashCache(dedupe_cache)
+            deduplicator = Deduplicator(dedupe, copier, hash_cache, dryRun)
+            logger.info(f"Processing duplicate files once, the others are handled with policy {dedupe}")
+        timezones = load_timezones(timezone_data) if plan_path is None else None
+        if plan_path is not None:
+            logger.info(f"Executing merge plan {plan_path}")
+            items = _iter_plan_items(plan_path, inputDir, outputDir, dryRun, summary)
+        elif is_archive(inputDir):
+            archive = open_archive(inputDir)
+            def not_copied(item: MergeItem) -> bool:
+                # a tar is extracted as it is streamed, except for the files this run doesn't copy
+                return xmp_only or (resume and journal is not None and journal.is_done(item.file, item.size, item.mtime_ns))
 
-        # confirm that all files have a sidecar file
-        if len(missing_files) > 0:
-            logger.warning(f"Missing sidecar files for {len(missing_files)} files")
-        if len(ambiguous_files) > 0:
-            logger.warning(
-                f"Ambiguous sidecar files for {len(ambiguous_files)} files")
+            items = _iter_archive_items(archive, outputDir, dryRun, summary, skip=not_copied)
+            if single_write:
+                logger.info("Extracting every file before writing its metadata, exiftool can't read from the archive")
+                single_write = False
+        else:
+            items = _iter_merge_items(inputDir, outputDir, dryRun, recursive, match_jobs, summary)
+        done_bytes = 0
 
-        # turn matched_files into a dict
-        matched_files_dict = turn_tuple_list_into_dict(
-            matched_files)  # {file: json_file}
-        failed_files = {}
+        def finish(item: MergeItem) -> MergeResult:
+            nonlocal bytes_written, done_bytes
+            result = MergeResult.of(item)
+            bytes_written += item.bytes_written
+            REGISTRY.inc("written_bytes_total", item.bytes_written)
+            if result.failed:
+                logger.error(f"Error merging metadata for {item.file}: {item.error}")
+                failures.write(result)
+                summary["failed"] += 1
+                REGISTRY.inc("files_total", result="failed")
+                if journal is not None:
+                    journal.record(item.file, item.size, item.mtime_ns, FAILED, item.output_file, result.error)
+            else:
+                REGISTRY.inc("files_total", result="ok")
+
+            summary["done"] += 1
+            done_bytes += item.size
+            REGISTRY.set("done_bytes", done_bytes)
+            eta = eta_seconds(done_bytes, REGISTRY.gauge("planned_bytes"), time.time() - REGISTRY.started)
+            if eta is not None:
+                REGISTRY.set("eta_seconds", round(eta, 1))
+            return result
 
-        # merge metadata
-        with logging_redirect_tqdm():
-            total_files = len(matched_files_dict)
-            for idx, file in enumerate(tqdm(matched_files_dict, desc="copying metadata", leave=LEAVE_TQDM, dynamic_ncols=True, disable=dryRun)):
-                try:
+        verification = None
+        if verify and not dryRun:
+            # tags are read back in batches by exiftool processes of their own, next to the writers
+            verify_pool = ExifToolPool(max(exiftool_procs, 1))
+            verifier = Verifier(verify_pool)
+            logger.info("Reading back the tags of every file to check them")
+
+        # sidecars are parsed, files copied, tagged and checked in concurrent stages
+        with ExifToolPool(max(exiftool_procs, 1)) as pool:
+            stages = _build_stages(dryRun, pool, copier, jobs, copy_jobs, single_write, journal, timezones, archive,
+                                   xmp_writer, native_exif, native_video, verifier)
+            verify_output = stages[-1].func
+            if deduplicator is not None:
+                # duplicates are told apart by their tags too, so this comes after the parse stage
+                stages.insert(1, Stage("dedupe", deduplicator.mark, 1))
+            pipeline = Pipeline(stages)
+            items = _track_items(items, summary, journal, resume, from_archive=archive is not None)
+            try:
+                for item in pipeline.run(items):
                     # Check for interruption
                     eventlet.sleep(0)
-                    
-                    input_file = os.path.join(
-                        inputDir, file)  # input file with path
-                    json_file = os.path.join(
-                        inputDir, matched_files_dict[file])  # json file with path
-                    with open(json_file, "r") as f:
-                        json_data = json.load(f)
-                    exif_data_from_sidecar = parse_exif_data_from_sidecar(
-                        json_data)
-                    
-                    # copy file to output dir
-                    output_file = os.path.join(
-                        outputDir, file)  # output file with path
-                    if not dryRun:
-                        logger.debug(f"Copying {input_file} -> {output_file}")
-                        shutil.copy(input_file, output_file)  # copy file to output dir
-                    else:
-                        logger.info(f"Would have copied {input_file} -> {output_file}")
-
-                    # write to output dir
-                    if not dryRun:
-                        write_exif_data_to_file(
-                            output_file, exif_data_from_sidecar)  # update exif data
-                        logger.info(f"Wrote exif data to {output_file} using {json_file}")
-                    else:
-                        logger.info(f"Would have written exif data using {json_file}")
-
-                    # Send progress update through callback
-                    if progress_callback:
-                        current_progress = idx + 1
-                        percent = int((current_progress / total_files) * 100)
-                        progress_callback({
-                            'current': current_progress,
-                            'total': total_files,
-                            'percent': percent,
-                            'file': file,
-                            'mute_in_log': True
-                        })
-
-                except eventlet.greenlet.GreenletExit:
-                    logger.warning(f"Processing interrupted at file: {file}")
-                    if not dryRun and os.path.exists(output_file):
+                    # a duplicate is finished once the file it duplicates is
+                    for finished in deduplicator.resolve(item) if deduplicator is not None else [item]:
+                        if finished.duplicate_of is not None and finished.error is None:
+                            _verify_duplicate(finished, verify_output)
+                        yield finish(finished)
+            except (eventlet.greenlet.GreenletExit, KeyboardInterrupt, GeneratorExit):
+                for item in pipeline.stop():
+                    logger.warning(f"Processing interrupted at file: {item.file}")
+                    # an output this run hasn't got to yet may be a finished one from an earlier run
+                    if not dryRun and item.written and os.path.exists(item.output_file):
                         try:
-                            os.remove(output_file)
-                            logger.info(f"Cleaned up partial file: {output_file}")
+                            os.remove(item.output_file)
+                            logger.info(f"Cleaned up partial file: {item.output_file}")
                         except Exception as e:
-                            logger.error(f"Error cleaning up file {output_file}: {e}")
-                    raise
-                except Exception as e:
-                    logger.error(f"Error merging metadata for {file}: {e}")
-                    failed_files[file] = e
+                            logger.error(f"Error cleaning up file {item.output_file}: {e}")
+                raise
+            except BaseException:
+                pipeline.stop()
+                raise
+            if verifier is not None:
+                verification = verifier.finish()
 
-        if len(failed_files) > 0:
+        # confirm that all files have a sidecar file
+        total_files = summary["total"]
+        logger.info(f"Matched {total_files} files, {summary['missing']} missing and {summary['ambiguous']} ambiguous sidecar files")
+        if summary["skipped"] > 0:
+            logger.info(f"Skipped {summary['skipped']} files already completed by an earlier run")
+        if summary["missing"] > 0:
+            logger.warning(f"Missing sidecar files for {summary['missing']} files")
+        if summary["ambiguous"] > 0:
             logger.warning(
-                f"Failed to merge metadata for {len(failed_files)} files")
-            logger.warning(f"Failed files: {failed_files}")
-            return False
-        
-        logger.info(
-            f"Successfully merged metadata for all {len(matched_files_dict)} files. Copied from {inputDir} to {outputDir}")
-        return True
+                f"Ambiguous sidecar files for {summary['ambiguous']} files")
+        processed_files = total_files - summary["skipped"]
+        if not dryRun and processed_files > 0:
+            logger.info(f"Wrote {_format_bytes(bytes_written)} to {outputDir} "
+                        f"({_format_bytes(bytes_written / processed_files)} per file, "
+                        f"{'xmp sidecars' if xmp_only else 'single write' if single_write else 'copy then overwrite'})")
+        if copier.strategy_counts:
+            logger.info(f"Copy strategies used: {dict(copier.strategy_counts)}")
+        if deduplicator is not None:
+            logger.info(f"Found {len(deduplicator.decisions)} duplicate files, {_format_bytes(deduplicator.saved_bytes)} "
+                        f"of them weren't written again ({dedupe})")
+        if summary["skipped"] > 0:
+            REGISTRY.inc("files_total", summary["skipped"], result="skipped")
+        _log_stage_summary()
+        if verification is not None:
+            _log_verification(verification)
+        if report_path is not None:
+            REGISTRY.write_report(report_path, inputDir=inputDir, outputDir=outputDir, summary=summary,
+                                  failures=failures.path,
+                                  dedupe=deduplicator.report() if deduplicator is not None else None,
+                                  verification=verification)
+            logger.info(f"Wrote the run report to {report_path}")
+
+        summary["verification"] = verification
+        summary["ok"] = failures.count == 0 and not (verification is not None and verification["mismatches"])
+        if failures.count > 0:
+            logger.warning(f"Failed to merge metadata for {failures.count} files"
+                           + (f", they are listed in {failures.path}" if failures.path is not None else ""))
+        elif summary["ok"]:
+            logger.info(
+                f"Successfully merged metadata for all {total_files} files. Copied from {inputDir} to {outputDir}")
     except eventlet.greenlet.GreenletExit:
         logger.warning("Processing interrupted")
         raise
+    finally:
+        if failures is not None:
+            failures.close()
+        if journal is not None:
+            journal.close()
+        if hash_cache is not None:
+            hash_cache.close()
+        if archive is not None:
+            archive.close()
+        if verifier is not None:
+            verifier.close()
+        if verify_pool is not None:
+            verify_pool.close()
+
+def merge_metadata(inputDir: str, outputDir: str, dryRun: bool = False, overwrite_if_exists: bool = False, progress_callback=None,
+                   show_progress: bool = True, **options) -> bool:
+    """Run `iter_merge` to the end with a progress bar, calling `progress_callback` with a `merge_progress`
+    update after every file.
+
+    Args:
+        options: passed on to `iter_merge` (jobs, single_write, report_path, ...)
+
+    Returns:
+        bool: True if every file was merged, and verified with `verify`
+    """
+    summary = {}
+    results = iter_merge(inputDir, outputDir, dryRun, overwrite_if_exists, summary=summary, **options)
+    try:
+        with logging_redirect_tqdm(), \
+                tqdm(total=0, desc="copying metadata", leave=LEAVE_TQDM, dynamic_ncols=True, disable=dryRun or not show_progress) as progress:
+            for result in results:
+                update = merge_progress(result, summary)
+                progress.total = update["total"]
+                progress.update(1)
+                # Send progress update through callback
+                if progress_callback:
+                    progress_callback(update)
+        return summary["ok"]
+    except FileExistsError as e:
+        logger.warning(str(e))
+        return False
     except Exception as e:
         logger.error(f"Unexpected error during processing: {e}")
         return False
+    finally:
+        results.close()
+
+
+def _log_verification(verification: dict):
+    logger.info(f"Read back the tags of {verification['checked']} files")
+    if verification["mismatches"]:
+        logger.warning(f"{verification['mismatched_files']} files don't have the tags that were written:")
+        for mismatch in verification["mismatches"][:20]:
+            if "error" in mismatch:
+                logger.warning(f"  {mismatch['file']}: {mismatch['error']}")
+            else:
+                logger.warning(f"  {mismatch['file']}: {mismatch['tag']} is {mismatch['found']!r}, expected {mismatch['expected']!r}")
+        if len(verification["mismatches"]) > 20:
+            logger.warning(f"  ... and {len(verification['mismatches']) - 20} more, see the report")
+
+
+def verify_merge(inputDir: str, outputDir: str, recursive: bool = False, match_jobs: int = MATCH_WORKERS,
+                 timezone_data: str = TZ_DATA_PATH, plan_path: str = None, exiftool_procs: int = EXIFTOOL_POOL_SIZE,
+                 xmp_only: bool = False, report_path: str = None) -> bool:
+    """Check an output tree from an earlier run against the sidecars (or the plan) it was made from,
+    without writing anything to it. Files are matched and parsed like a merge would, and their tags
+    are read back in batches.
+
+    The mismatches are written to a JSON report at `report_path`, by default OUTPUTDIR.verify.json.
+    """
+    REGISTRY.reset()
+    report_path = report_path or os.path.normpath(outputDir) + ".verify.json"
+    summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+    archive = None
+    missing_outputs = []
+    unparsed = {}
+    try:
+        if plan_path is not None:
+            timezones = None
+            items = iter_plan(plan_path, inputDir, outputDir, summary)
+        elif is_archive(inputDir):
+            timezones = load_timezones(timezone_data)
+            archive = open_archive(inputDir)
+            items = _iter_archive_items(archive, outputDir, True, summary)
+        else:
+            timezones = load_timezones(timezone_data)
+            items = _iter_merge_items(inputDir, outputDir, True, recursive, match_jobs, summary)
+        with ExifToolPool(max(exiftool_procs, 1)) as pool:
+            verifier = Verifier(pool)
+            try:
+                for item in items:
+                    if not item.exif_data:
+                        try:
+                            _parse_sidecar(item, timezones, archive)
+                        except Exception as e:
+                            unparsed[item.file] = str(e)
+                            continue
+                    if xmp_only:
+                        item.output_file, item.file_type = xmp_path(item.output_file), XMP_EXTENSION
+                    if not os.path.isfile(item.output_file):
+                        missing_outputs.append(item.output_file)
+                        continue
+                    verifier.add(item.output_file, expected_tags(item.exif_data, item.file_type))
+                verification = verifier.finish()
+            finally:
+                verifier.close()
+    finally:
+        if archive is not None:
+            archive.close()
+
+    _log_verification(verification)
+    if missing_outputs:
+        logger.warning(f"{len(missing_outputs)} files are missing from {outputDir}")
+    if unparsed:
+        logger.warning(f"Couldn't parse the sidecars of {len(unparsed)} files: {unparsed}")
+    REGISTRY.write_report(report_path, inputDir=inputDir, outputDir=outputDir, summary=summary,
+                          verification=verification, missing=sorted(missing_outputs), failed=unparsed)
+    logger.info(f"Wrote the verification report to {report_path}")
+    return not verification["mismatches"] and not missing_outputs and not unparsed
+
+
+def plan_merge(inputDir: str, outputDir: str, plan_path: str, recursive: bool = False, match_jobs: int = MATCH_WORKERS,
+               timezone_data: str = TZ_DATA_PATH) -> bool:
+    """Match sidecars, recognise file types and work out the tags for every file, and write all of it to
+    a merge plan at `plan_path` instead of copying anything. `merge_metadata(..., plan_path=...)` then
+    executes the plan without listing, matching or parsing anything again.
+    """
+    summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+    failed_files = 0
+    timezones = load_timezones(timezone_data)
+    pipeline = Pipeline([Stage("parse", lambda item: _parse_sidecar(item, timezones))])
+
+    def parsed_items() -> Iterator[MergeItem]:
+        nonlocal failed_files
+        for item in pipeline.run(_iter_merge_items(inputDir, outputDir, True, recursive, match_jobs, summary)):
+            if item.error is not None:
+                logger.error(f"Error parsing the sidecar of {item.file}: {item.error}")
+                failed_files += 1
+                continue
+            yield item
+
+    try:
+        planned = write_plan(plan_path, inputDir, outputDir, parsed_items(), summary)
+    except Exception as e:
+        pipeline.stop()
+        logger.error(f"Unexpected error while planning: {e}")
+        return False
+    logger.info(f"Wrote a plan for {planned} files to {plan_path}, {summary['missing']} missing and "
+                f"{summary['ambiguous']} ambiguous sidecar files")
+    if failed_files > 0:
+        logger.warning(f"Left {failed_files} files out of the plan, see the errors above")
+        return False
+    return True
+
+def _positive_int(value: str) -> int:
+    """argparse type for worker counts: a stage without workers would never finish."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 if __name__ == "__main__":
     logger.info(f"Welcome to google-photos-exif-merger by @ckinateder!\n--")
     parser = argparse.ArgumentParser()
-    parser.add_argument("--inputDir", type=str, required=True,
-                        help="Input directory to read files from")
-    parser.add_argument("--outputDir", type=str, required=True,
+    parser.add_argument("--inputDir", type=str, required=False,
+                        help="Input directory to read files from, or a Takeout .zip/.tgz archive (any part of a multi-part export)")
+    parser.add_argument("--outputDir", type=str, required=False,
                         help="Output directory to COPY files into")
     parser.add_argument("--logLevel", type=str, default="INFO", choices=[
                         "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Logging level")
@@ -144,10 +786,76 @@ if __name__ == "__main__":
                         help="Prints what it will do but doesn't execute")
     parser.add_argument("--overwriteIfExists", action="store_true",
                         help="Overwrite the output directory if it exists")
+    parser.add_argument("--exiftoolProcs", type=int, default=EXIFTOOL_POOL_SIZE,
+                        help="Number of long-lived exiftool processes to keep running")
+    parser.add_argument("--jobs", type=_positive_int, default=EXIFTOOL_POOL_SIZE,
+                        help="Number of files having their metadata written at the same time")
+    parser.add_argument("--copyJobs", type=_positive_int, default=COPY_WORKERS,
+                        help="Number of files being copied at the same time")
+    parser.add_argument("--singleWrite", action="store_true",
+                        help="Write each tagged file straight from the source instead of copying it first and then rewriting the copy")
+    parser.add_argument("--copyMode", type=str, default="auto", choices=COPY_MODES,
+                        help="How files are copied: reflink, kernel-side copy, or a buffered loop. 'auto' picks the fastest that works")
+    parser.add_argument("--checksum", type=str, default=None, choices=["md5", "sha1", "sha256", "blake2b"],
+                        help="Hash every file while copying it")
+    parser.add_argument("--hardlinkUnchanged", action="store_true",
+                        help="Hardlink files that end up in the output without any metadata change instead of copying them")
+    parser.add_argument("--dedupe", type=str, default=None, choices=DEDUPE_POLICIES,
+                        help="Process files with the same contents (the same photo in several albums) once, and hardlink, reflink or skip the other copies")
+    parser.add_argument("--dedupeCache", type=str, default=DEDUPE_CACHE_PATH,
+                        help="SQLite cache of file hashes used by --dedupe, kept between runs")
+    parser.add_argument("--xmpOnly", action="store_true",
+                        help="Write an .xmp sidecar with the corrected dates for every file into outputDir instead of copying the media")
+    parser.add_argument("--nativeExif", action="store_true",
+                        help="Write the metadata of JPEG, PNG and WebP files without exiftool, in the same pass that copies them")
+    parser.add_argument("--nativeVideo", action="store_true",
+                        help="Patch the dates of MP4 and QuickTime videos in place in the copy instead of having exiftool rewrite the whole file")
+    parser.add_argument("--verify", action="store_true",
+                        help="Read back the tags of every written file in batches and report the ones that don't match")
+    parser.add_argument("--verifyOnly", action="store_true",
+                        help="Only check the tags of an output tree from an earlier run against the sidecars, writing nothing")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an earlier run into an existing output directory, redoing only files that didn't finish")
+    parser.add_argument("--journal", type=str, default=None,
+                        help="Path of the progress journal. Defaults to OUTPUTDIR.journal.sqlite next to the output directory")
+    parser.add_argument("--writePlan", type=str, default=None,
+                        help="Match, detect and parse everything, and write the merge plan to this file instead of copying")
+    parser.add_argument("--executePlan", type=str, default=None,
+                        help="Carry out a plan from --writePlan. --inputDir and --outputDir default to the ones it was made for")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Split the work into this many byte-balanced shards, handed out to worker processes by a coordinator")
+    parser.add_argument("--shardWorkers", type=int, default=2,
+                        help="Number of local worker processes for --shards")
+    parser.add_argument("--coordinator", type=str, default="127.0.0.1:0",
+                        help="HOST:PORT the shard coordinator listens on. Use an address other machines can reach to add remote workers")
+    parser.add_argument("--shardWorker", type=str, default=None,
+                        help="Run as a shard worker for the coordinator at this URL")
+    parser.add_argument("--tzData", type=str, default=TZ_DATA_PATH,
+                        help="Timezone boundary GeoJSON (or a zip of it) used to find the timezone each photo was taken in")
+    parser.add_argument("--report", type=str, default=None,
+                        help="Path of the JSON run report with per-stage timings. Defaults to OUTPUTDIR.report.json next to the output directory")
+    parser.add_argument("--failures", type=str, default=None,
+                        help="Path of the JSON Lines file the failed files are written to as they fail. Defaults to OUTPUTDIR.failures.jsonl")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Process every directory under inputDir, mirroring the layout in outputDir")
+    parser.add_argument("--matchJobs", type=_positive_int, default=MATCH_WORKERS,
+                        help="Number of processes matching sidecars in recursive mode")
     args = parser.parse_args()
 
     # argument validation
+    if args.shardWorker:
+        logger.setLevel(getattr(logging, args.logLevel))
+        run_worker(args.shardWorker)
+        raise SystemExit(0)
+    if args.executePlan:
+        plan_header = read_plan_header(args.executePlan)
+        args.inputDir = args.inputDir or plan_header["inputDir"]
+        args.outputDir = args.outputDir or plan_header["outputDir"]
+    if not args.inputDir or not args.outputDir:
+        parser.error("--inputDir and --outputDir are required")
     assert args.inputDir != args.outputDir, "Input directory must be different than output directory!"
+    if is_archive(args.inputDir) and (args.writePlan or args.shards > 0 or args.testCaseDir):
+        parser.error("--writePlan, --shards and --testCaseDir need an input directory, not an archive")
 
     # Set log level from command line argument
     logger.setLevel(getattr(logging, args.logLevel))
@@ -160,5 +868,34 @@ if __name__ == "__main__":
         matched_files, missing_files, ambiguous_files = find_sidecar_files(
             args.inputDir, args.testCaseDir)
         logger.info(f"Exiting")
+    elif args.verifyOnly:
+        if not verify_merge(args.inputDir, args.outputDir, recursive=args.recursive, match_jobs=args.matchJobs,
+                            timezone_data=args.tzData, plan_path=args.executePlan, exiftool_procs=args.exiftoolProcs,
+                            xmp_only=args.xmpOnly, report_path=args.report):
+            raise SystemExit(1)
+    elif args.shards > 0:
+        host, port = args.coordinator.rsplit(":", 1)
+        plan_path = args.executePlan
+        if plan_path is None:
+            plan_path = os.path.normpath(args.outputDir) + ".plan.jsonl.gz"
+            if not plan_merge(args.inputDir, args.outputDir, plan_path, recursive=args.recursive,
+                              match_jobs=args.matchJobs, timezone_data=args.tzData):
+                raise SystemExit(1)
+        run_sharded(plan_path, args.inputDir, args.outputDir, args.shards, args.shardWorkers, host=host, port=int(port),
+                    overwrite_if_exists=args.overwriteIfExists, resume=args.resume, dryRun=args.dryRun, exiftool_procs=args.exiftoolProcs, jobs=args.jobs,
+                    copy_jobs=args.copyJobs, single_write=args.singleWrite, copy_mode=args.copyMode,
+                    checksum=args.checksum, hardlink_unchanged=args.hardlinkUnchanged, dedupe=args.dedupe,
+                    dedupe_cache=args.dedupeCache, xmp_only=args.xmpOnly, native_exif=args.nativeExif,
+                    native_video=args.nativeVideo, verify=args.verify)
+    elif args.writePlan:
+        plan_merge(args.inputDir, args.outputDir, args.writePlan, recursive=args.recursive,
+                   match_jobs=args.matchJobs, timezone_data=args.tzData)
     else:
-        merge_metadata(args.inputDir, args.outputDir, args.dryRun, args.overwriteIfExists)
+        merge_metadata(args.inputDir, args.outputDir, args.dryRun, args.overwriteIfExists,
+                       exiftool_procs=args.exiftoolProcs, recursive=args.recursive, match_jobs=args.matchJobs,
+                       jobs=args.jobs, copy_jobs=args.copyJobs, single_write=args.singleWrite,
+                       copy_mode=args.copyMode, checksum=args.checksum, hardlink_unchanged=args.hardlinkUnchanged,
+                       resume=args.resume, journal_path=args.journal, timezone_data=args.tzData,
+                       plan_path=args.executePlan, report_path=args.report, failures_path=args.failures, dedupe=args.dedupe,
+                       dedupe_cache=args.dedupeCache, xmp_only=args.xmpOnly, native_exif=args.nativeExif,
+                       native_video=args.nativeVideo, verify=args.verify)
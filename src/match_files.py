@@ -1,11 +1,19 @@
 import os
 import re
 import pdb
-from typing import Union, List, Tuple, Dict
-from util import _format_list, _find_in_matched, _list_files
+import queue
+import threading
+import time
+import multiprocessing
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Union, List, Tuple, Dict, Iterator
+from util import _format_list
+from catalog import FileCatalog, walk_catalogs, MEDIA, SIDECAR, OTHER
+from metrics import REGISTRY
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
-from __init__ import JSON_EXTENSION, MEDIA_EXTENSIONS, LEAVE_TQDM, LIVE_PHOTO_EXTENSION, IN_PKL_NAME, OUT_PKL_NAME, PROPS_JSON_NAME
+from __init__ import JSON_EXTENSION, MEDIA_EXTENSIONS, LEAVE_TQDM, LIVE_PHOTO_EXTENSION, IN_PKL_NAME, OUT_PKL_NAME, PROPS_JSON_NAME, MATCH_WORKERS
 import logging
 import json
 import pickle
@@ -13,12 +21,99 @@ import pickle
 
 logger = logging.getLogger(__name__)
 
-def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]], List[str], List[Tuple[str, Tuple[str]]]]:
+class SidecarIndex:
+    """
+    Lookup structure over the json names of one directory, built once per directory.
+
+    Every matching pattern used by `match_files_from_file_list` is anchored at the start of the
+    json name and begins with a literal (the media stem, optionally followed by its extension),
+    so the json names are kept sorted and each pattern only has to be tried on the short run of
+    names that share that literal prefix. Exact lookups go through a set.
+    """
+    # Google cuts long names down to 46 characters before adding the .json extension
+    TRUNCATED_STEM_LENGTH = 46
+
+    def __init__(self, json_files: List[str]):
+        self.sorted_names = sorted(json_files)
+        self.names = set(json_files)
+        truncated_length = self.TRUNCATED_STEM_LENGTH + len(JSON_EXTENSION)
+        self.truncated = {name for name in json_files if len(name) == truncated_length and name.endswith(JSON_EXTENSION)}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def with_prefix(self, prefix: str) -> List[str]:
+        """Return every json name that starts with `prefix`, found by bisecting the sorted names."""
+        names = self.sorted_names
+        i = bisect_left(names, prefix)
+        found = []
+        while i < len(names) and names[i].startswith(prefix):
+            found.append(names[i])
+            i += 1
+        return found
+
+    def match(self, pattern: "re.Pattern", prefix: str) -> List[str]:
+        """Return the json names starting with `prefix` that `pattern` matches."""
+        return [name for name in self.with_prefix(prefix) if pattern.match(name)]
+
+    def truncated_sidecar(self, basename: str) -> Union[str, None]:
+        """Return the json named after the first 46 characters of `basename`, if there is one."""
+        if len(basename) <= self.TRUNCATED_STEM_LENGTH:
+            return None
+        cutoff_file = basename[:self.TRUNCATED_STEM_LENGTH] + JSON_EXTENSION
+        return cutoff_file if cutoff_file in self.truncated else None
+
+class MatchedIndex:
+    """
+    Substring index over the media names of already matched (media_file, json_file) tuples.
+
+    Every media name is split into character trigrams, and each trigram maps to the ascending
+    positions of the names that contain it. A name containing `item` contains all of its trigrams,
+    so only the shortest of those posting lists has to be checked, in order, to find the same
+    first match a linear scan with `item in media_file` would.
+    """
+    GRAM = 3
+
+    def __init__(self, matched_files: List[Tuple[str, str]]):
+        self.matched_files = list(matched_files)
+        self.postings: Dict[str, List[int]] = {}
+        for position, (media_file, _) in enumerate(self.matched_files):
+            for gram in {media_file[i:i + self.GRAM] for i in range(len(media_file) - self.GRAM + 1)}:
+                self.postings.setdefault(gram, []).append(position)
+
+    def find(self, item: str) -> Union[Tuple[str, str], None]:
+        """Return the first matched tuple whose media name contains `item`, or None."""
+        if len(item) < self.GRAM:
+            candidates = range(len(self.matched_files))
+        else:
+            grams = {item[i:i + self.GRAM] for i in range(len(item) - self.GRAM + 1)}
+            candidates = min((self.postings.get(gram, []) for gram in grams), key=len)
+        for position in candidates:
+            if item in self.matched_files[position][0]:
+                return self.matched_files[position]
+        return None
+
+def match_files_from_file_list(filenames: List[str]=0, show_progress: bool = True) -> Union[List[Tuple[str]], List[str], List[Tuple[str, Tuple[str]]]]:
     """
     This function will match the json metadata files with the images in the same directory. There will be a default matching scheme, but there will be cases for other matching schemes.
 
     Args:
-        directory (str): The directory to match the files in.
+        filenames (List[str]): The names of the files in the directory to match.
+        show_progress (bool, optional): Show tqdm bars. Defaults to True.
+
+    Returns:
+        Union[List[Tuple[str]], List[str], List[Tuple[str, Tuple[str]]]]:
+            Matched files, missing files, ambiguous files
+    """
+    return match_files_from_catalog(FileCatalog.from_names("", filenames), show_progress)
+
+def match_files_from_catalog(catalog: FileCatalog, show_progress: bool = True) -> Union[List[Tuple[str]], List[str], List[Tuple[str, Tuple[str]]]]:
+    """
+    Match the json metadata files with the media files of one directory, from its catalog.
+
+    Args:
+        catalog (FileCatalog): The files of the directory.
+        show_progress (bool, optional): Show tqdm bars. Defaults to True.
 
     Returns:
         Union[List[Tuple[str]], List[str], List[Tuple[str, Tuple[str]]]]:
@@ -31,9 +126,10 @@ def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]]
     ambiguous_files = []
 
     # stage 1: match the json files with the media files
-    all_json_files = [f for f in filenames if os.path.splitext(f)[1].lower() == JSON_EXTENSION]
-    all_media_files = [f for f in filenames if os.path.splitext(f)[1].lower() in MEDIA_EXTENSIONS]
-    skipped_files = [f for f in filenames if os.path.splitext(f)[1].lower() not in MEDIA_EXTENSIONS and os.path.splitext(f)[1].lower() != JSON_EXTENSION]
+    all_json_files = catalog.names_of(SIDECAR)
+    all_media_files = catalog.names_of(MEDIA)
+    skipped_files = catalog.names_of(OTHER)
+    json_index = SidecarIndex(all_json_files)
     
     if len(skipped_files) > 0:
         logger.info(f"Skipping the following files: {skipped_files}")
@@ -43,7 +139,7 @@ def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]]
     logger.info(f"Found {total_media_files} media files and {total_json_files} json files")
 
     with logging_redirect_tqdm():
-        for file in tqdm(all_media_files, desc="finding sidecars", leave=LEAVE_TQDM, dynamic_ncols=True):
+        for file in tqdm(all_media_files, desc="finding sidecars", leave=LEAVE_TQDM, dynamic_ncols=True, disable=not show_progress):
             basename = os.path.splitext(file)[0]
             media_extension = os.path.splitext(file)[1]
             msg = f"Checking '{file}'... "
@@ -59,22 +155,20 @@ def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]]
                 # Has counter: look for name.ext.*counter.json
                 name = counter_match.group(1)
                 counter = counter_match.group(2)
+                prefix = f"{name}{media_extension}"
                 pattern = f"{re.escape(name)}{re.escape(media_extension)}.*{re.escape(counter)}{re.escape(JSON_EXTENSION)}"
             else:
                 # No counter: look for basename.ext.*.json (but exclude files with counters)
+                prefix = f"{basename}{media_extension}."
                 pattern = f"{re.escape(basename)}{re.escape(media_extension)}\\.[^()]+{re.escape(JSON_EXTENSION)}"
             
             # Find matches
-            for json_file in all_json_files:
-                if re.match(pattern, json_file):
-                    potential_jsons.append(json_file)
+            potential_jsons += json_index.match(re.compile(pattern), prefix)
             
             # Fallback: if no counter and no matches, try loose matching
             if not counter_match and not potential_jsons:
-                fallback_pattern = f"^{re.escape(basename)}.*{re.escape(JSON_EXTENSION)}$"
-                for json_file in all_json_files:
-                    if re.match(fallback_pattern, json_file) and '(' not in json_file:
-                        potential_jsons.append(json_file)
+                fallback_pattern = re.compile(f"^{re.escape(basename)}.*{re.escape(JSON_EXTENSION)}$")
+                potential_jsons += [json_file for json_file in json_index.match(fallback_pattern, basename) if '(' not in json_file]
             
             # Handle special trailing characters
             if basename.endswith(('_n-', '_n', '_')):
@@ -98,19 +192,19 @@ def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]]
     if len(missing_files) > 0:
         logger.info(f"Attempting to fix {len(missing_files)} missing metadata files...")
         recovered = []
+        matched_index = MatchedIndex(matched_files)
         with logging_redirect_tqdm():
-            for file in tqdm(missing_files, desc="fixing missing files", leave=LEAVE_TQDM, dynamic_ncols=True):
+            for file in tqdm(missing_files, desc="fixing missing files", leave=LEAVE_TQDM, dynamic_ncols=True, disable=not show_progress):
                 basename = os.path.splitext(file)[0]
         
                 # Check for filename cutoff at 46 characters
-                if len(basename) >= 47:
-                    cutoff_file = basename[:46] + JSON_EXTENSION
-                    if cutoff_file in all_json_files:
-                        recovered.append((file, cutoff_file))
-                        continue
+                cutoff_file = json_index.truncated_sidecar(basename)
+                if cutoff_file:
+                    recovered.append((file, cutoff_file))
+                    continue
                 
                 # Look for exact basename match in already matched files
-                existing_match = _find_in_matched(matched_files, basename)
+                existing_match = matched_index.find(basename)
                 if existing_match:
                     logger.debug(f"Found {basename} in matched, falling back.")
                     recovered.append((file, existing_match[1]))
@@ -119,7 +213,7 @@ def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]]
                 # Try removing counter like (1), (2) and search again
                 if basename.endswith(')') and '(' in basename:
                     basename_no_counter = re.sub(r'\(\d+\)$', '', basename)
-                    existing_match = _find_in_matched(matched_files, basename_no_counter)
+                    existing_match = matched_index.find(basename_no_counter)
                     if existing_match:
                         logger.debug(f"Found {basename} in matched, falling back.")
                         recovered.append((file, existing_match[1]))
@@ -128,16 +222,15 @@ def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]]
         # move found files into matched_files
         logger.info(f"Recovered {len(recovered)} missing metadata files.")
         matched_files += recovered
-        for f, _ in recovered:
-            missing_files.remove(f)
-        
-        recovered = []
+        recovered_fs = {f for f, _ in recovered}
+        missing_files = [f for f in missing_files if f not in recovered_fs]
 
     # stage 3: examine all the ambiguous files. this happens a lot with live photos
     if len(ambiguous_files) > 0:
+        recovered = []
         logger.info(f"Attempting to fix {len(ambiguous_files)} ambiguous metadata files...")
         with logging_redirect_tqdm():
-            for file, prospects in tqdm(ambiguous_files, desc="fixing ambiguous files", leave=LEAVE_TQDM, dynamic_ncols=True):
+            for file, prospects in tqdm(ambiguous_files, desc="fixing ambiguous files", leave=LEAVE_TQDM, dynamic_ncols=True, disable=not show_progress):
                 basename = os.path.splitext(file)[0]
                 media_extension = os.path.splitext(file)[1]
                 if media_extension.lower() == LIVE_PHOTO_EXTENSION: # if live photo
@@ -150,12 +243,8 @@ def match_files_from_file_list(filenames: List[str]=0) -> Union[List[Tuple[str]]
 
         # remove from list
         if len(recovered) > 0:
-            recovered_fs, _ = zip(*recovered)
-            for i, (f, _) in enumerate(ambiguous_files):
-                if f in recovered_fs:
-                    ambiguous_files[i] = None
-            
-            ambiguous_files = [x for x in ambiguous_files if x is not None]
+            recovered_fs = {f for f, _ in recovered}
+            ambiguous_files = [x for x in ambiguous_files if x[0] not in recovered_fs]
     
     # sort by name
     matched_files.sort(key=lambda x: x[0])
@@ -186,16 +275,30 @@ def turn_tuple_list_into_dict(tuple_list:List[Tuple[str, str]]) -> Dict[str, str
     assert len(tuple_list) == len(set(tuple_list)), "Duplicate files in tuple list"
     return {file: json_file for file, json_file in tuple_list}
 
-def find_sidecar_files(directory:str, test_case_dir:str = None):
-    files_in_directory = _list_files(directory)
-    
-    matched_files, missing_files, ambiguous_files = match_files_from_file_list(files_in_directory)
+def _validate_matches(catalog:FileCatalog, matched_files:List[Tuple[str, str]], show_progress:bool = True):
+    # the catalog saw every file of the directory, so this doesn't touch the filesystem again
     with logging_redirect_tqdm():
-        for media_file, json_file in tqdm(matched_files, desc="validating", leave=LEAVE_TQDM, dynamic_ncols=True):
-            full_media_file = os.path.join(directory, media_file)
-            assert os.path.isfile(full_media_file), f"{full_media_file} doesn't exist!"
-            full_json_file = os.path.join(directory, json_file)
-            assert os.path.isfile(full_json_file), f"{full_json_file} doesn't exist!"
+        for media_file, json_file in tqdm(matched_files, desc="validating", leave=LEAVE_TQDM, dynamic_ncols=True, disable=not show_progress):
+            assert media_file in catalog, f"{os.path.join(catalog.directory, media_file)} doesn't exist!"
+            assert json_file in catalog, f"{os.path.join(catalog.directory, json_file)} doesn't exist!"
+
+def _scan_directory(directory:str) -> FileCatalog:
+    with REGISTRY.timer("list_seconds"):
+        try:
+            return FileCatalog.scan(directory)[0]
+        except FileNotFoundError:
+            logger.warning(f"Directory '{directory}' not found!")
+            return FileCatalog(directory)
+
+def find_sidecar_files(directory:str, test_case_dir:str = None, catalog:FileCatalog = None):
+    if catalog is None:
+        catalog = _scan_directory(directory)
+    files_in_directory = catalog.names
+    
+    with REGISTRY.timer("match_seconds"):
+        matched_files, missing_files, ambiguous_files = match_files_from_catalog(catalog)
+    with REGISTRY.timer("validate_seconds"):
+        _validate_matches(catalog, matched_files)
 
     if test_case_dir:
         logger.info(f"Saving test cases to {test_case_dir}...")
@@ -215,4 +318,87 @@ def find_sidecar_files(directory:str, test_case_dir:str = None):
             
         logger.info(f"I/O saved to in.pkl, out.pkl, and props.json in {test_case_dir}.")
 
-    return matched_files, missing_files, ambiguous_files
\ No newline at end of file
+    return matched_files, missing_files, ambiguous_files
+
+def _match_directory(relative_dir:str, catalog:FileCatalog):
+    """
+    Match and validate the files of one directory of a tree. Runs in a worker process in recursive mode,
+    which is safe because a media file and its sidecar always live in the same directory.
+
+    Returns:
+        Tuple: relative_dir, then matched, missing and ambiguous files with paths relative to `root`, then
+            the seconds spent matching and validating, since the worker's metrics don't reach the parent
+    """
+    start = time.perf_counter()
+    matched_files, missing_files, ambiguous_files = match_files_from_catalog(catalog, show_progress=False)
+    matched = time.perf_counter()
+    _validate_matches(catalog, matched_files, show_progress=False)
+    timings = {"match_seconds": matched - start, "validate_seconds": time.perf_counter() - matched}
+    if relative_dir:
+        join = lambda name: os.path.join(relative_dir, name)
+        matched_files = [(join(media_file), join(json_file)) for media_file, json_file in matched_files]
+        missing_files = [join(media_file) for media_file in missing_files]
+        ambiguous_files = [(join(media_file), [join(j) for j in prospects]) for media_file, prospects in ambiguous_files]
+    return relative_dir, matched_files, missing_files, ambiguous_files, timings
+
+def iter_sidecar_files(directory:str, recursive:bool = False, workers:int = MATCH_WORKERS) -> Iterator[Tuple[str, List[Tuple[str, str]], List[str], List[Tuple[str, List[str]]], FileCatalog]]:
+    """
+    Find sidecar files directory by directory.
+
+    In recursive mode the tree is walked with os.scandir on a background thread and every directory is
+    matched in a process pool as soon as it is listed, so callers can start merging the first albums
+    while the rest of the tree is still being walked and matched.
+
+    Args:
+        directory (str): The directory (or root of the tree) to match the files in.
+        recursive (bool, optional): Descend into subdirectories. Defaults to False.
+        workers (int, optional): Matching processes in recursive mode. Defaults to MATCH_WORKERS.
+
+    Yields:
+        Tuple: (relative_dir, matched_files, missing_files, ambiguous_files, catalog) per directory, in completion
+            order, with every path relative to `directory` except the names in the directory's catalog
+    """
+    if not recursive:
+        catalog = _scan_directory(directory)
+        matched_files, missing_files, ambiguous_files = find_sidecar_files(directory, catalog=catalog)
+        yield "", matched_files, missing_files, ambiguous_files, catalog
+        return
+
+    results = queue.Queue()
+    stop = threading.Event()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def walk():
+        futures = []
+        try:
+            listed = time.perf_counter()
+            for relative_dir, catalog in walk_catalogs(directory):
+                REGISTRY.observe("list_seconds", time.perf_counter() - listed)
+                if stop.is_set():
+                    break
+                if len(catalog):
+                    future = executor.submit(_match_directory, relative_dir, catalog)
+                    future.add_done_callback(lambda future, catalog=catalog: results.put((future, catalog)))
+                    futures.append(future)
+                listed = time.perf_counter()
+            logger.info(f"Walked {directory}, matching {len(futures)} directories")
+        except Exception as e:
+            if not stop.is_set():
+                logger.error(f"Error walking {directory}: {e}")
+        finally:
+            wait(futures)
+            results.put(None)
+
+    walker = threading.Thread(target=walk, name="sidecar-walker", daemon=True)
+    walker.start()
+    try:
+        while (done := results.get()) is not None:
+            future, catalog = done
+            *result, timings = future.result()
+            for name, seconds in timings.items():
+                REGISTRY.observe(name, seconds)
+            yield (*result, catalog)
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        walker.join()
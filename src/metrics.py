@@ -0,0 +1,239 @@
+import bisect
+import copy
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# upper bounds in seconds, from a millisecond to a minute
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# what the metrics recorded during a run are, for the HELP and TYPE lines of /metrics
+DESCRIPTIONS = {
+    "stage_seconds": ("histogram", "Time spent on one file in each merge stage"),
+    "list_seconds": ("histogram", "Time spent listing one directory"),
+    "match_seconds": ("histogram", "Time spent matching the sidecars of one directory"),
+    "validate_seconds": ("histogram", "Time spent checking the matched files of one directory exist"),
+    "exiftool_seconds": ("histogram", "Latency of one exiftool command"),
+    "exiftool_calls_total": ("counter", "exiftool commands run"),
+    "exiftool_retries_total": ("counter", "exiftool commands run again, by reason"),
+    "copied_bytes_total": ("counter", "Bytes copied into the output directory, by strategy"),
+    "written_bytes_total": ("counter", "Bytes written to the output disk"),
+    "files_total": ("counter", "Files finished, by result"),
+    "planned_bytes": ("gauge", "Bytes of source media planned so far"),
+    "done_bytes": ("gauge", "Bytes of source media finished so far"),
+    "eta_seconds": ("gauge", "Estimated time left, from the byte rate so far"),
+    "dedupe_files_total": ("counter", "Files found to duplicate an earlier file, by dedupe policy"),
+    "dedupe_saved_bytes_total": ("counter", "Bytes of duplicates that weren't copied or tagged again"),
+    "dedupe_hashed_bytes_total": ("counter", "Bytes read to hash files for dedupe, by partial or full hash"),
+    "dedupe_cache_hits_total": ("counter", "File hashes found in the dedupe hash cache"),
+    "native_exif_seconds": ("histogram", "Time spent writing one file's metadata without exiftool"),
+    "native_exif_writes_total": ("counter", "Files whose metadata was written without exiftool, by type"),
+    "native_exif_fallbacks_total": ("counter", "Files handed to exiftool after writing them without it failed, by type"),
+    "verify_seconds": ("histogram", "Time spent reading back the tags of one batch of files"),
+    "verified_files_total": ("counter", "Files whose tags were read back and compared"),
+    "verify_mismatches_total": ("counter", "Tags read back with a different value than was written, or files that couldn't be read"),
+}
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> _Key:
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _bucket_bounds(histogram: "Histogram") -> List[str]:
+    return [repr(float(bound)) for bound in histogram.buckets] + ["+Inf"]
+
+
+def eta_seconds(done: float, total: float, elapsed: float) -> float:
+    """Time left to get from `done` to `total` at the average rate so far, or None before there is a rate."""
+    if done <= 0 or elapsed <= 0:
+        return None
+    return max(total - done, 0) * elapsed / done
+
+
+class Histogram:
+    """Counts observations into fixed buckets, Prometheus style, and keeps their sum, min and max."""
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating inside the bucket it falls in."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        if self.count == 0:
+            return {"count": 0}
+        return {"count": self.count, "sum": round(self.sum, 6), "mean": round(self.sum / self.count, 6),
+                "min": round(self.min, 6), "p50": round(self.quantile(0.5), 6), "p95": round(self.quantile(0.95), 6),
+                "p99": round(self.quantile(0.99), 6), "max": round(self.max, 6)}
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms for one run, identified by a name and optional labels.
+
+    Everything is guarded by one lock, which is cheap next to the file operations being measured.
+    `merge_metadata` resets the process-wide REGISTRY at the start of a run and writes `report()` to a
+    JSON file at the end. Web app jobs send `snapshot()`s of theirs to the web app, which serves them
+    on /metrics.
+    """
+
+    def __init__(self, namespace: str = "gpem"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = dict(DESCRIPTIONS)
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, float] = {}
+        self._histograms: Dict[_Key, Histogram] = {}
+        self.started = time.time()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+    def describe(self, name: str, kind: str, help: str):
+        self._help[name] = (kind, help)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, buckets: List[float] = LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time the body of a `with` block into the `name` histogram, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def gauge(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._gauges.get(_key(name, labels), 0)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        with self._lock:
+            return self._histograms.get(_key(name, labels)) or Histogram()
+
+    def snapshot(self) -> dict:
+        """A picklable copy of everything recorded, for handing to another process."""
+        with self._lock:
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges),
+                    "histograms": {key: copy.deepcopy(histogram) for key, histogram in self._histograms.items()}}
+
+    def absorb(self, snapshot: dict, **labels):
+        """Add the values of a `snapshot()` from another process, with `labels` added to each of them."""
+        extra = tuple(sorted(labels.items()))
+        relabel = lambda key: (key[0], tuple(sorted(key[1] + extra)))
+        with self._lock:
+            for key, value in snapshot["counters"].items():
+                self._counters[relabel(key)] = self._counters.get(relabel(key), 0) + value
+            for key, value in snapshot["gauges"].items():
+                self._gauges[relabel(key)] = value
+            for key, histogram in snapshot["histograms"].items():
+                self._histograms[relabel(key)] = copy.deepcopy(histogram)
+
+    def report(self) -> dict:
+        """Everything recorded so far as plain JSON types, with labels folded into the names."""
+        def flat(key: _Key) -> str:
+            name, labels = key
+            return name + _format_labels(labels).replace('"', "")
+        with self._lock:
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "counters": {flat(key): value for key, value in sorted(self._counters.items())},
+                "gauges": {flat(key): value for key, value in sorted(self._gauges.items())},
+                "histograms": {flat(key): histogram.to_dict() for key, histogram in sorted(self._histograms.items())},
+            }
+
+    def write_report(self, path: str, **extra):
+        with open(path, "w") as f:
+            json.dump(dict(self.report(), **extra), f, indent=2, default=str)
+
+    def to_prometheus(self) -> str:
+        """Render everything in the Prometheus text exposition format."""
+        lines = []
+        described = set()
+
+        def header(name: str, kind: str):
+            full = f"{self.namespace}_{name}"
+            if full not in described:
+                described.add(full)
+                lines.append(f"# HELP {full} {self._help.get(name, (kind, name.replace('_', ' ')))[1]}")
+                lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{header(name, 'counter')}{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(f"{header(name, 'gauge')}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                full = header(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(_bucket_bounds(histogram), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{full}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{full}_count{_format_labels(labels)} {histogram.count}")
+        return "".join(line + "\n" for line in lines)
+
+
+REGISTRY = Metrics()
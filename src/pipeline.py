@@ -0,0 +1,181 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List
+from metrics import REGISTRY
+from __init__ import PIPELINE_QUEUE_SIZE, PIPELINE_STOP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # end-of-stream marker passed from stage to stage
+_POLL_SECONDS = 0.1
+
+
+@dataclass(slots=True)
+class MergeItem:
+    """One media file moving through the merge pipeline."""
+    file: str  # media path relative to the input dir
+    json_name: str  # sidecar path relative to the input dir
+    input_file: str
+    json_file: str
+    output_file: str
+    size: int = 0  # of the source file
+    mtime_ns: int = 0  # of the source file
+    device: int = None  # st_dev of the source file, when known from the directory listing
+    inode: int = 0  # st_ino of the source file, when known from the directory listing
+    file_type: str = None  # extension matching the contents, when it could be recognised
+    exif_data: dict = field(default_factory=dict)
+    sidecar: bytes = None  # contents of the sidecar, when it was read ahead of the parse stage (compressed)
+    bytes_written: int = 0  # bytes written to the output disk for this file
+    copy_strategy: str = None
+    written: bool = False  # whether this run has started writing `output_file`
+    checksum: str = None  # of the source bytes, when the copy engine computes one
+    error: BaseException = None
+    stage: str = None  # stage that raised `error`
+    content: object = None  # dedupe record of the file's contents, when this file is the first to have them
+    duplicate_of: object = None  # dedupe record of an earlier file with the same contents
+    seconds: float = 0.0  # spent in the stages
+
+
+@dataclass(slots=True)
+class Stage:
+    """A pipeline step. `func` is called with each item and updates it in place."""
+    name: str
+    func: Callable
+    workers: int = 1
+
+
+class Pipeline:
+    """
+    Run items through a chain of stages. Every stage has its own worker threads and reads from a
+    bounded queue, so a slow stage makes the ones before it wait instead of piling up items in memory.
+
+    An item whose stage raises is marked with the error and passed straight to the end of the pipeline,
+    skipping the remaining stages. Duplicates of earlier items pass through untouched, they are dealt
+    with once the earlier item is done.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = PIPELINE_QUEUE_SIZE):
+        """
+        Raises:
+            ValueError: If a stage has no workers, nothing would ever take items off its queue
+        """
+        for stage in stages:
+            if stage.workers < 1:
+                raise ValueError(f"Stage {stage.name} needs at least one worker, got {stage.workers}")
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self._stop = threading.Event()
+        self._threads = []
+        self._feeder = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._feed_error = None
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, items: Iterable):
+        try:
+            for item in items:
+                if self._stop.is_set():
+                    return
+                with self._lock:
+                    self._in_flight[id(item)] = item
+                if not self._put(self.queues[0], item):
+                    return
+        except BaseException as e:
+            self._feed_error = e
+        finally:
+            self._put(self.queues[0], _DONE)
+
+    def _work(self, index: int, stage: Stage, remaining: List[int]):
+        source, sink = self.queues[index], self.queues[index + 1]
+        while True:
+            item = self._get(source)
+            if item is _DONE:
+                # let the other workers of this stage see the marker too; the last one forwards it
+                self._put(source, _DONE)
+                with self._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self._put(sink, _DONE)
+                return
+            if item.error is None and item.duplicate_of is None:
+                started = time.perf_counter()
+                try:
+                    stage.func(item)
+                except Exception as e:
+                    item.error = e
+                    item.stage = stage.name
+                seconds = time.perf_counter() - started
+                REGISTRY.observe("stage_seconds", seconds, stage=stage.name)
+                item.seconds += seconds
+            if not self._put(sink, item):
+                return
+
+    def run(self, items: Iterable) -> Iterator[MergeItem]:
+        """Feed `items` through the stages and yield each one once it has left the last stage.
+
+        Raises:
+            Exception: whatever the `items` iterable raised, after the items it did produce are done
+        """
+        self._feeder = threading.Thread(target=self._feed, args=(items,), name="pipeline-feed", daemon=True)
+        self._threads.append(self._feeder)
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for n in range(stage.workers):
+                self._threads.append(threading.Thread(target=self._work, args=(index, stage, remaining),
+                                                      name=f"pipeline-{stage.name}-{n}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+        while True:
+            item = self._get(self.queues[-1])
+            if item is _DONE:
+                break
+            with self._lock:
+                self._in_flight.pop(id(item), None)
+            yield item
+        self.join()
+        if self._feed_error is not None:
+            raise self._feed_error
+
+    def stop(self, timeout: float = PIPELINE_STOP_TIMEOUT) -> List[MergeItem]:
+        """Stop all stages and return the items that were still in flight.
+
+        The stages notice within a poll interval. The feeder only notices between items, and the input
+        can block for long on a single one (a directory walk, a sidecar matched in another process), so
+        it is given `timeout` seconds and then left behind; it is a daemon thread and drops whatever it
+        gets next.
+        """
+        self._stop.set()
+        self.join(feeder_timeout=timeout)
+        if self._feeder is not None and self._feeder.is_alive():
+            logger.warning(f"The pipeline input didn't stop within {timeout}s, leaving it behind")
+        with self._lock:
+            unfinished = list(self._in_flight.values())
+            self._in_flight.clear()
+        return unfinished
+
+    def join(self, feeder_timeout: float = None):
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(feeder_timeout if thread is self._feeder else None)
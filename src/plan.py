@@ -0,0 +1,93 @@
+import gzip
+import json
+import logging
+import os
+from typing import Iterable, Iterator, TextIO
+from pipeline import MergeItem
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+
+def _open(path: str, mode: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _dumps(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def write_plan(path: str, inputDir: str, outputDir: str, items: Iterable[MergeItem], summary: dict) -> int:
+    """Stream a merge plan to `path` as JSON lines (gzipped if the name ends in .gz).
+
+    The first line holds the directories the plan was made for, then there is one line per file with
+    the paths relative to those directories, the detected type, size and mtime of the source, and the
+    tag values to write. The last line holds the missing and ambiguous sidecar counts from `summary`,
+    which `items` is expected to fill in as it goes, and marks the plan as complete.
+
+    Returns:
+        int: number of files written to the plan
+    """
+    count = 0
+    with _open(path, "w") as f:
+        f.write(_dumps({"version": PLAN_VERSION, "inputDir": os.path.abspath(inputDir),
+                        "outputDir": os.path.abspath(outputDir)}))
+        for item in items:
+            f.write(_dumps({
+                "file": item.file,
+                "sidecar": item.json_name,
+                "output": os.path.relpath(item.output_file, outputDir),
+                "type": item.file_type,
+                "size": item.size,
+                "mtime_ns": item.mtime_ns,
+                "tags": item.exif_data,
+            }))
+            count += 1
+        f.write(_dumps({"end": True, "files": count, "missing": summary["missing"], "ambiguous": summary["ambiguous"]}))
+    return count
+
+
+def read_plan_header(path: str) -> dict:
+    """Return the first line of a plan: its version and the directories it was made for."""
+    with _open(path, "r") as f:
+        header = json.loads(f.readline())
+    if header.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path} is not a version {PLAN_VERSION} merge plan")
+    return header
+
+
+def iter_plan(path: str, inputDir: str, outputDir: str, summary: dict) -> Iterator[MergeItem]:
+    """Stream the files of a plan as pipeline items, with their tags already filled in.
+
+    Paths are joined onto `inputDir` and `outputDir`, so a plan can be executed against a moved copy
+    of the library. Only one line is held in memory at a time. `summary` is updated as files are read,
+    and with the missing and ambiguous counts once the end of the plan is reached.
+
+    Raises:
+        ValueError: if the plan was cut short
+    """
+    read_plan_header(path)
+    with _open(path, "r") as f:
+        f.readline()
+        for line in f:
+            entry = json.loads(line)
+            if entry.get("end"):
+                summary["missing"] += entry["missing"]
+                summary["ambiguous"] += entry["ambiguous"]
+                return
+            summary["total"] += 1
+            yield MergeItem(
+                file=entry["file"],
+                json_name=entry["sidecar"],
+                input_file=os.path.join(inputDir, entry["file"]),
+                json_file=os.path.join(inputDir, entry["sidecar"]),
+                output_file=os.path.join(outputDir, entry["output"]),
+                size=entry["size"],
+                mtime_ns=entry["mtime_ns"],
+                file_type=entry["type"],
+                exif_data=entry["tags"],
+            )
+    raise ValueError(f"Merge plan {path} is incomplete, it was probably written by a run that didn't finish")
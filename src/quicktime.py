@@ -0,0 +1,145 @@
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Iterator, List, Tuple
+from exif_native import parse_date, set_modify_date
+
+# video containers whose dates can be patched in place, by the extension `sniff_bytes` gives them
+QUICKTIME_TYPES = (".mp4", ".mov", ".m4v", ".3gp", ".3g2")
+
+_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)  # QuickTime times count seconds from here, in UTC
+_DATED_BOXES = (b"mvhd", b"tkhd", b"mdhd")  # full boxes starting with a creation and a modification time
+_XMP_UUID = bytes.fromhex("BE7ACFCB97A942E89C71999491E3AFAC")
+
+Patch = Tuple[int, bytes]  # file offset, bytes to write there
+
+
+def _read_exact(f: BinaryIO, length: int) -> bytes:
+    data = f.read(length)
+    if len(data) != length:
+        raise ValueError("Unexpected end of file")
+    return data
+
+
+def _boxes(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, start of the payload, end of the box) for the boxes between `start` and `end`,
+    reading only their headers."""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, kind = struct.unpack(">I4s", _read_exact(f, 8))
+        header = 8
+        if size == 1:
+            size, = struct.unpack(">Q", _read_exact(f, 8))
+            header = 16
+        elif size == 0:  # runs to the end of the file
+            size = end - position
+        if size < header or position + size > end:
+            raise ValueError(f"Corrupt {kind!r} box at offset {position}")
+        yield kind, position + header, position + size
+        position += size
+
+
+def _meta_has_dates(f: BinaryIO, start: int, end: int) -> bool:
+    """Whether a `meta` box holds QuickTime keys or an iTunes `©day`, dates exiftool has to update."""
+    f.seek(start + 4)
+    if f.read(4) != b"hdlr":
+        start += 4  # an ISO meta box has a version and flags in front of its children, a QuickTime one doesn't
+    for kind, child, child_end in _boxes(f, start, end):
+        if kind == b"keys":
+            return True
+        if kind == b"ilst" and any(item == b"\xa9day" for item, _, _ in _boxes(f, child, child_end)):
+            return True
+    return False
+
+
+def _collect(f: BinaryIO, start: int, end: int, when: int, patches: List[Patch]):
+    for kind, payload, box_end in _boxes(f, start, end):
+        if kind in _DATED_BOXES:
+            f.seek(payload)
+            version = _read_exact(f, 1)[0]
+            if version == 0:
+                if when >= 2 ** 32:
+                    raise ValueError(f"{kind.decode()} can't hold a date after 2040")
+                patches.append((payload + 4, struct.pack(">II", when, when)))
+            elif version == 1:
+                patches.append((payload + 4, struct.pack(">QQ", when, when)))
+            else:
+                raise ValueError(f"Unknown {kind.decode()} version {version}")
+        elif kind in (b"trak", b"mdia"):
+            _collect(f, payload, box_end, when, patches)
+        elif kind == b"cmov":
+            raise ValueError("The movie header is compressed")
+        elif kind == b"udta":
+            for child, child_payload, child_end in _boxes(f, payload, box_end):
+                if child in (b"XMP_", b"\xa9day") or (child == b"meta" and _meta_has_dates(f, child_payload, child_end)):
+                    raise ValueError(f"It has {child.decode('latin-1')} metadata")
+        elif kind == b"meta" and _meta_has_dates(f, payload, box_end):
+            raise ValueError("It has QuickTime keys")
+
+
+def plan_date_patches(file_path: str, exif_data: dict) -> List[Patch]:
+    """Find the creation and modification times in the `mvhd`, `tkhd` and `mdhd` boxes of a QuickTime
+    or MP4 file, and the bytes that set them to `CreateDate`.
+
+    Only box headers are read, the media data is skipped over, so this costs a few KB of reads
+    whatever the size of the video. A file laid out the same way, like a copy of it, can be patched
+    with the result.
+
+    Raises:
+        ValueError: If the file has dates these fields can't carry (QuickTime keys, XMP, `©day`) or a
+            layout this doesn't understand. It is left to exiftool then
+    """
+    when = int((parse_date(exif_data["CreateDate"]) - _EPOCH).total_seconds())
+    if when < 0:
+        raise ValueError("QuickTime dates start in 1904")
+    patches = []
+    with open(file_path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+        top = list(_boxes(f, 0, end))
+        for kind, payload, box_end in top:
+            if kind == b"uuid":
+                f.seek(payload)
+                if f.read(16) == _XMP_UUID:
+                    raise ValueError("It has XMP metadata")
+        movies = [box for box in top if box[0] == b"moov"]
+        if len(movies) != 1:
+            raise ValueError(f"Expected one moov box, found {len(movies)}")
+        _collect(f, movies[0][1], movies[0][2], when, patches)
+    if not patches:
+        raise ValueError("No movie header")
+    return patches
+
+
+def apply_date_patches(file_path: str, patches: List[Patch], exif_data: dict) -> int:
+    """Write `patches` into the file in place and set its mtime from `FileModifyDate`.
+
+    Returns:
+        int: bytes written
+    """
+    with open(file_path, "r+b") as f:
+        for offset, data in patches:
+            f.seek(offset)
+            f.write(data)
+    set_modify_date(file_path, exif_data)
+    return sum(len(data) for _, data in patches)
+
+
+def read_dates(file_path: str) -> List[Tuple[str, datetime, datetime]]:
+    """(box type, creation time, modification time) for every dated box in the movie header, in file order."""
+    dates = []
+
+    def walk(f: BinaryIO, start: int, end: int):
+        for kind, payload, box_end in _boxes(f, start, end):
+            if kind in _DATED_BOXES:
+                f.seek(payload)
+                version = _read_exact(f, 1)[0]
+                f.seek(payload + 4)
+                created, modified = struct.unpack(">QQ" if version == 1 else ">II", _read_exact(f, 16 if version == 1 else 8))
+                dates.append((kind.decode(), _EPOCH + timedelta(seconds=created), _EPOCH + timedelta(seconds=modified)))
+            elif kind in (b"moov", b"trak", b"mdia"):
+                walk(f, payload, box_end)
+
+    with open(file_path, "rb") as f:
+        walk(f, 0, os.fstat(f.fileno()).st_size)
+    return dates
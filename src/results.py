@@ -0,0 +1,73 @@
+import json
+from dataclasses import asdict, dataclass
+from typing import Iterator
+from pipeline import MergeItem
+
+MERGED = "merged"
+DUPLICATE = "duplicate"  # handled by the dedupe policy of an earlier file with the same contents
+FAILED = "failed"
+
+
+@dataclass(slots=True)
+class MergeResult:
+    """What became of one file, as `iter_merge` yields it. It keeps no reference to the pipeline item,
+    its tags or its exception, so a consumer can hold on to millions of these."""
+    file: str  # media path relative to the input dir
+    status: str
+    output_file: str
+    size: int  # of the source file
+    bytes_written: int
+    seconds: float  # spent in the pipeline stages
+    stage: str = None  # stage that failed
+    error_type: str = None  # class name of the exception
+    error: str = None
+
+    @classmethod
+    def of(cls, item: MergeItem) -> "MergeResult":
+        if item.error is not None:
+            status = FAILED
+        elif item.duplicate_of is not None:
+            status = DUPLICATE
+        else:
+            status = MERGED
+        return cls(item.file, status, item.output_file, item.size, item.bytes_written, round(item.seconds, 6), item.stage,
+                   type(item.error).__name__ if item.error is not None else None,
+                   str(item.error) if item.error is not None else None)
+
+    @property
+    def failed(self) -> bool:
+        return self.status == FAILED
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class FailureLog:
+    """
+    Write failed results to a JSON Lines file as they happen, one object per line, instead of keeping
+    them until the end of the run. Without a `path` they are only counted.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.count = 0
+        # line buffered, so the file can be followed while the run goes on
+        self._file = open(path, "w", buffering=1) if path is not None else None
+
+    def write(self, result: MergeResult):
+        self.count += 1
+        if self._file is not None:
+            self._file.write(json.dumps(result.to_dict()) + "\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_failures(path: str) -> Iterator[MergeResult]:
+    """Iterate over the results in a failures file written by `FailureLog`."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield MergeResult(**json.loads(line))
@@ -0,0 +1,415 @@
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple, Union
+from urllib import request as urlrequest
+from urllib.error import URLError
+from plan import _open, _dumps, read_plan_header
+from journal import Journal
+from __init__ import SHARD_FILE_OVERHEAD_BYTES, SHARD_LEASE_SECONDS, SHARD_HEARTBEAT_SECONDS, SHARD_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+
+@dataclass(slots=True)
+class Shard:
+    """A part of a merge plan, handed to one worker at a time."""
+    index: int
+    plan_path: str
+    files: int = 0
+    bytes: int = 0
+    state: str = PENDING
+    worker: str = None
+    lease_expires: float = 0
+    attempts: int = 0
+    current: int = 0  # files finished by the current attempt
+    failed: Dict[str, str] = field(default_factory=dict)
+    error: str = None
+
+
+def split_plan(plan_path: str, shard_count: int, shard_dir: str) -> Tuple[List[Shard], dict]:
+    """Split a merge plan into up to `shard_count` shard plans of about the same number of bytes.
+
+    Files are handed out largest first, each to the shard with the fewest bytes so far (every file also
+    counts as SHARD_FILE_OVERHEAD_BYTES, for the exiftool call it needs). A big video therefore ends up
+    in a shard with fewer other files instead of making one shard run much longer than the rest.
+    Within a shard, files keep their order in the plan.
+
+    Returns:
+        Tuple[List[Shard], dict]: the non-empty shards, and the missing and ambiguous sidecar counts of the plan
+    """
+    header = read_plan_header(plan_path)
+    sizes = array("q")
+    totals = None
+    with _open(plan_path, "r") as f:
+        f.readline()
+        for line in f:
+            entry = json.loads(line)
+            if entry.get("end"):
+                totals = {"missing": entry["missing"], "ambiguous": entry["ambiguous"]}
+                break
+            sizes.append(entry["size"])
+    if totals is None:
+        raise ValueError(f"Merge plan {plan_path} is incomplete, it was probably written by a run that didn't finish")
+
+    shard_count = max(1, min(shard_count, len(sizes)))
+    shards = [Shard(i, os.path.join(shard_dir, f"shard-{i:03d}.jsonl")) for i in range(shard_count)]
+    assignment = array("I", bytes(4 * len(sizes)))
+    loads = [(0, i) for i in range(shard_count)]
+    for i in sorted(range(len(sizes)), key=sizes.__getitem__, reverse=True):
+        load, shard = heapq.heappop(loads)
+        assignment[i] = shard
+        shards[shard].files += 1
+        shards[shard].bytes += sizes[i]
+        heapq.heappush(loads, (load + sizes[i] + SHARD_FILE_OVERHEAD_BYTES, shard))
+    del sizes
+
+    os.makedirs(shard_dir, exist_ok=True)
+    outputs = [_open(shard.plan_path, "w") for shard in shards]
+    try:
+        for out in outputs:
+            out.write(_dumps(header))
+        with _open(plan_path, "r") as f:
+            f.readline()
+            for i, line in zip(range(len(assignment)), f):
+                outputs[assignment[i]].write(line)
+        for shard, out in zip(shards, outputs):
+            out.write(_dumps({"end": True, "files": shard.files, "missing": 0, "ambiguous": 0}))
+    finally:
+        for out in outputs:
+            out.close()
+    shards = [shard for shard in shards if shard.files > 0]
+    return shards, totals
+
+
+class ShardBoard:
+    """
+    Keeps track of which worker has which shard. A worker leases a shard and has to renew the lease
+    with heartbeats; a shard whose lease runs out goes back to the pending shards for another worker,
+    up to `max_attempts` times.
+    """
+
+    def __init__(self, shards: List[Shard], lease_seconds: float = SHARD_LEASE_SECONDS,
+                 max_attempts: int = SHARD_MAX_ATTEMPTS, clock: Callable[[], float] = time.monotonic):
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def lease(self, worker: str) -> Union[Shard, None]:
+        """Hand the next pending shard to `worker`, or return None if there is none right now."""
+        with self._lock:
+            self._expire()
+            for shard in self.shards:
+                if shard.state == PENDING:
+                    shard.state, shard.worker, shard.current = LEASED, worker, 0
+                    shard.attempts += 1
+                    shard.lease_expires = self._clock() + self.lease_seconds
+                    logger.debug(f"Leased shard {shard.index} to {worker} (attempt {shard.attempts})")
+                    return shard
+            return None
+
+    def heartbeat(self, worker: str, index: int, current: int = 0) -> bool:
+        """Renew a lease and record progress. Returns False if the worker no longer holds the shard."""
+        with self._lock:
+            shard = self.shards[index]
+            if shard.state != LEASED or shard.worker != worker:
+                return False
+            shard.lease_expires = self._clock() + self.lease_seconds
+            shard.current = current
+            return True
+
+    def complete(self, worker: str, index: int, failed: Dict[str, str] = None, error: str = None):
+        """Mark a shard as done. The first completion wins, even from a worker whose lease ran out."""
+        with self._lock:
+            shard = self.shards[index]
+            if shard.state == DONE:
+                return
+            if shard.worker != worker:
+                logger.info(f"Shard {shard.index} was finished by {worker} after its lease was handed on")
+            shard.state, shard.worker, shard.current = DONE, worker, shard.files
+            shard.failed = failed or {}
+            shard.error = error
+
+    def expire(self) -> List[Shard]:
+        with self._lock:
+            return self._expire()
+
+    def _expire(self) -> List[Shard]:
+        now = self._clock()
+        expired = []
+        for shard in self.shards:
+            if shard.state == LEASED and shard.lease_expires < now:
+                expired.append(shard)
+                if shard.attempts >= self.max_attempts:
+                    logger.error(f"Giving up on shard {shard.index}, its worker stopped responding {shard.attempts} times")
+                    shard.state, shard.error = DONE, f"worker stopped responding {shard.attempts} times"
+                else:
+                    logger.warning(f"Worker {shard.worker} stopped responding, handing shard {shard.index} to another worker")
+                    shard.state, shard.worker, shard.current = PENDING, None, 0
+        return expired
+
+    @property
+    def done(self) -> bool:
+        with self._lock:
+            return all(shard.state == DONE for shard in self.shards)
+
+    def progress(self) -> Tuple[int, int]:
+        """Files finished so far and files in all shards."""
+        with self._lock:
+            return sum(shard.current for shard in self.shards), sum(shard.files for shard in self.shards)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def _reply(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self._reply({"error": "not found"}, 404)
+        current, total = self.server.board.progress()
+        self._reply({"current": current, "total": total, "done": self.server.board.done,
+                     "shards": {shard.index: shard.state for shard in self.server.board.shards}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        board = self.server.board
+        if self.path == "/lease":
+            shard = board.lease(body["worker"])
+            if shard is None:
+                return self._reply({"shard": None, "done": board.done})
+            return self._reply({"shard": shard.index, "plan": shard.plan_path,
+                                "heartbeat_seconds": self.server.heartbeat_seconds, "options": self.server.options})
+        if self.path == "/heartbeat":
+            return self._reply({"ok": board.heartbeat(body["worker"], body["shard"], body.get("current", 0))})
+        if self.path == "/complete":
+            board.complete(body["worker"], body["shard"], body.get("failed"), body.get("error"))
+            return self._reply({"ok": True})
+        self._reply({"error": "not found"}, 404)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, board: ShardBoard, options: dict, heartbeat_seconds: float):
+        super().__init__(address, _Handler)
+        self.board = board
+        self.options = options
+        self.heartbeat_seconds = heartbeat_seconds
+
+
+class Coordinator:
+    """
+    Serves a ShardBoard over HTTP. Workers POST to /lease, /heartbeat and /complete with JSON bodies;
+    GET /status shows the overall progress. The lease reply carries `options`, the keyword arguments a
+    worker passes to `merge_metadata`, so remote workers only need the coordinator's URL.
+    """
+
+    def __init__(self, board: ShardBoard, options: dict, host: str = "127.0.0.1", port: int = 0,
+                 heartbeat_seconds: float = SHARD_HEARTBEAT_SECONDS):
+        self.board = board
+        self._server = _Server((host, port), board, options, heartbeat_seconds)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="shard-coordinator", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        if host in ("0.0.0.0", "::"):
+            host = socket.gethostname()
+        return f"http://{host}:{port}"
+
+    def start(self) -> "Coordinator":
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _post(url: str, body: dict) -> dict:
+    req = urlrequest.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    with urlrequest.urlopen(req, timeout=SHARD_LEASE_SECONDS) as response:
+        return json.loads(response.read())
+
+
+def run_worker(url: str, worker: str = None):
+    """Lease shards from the coordinator at `url` and merge them until there are none left.
+
+    Run one per machine (or several) with `main.py --shardWorker URL`; the input and output paths
+    must be the same on every machine.
+    """
+    from main import merge_metadata  # main imports this module for its command line
+
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    while True:
+        try:
+            lease = _post(f"{url}/lease", {"worker": worker})
+        except (URLError, OSError) as e:
+            logger.info(f"Coordinator at {url} is gone ({e}), stopping worker {worker}")
+            return
+        if lease["shard"] is None:
+            if lease["done"]:
+                return
+            time.sleep(1)  # every shard is leased, but one may come back if its worker dies
+            continue
+
+        index = lease["shard"]
+        progress = {"current": 0}
+        finished = threading.Event()
+
+        def heartbeat():
+            while not finished.wait(lease["heartbeat_seconds"]):
+                try:
+                    if not _post(f"{url}/heartbeat", {"worker": worker, "shard": index, "current": progress["current"]})["ok"]:
+                        logger.warning(f"Worker {worker} lost its lease on shard {index}")
+                except (URLError, OSError) as e:
+                    logger.debug(f"Heartbeat for shard {index} failed: {e}")
+
+        beat = threading.Thread(target=heartbeat, name=f"shard-{index}-heartbeat", daemon=True)
+        beat.start()
+        journal_path = lease["plan"] + ".journal.sqlite"
+        error = None
+        try:
+            ok = merge_metadata(plan_path=lease["plan"], journal_path=journal_path, report_path=lease["plan"] + ".report.json",
+                                failures_path=lease["plan"] + ".failures.jsonl", resume=True, show_progress=False,
+                                progress_callback=lambda update: progress.update(current=update["current"]),
+                                **lease["options"])
+            if not ok:
+                error = "merge_metadata failed, see the worker's log"
+        except Exception as e:
+            error = str(e)
+        finally:
+            finished.set()
+            beat.join()
+        with Journal(journal_path) as journal:
+            failed = journal.failures()
+        if failed:
+            error = None  # the failed files say what went wrong
+        try:
+            _post(f"{url}/complete", {"worker": worker, "shard": index, "failed": failed, "error": error})
+        except (URLError, OSError) as e:
+            logger.warning(f"Couldn't report shard {index} as done: {e}")
+            return
+
+
+def run_sharded(plan_path: str, inputDir: str, outputDir: str, shards: int, workers: int, shard_dir: str = None,
+                host: str = "127.0.0.1", port: int = 0, progress_callback=None, overwrite_if_exists: bool = False,
+                resume: bool = False, **options) -> bool:
+    """Execute a merge plan as byte-balanced shards spread over worker processes.
+
+    `workers` local worker processes are started; more can join from other machines with
+    `main.py --shardWorker <coordinator url>` when `host` is an address they can reach. Local workers
+    that die are replaced while shards remain. Each shard keeps its own journal in `shard_dir`, so a
+    shard handed to a new worker, or rerun with `resume`, skips the files that were already done.
+
+    Args:
+        options: passed on to `merge_metadata` by every worker (jobs, copy_mode, single_write, ...)
+
+    Returns:
+        bool: True if every file was merged, like `merge_metadata`
+    """
+    if os.path.exists(outputDir) and not overwrite_if_exists and not resume:
+        logger.warning(f"Output directory {outputDir} already exists! Exiting.")
+        return False
+    shard_dir = shard_dir or os.path.normpath(outputDir) + ".shards"
+    if os.path.exists(shard_dir) and not resume:
+        shutil.rmtree(shard_dir)
+    shard_list, totals = split_plan(plan_path, shards, shard_dir)
+    logger.info(f"Split {sum(s.files for s in shard_list)} files into {len(shard_list)} shards: "
+                + ", ".join(f"{s.files} files/{s.bytes // 2**20} MB" for s in shard_list))
+    dryRun = options.get("dryRun", False)
+    if not dryRun:
+        os.makedirs(outputDir, exist_ok=True)
+
+    board = ShardBoard(shard_list)
+    options = dict(options, inputDir=inputDir, outputDir=outputDir)
+    coordinator = Coordinator(board, options, host, port).start()
+    logger.info(f"Coordinating shards at {coordinator.url}")
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    restarts = 0
+
+    def start_worker():
+        process = context.Process(target=run_worker, args=(coordinator.url, f"local-{len(processes) + restarts}"))
+        process.start()
+        processes.append(process)
+
+    try:
+        for _ in range(workers):
+            start_worker()
+        last_current = -1
+        waiting_for_remote = False
+        while not board.done:
+            time.sleep(0.5)
+            board.expire()
+            for process in [p for p in processes if p.exitcode not in (None, 0)]:
+                processes.remove(process)
+                if restarts < workers * SHARD_MAX_ATTEMPTS:
+                    logger.warning(f"Worker process {process.pid} died with exit code {process.exitcode}, starting another")
+                    restarts += 1
+                    start_worker()
+            if workers > 0 and not processes and not board.done:
+                if host in ("127.0.0.1", "localhost", "::1"):
+                    logger.error("Every local worker died and no remote worker can reach the coordinator, giving up")
+                    break
+                if not waiting_for_remote:
+                    logger.warning("No local worker left, waiting for remote workers")
+                    waiting_for_remote = True
+            current, total = board.progress()
+            if progress_callback and current != last_current:
+                last_current = current
+                progress_callback({'current': current, 'total': total, 'percent': int(current / max(total, 1) * 100),
+                                   'file': None, 'mute_in_log': True})
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        coordinator.close()
+
+    failed_files = 0
+    for shard in board.shards:
+        if shard.state != DONE:
+            shard.error = "never finished"
+        failed_files += len(shard.failed)
+        if shard.failed and not dryRun:
+            # the worker wrote them to the failures file of its shard as they happened
+            logger.warning(f"Shard {shard.index}: {len(shard.failed)} files failed, they are listed in "
+                           f"{shard.plan_path}.failures.jsonl")
+        if shard.error:
+            logger.error(f"Shard {shard.index} ({shard.plan_path}) failed: {shard.error}")
+    total_files = sum(shard.files for shard in board.shards)
+    logger.info(f"Matched {total_files} files, {totals['missing']} missing and {totals['ambiguous']} ambiguous sidecar files")
+    if failed_files > 0:
+        logger.warning(f"Failed to merge metadata for {failed_files} files")
+    if failed_files or any(shard.error for shard in board.shards):
+        return False
+    logger.info(f"Successfully merged metadata for all {total_files} files in {len(board.shards)} shards. "
+                f"Copied from {inputDir} to {outputDir}")
+    return True
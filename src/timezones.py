@@ -0,0 +1,316 @@
+import bisect
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import zipfile
+from array import array
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from __init__ import TZ_CELL_DEGREES, TZ_LOOKUP_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_INDEX_MAGIC = b"GPTZIDX\0"
+_INDEX_VERSION = 2
+# magic, version, size and mtime_ns of the data file, cell degrees, length of the zone names JSON, cell count
+_INDEX_HEADER = struct.Struct("<8sIqqdII")
+# entry count of a cell, then per entry: zone id, inside, number of float32 values in its edges
+_CELL_HEADER = struct.Struct("<I")
+_ENTRY_HEADER = struct.Struct("<HBxI")
+# the grid is shifted off whole degrees so that boundary vertices, which are often on whole degrees,
+# never lie exactly on a grid line
+_GRID_SHIFT = 3.14159e-7
+_ORIGIN_X = -180 - _GRID_SHIFT
+_ORIGIN_Y = -90 - _GRID_SHIFT
+
+# one entry of a grid cell: (zone id, whether the cell's south-east corner is inside the zone,
+# the zone's boundary edges touching the cell as x1, y1, x2, y2 floats or None if there are none)
+_CellEntry = Tuple[int, bool, Union[array, None]]
+
+
+def _pad(length: int) -> bytes:
+    return b"\0" * (-length % 8)
+
+
+def _write_index(path: str, key: Tuple[int, int, float], zones: List[str], cells: Dict[int, List[_CellEntry]]):
+    """Save an index as: header, zone names as JSON, the sorted cell ids (int32), the offset of each
+    cell's entries (int64), then the entries. Everything is 8-byte aligned so it can be mapped as is.
+    The file is written next to `path` and renamed over it, so a run that has the old one mapped keeps
+    reading a whole file."""
+    names = json.dumps(zones).encode("utf-8")
+    ids = array("i", sorted(cells))
+    start = _INDEX_HEADER.size + len(names) + len(_pad(len(names))) + 4 * len(ids) + len(_pad(4 * len(ids))) + 8 * len(ids)
+    offsets = array("q")
+    body = bytearray()
+    for cell in ids:
+        offsets.append(start + len(body))
+        body += _CELL_HEADER.pack(len(cells[cell]))
+        for zone_id, inside, edges in cells[cell]:
+            values = edges if edges is not None else array("f")
+            body += _ENTRY_HEADER.pack(zone_id, inside, len(values))
+            body += values.tobytes()
+            body += _pad(len(body))
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, *key, len(names), len(ids)))
+        f.write(names + _pad(len(names)))
+        f.write(ids.tobytes() + _pad(4 * len(ids)))
+        f.write(offsets.tobytes())
+        f.write(body)
+    os.replace(temporary, path)
+
+
+class _MappedCells:
+    """The grid cells of an index file, read from a memory map as they are looked up, so only the
+    pages of the cells photos fall in are ever read. Edges are float32 views of the map, not copies."""
+
+    def __init__(self, mapped: mmap.mmap, ids: memoryview, offsets: memoryview):
+        self._mapped = mapped
+        self._view = memoryview(mapped)
+        self._ids = ids
+        self._offsets = offsets
+        self._cells: Dict[int, List[_CellEntry]] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get(self, cell: int, default=None) -> Union[List[_CellEntry], None]:
+        entries = self._cells.get(cell)
+        if entries is not None:
+            return entries
+        i = bisect.bisect_left(self._ids, cell)
+        if i == len(self._ids) or self._ids[i] != cell:
+            return default
+        position = self._offsets[i]
+        count, = _CELL_HEADER.unpack_from(self._mapped, position)
+        position += _CELL_HEADER.size
+        entries = []
+        for _ in range(count):
+            zone_id, inside, values = _ENTRY_HEADER.unpack_from(self._mapped, position)
+            position += _ENTRY_HEADER.size
+            edges = self._view[position:position + 4 * values].cast("f") if values else None
+            position += 4 * values + len(_pad(4 * values))
+            entries.append((zone_id, bool(inside), edges))
+        self._cells[cell] = entries
+        return entries
+
+
+def _read_index(path: str, key: Tuple[int, int, float]) -> Union[Tuple[List[str], _MappedCells], None]:
+    """Map an index written by `_write_index`, or return None if it is missing, of another version,
+    or was built from another data file."""
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # ValueError for an empty file
+        return None
+    try:
+        magic, version, *cached_key, names_length, count = _INDEX_HEADER.unpack_from(mapped, 0)
+    except struct.error:
+        mapped.close()
+        return None
+    if magic != _INDEX_MAGIC or version != _INDEX_VERSION or tuple(cached_key) != key:
+        mapped.close()
+        return None
+    position = _INDEX_HEADER.size
+    zones = json.loads(mapped[position:position + names_length])
+    position += names_length + len(_pad(names_length))
+    view = memoryview(mapped)
+    ids = view[position:position + 4 * count].cast("i")
+    position += 4 * count + len(_pad(4 * count))
+    offsets = view[position:position + 8 * count].cast("q")
+    return zones, _MappedCells(mapped, ids, offsets)
+
+
+def _iter_rings(geometry: dict) -> Iterable[List[List[float]]]:
+    if geometry["type"] == "Polygon":
+        yield from geometry["coordinates"]
+    elif geometry["type"] == "MultiPolygon":
+        for polygon in geometry["coordinates"]:
+            yield from polygon
+    else:
+        raise ValueError(f"Unsupported geometry type {geometry['type']}")
+
+
+class TimezoneResolver:
+    """
+    Find the IANA timezone at a coordinate, offline, from timezone boundary polygons.
+
+    The polygons are cut into a grid of `cell_degrees` cells. A cell that lies entirely inside one
+    zone resolves with a single dict lookup; a cell a boundary passes through keeps only the edges
+    touching it plus whether its south-east corner is inside each zone, so a lookup casts a ray within
+    the cell instead of across the whole polygon. Edges are stored as 32-bit floats (about a metre of
+    precision). The full world data makes an index of a few hundred MB, which is saved to a file and
+    memory-mapped by later runs, so a run only reads the cells its photos are in.
+
+    UTC offsets are computed with `zoneinfo` and cached per (zone, hour).
+    """
+
+    def __init__(self, zones: List[str], cells: Mapping[int, List[_CellEntry]], cell_degrees: float = TZ_CELL_DEGREES):
+        self.zones = zones
+        self.cells = cells
+        self.cell_degrees = cell_degrees
+        self._columns = int(360 / cell_degrees) + 1
+        self._zone_at = lru_cache(maxsize=TZ_LOOKUP_CACHE_SIZE)(self._find_zone)
+        self._zoneinfos: Dict[str, ZoneInfo] = {}
+        self._offsets: Dict[Tuple[str, int], timedelta] = {}
+
+    @classmethod
+    def from_geojson(cls, geojson: dict, cell_degrees: float = TZ_CELL_DEGREES) -> "TimezoneResolver":
+        """Build the index from a GeoJSON FeatureCollection with a `tzid` property on every feature,
+        like the releases of timezone-boundary-builder."""
+        zones = []
+        cells = {}
+        columns = int(360 / cell_degrees) + 1
+        for feature in geojson["features"]:
+            zone_id = len(zones)
+            zones.append(feature["properties"]["tzid"])
+            cell_edges: Dict[int, array] = {}
+            row_crossings: Dict[int, List[float]] = {}
+            min_ix = min_iy = math.inf
+            max_ix = max_iy = -math.inf
+            for ring in _iter_rings(feature["geometry"]):
+                # round to float32 first so the index is built from exactly the values a lookup sees
+                points = array("f", [value for point in ring for value in point[:2]]).tolist()
+                for i in range(0, len(points) - 2, 2):
+                    x1, y1, x2, y2 = points[i:i + 4]
+                    ix1 = int((min(x1, x2) - _ORIGIN_X) // cell_degrees)
+                    ix2 = int((max(x1, x2) - _ORIGIN_X) // cell_degrees)
+                    iy1 = int((min(y1, y2) - _ORIGIN_Y) // cell_degrees)
+                    iy2 = int((max(y1, y2) - _ORIGIN_Y) // cell_degrees)
+                    min_ix, max_ix = min(min_ix, ix1), max(max_ix, ix2)
+                    min_iy, max_iy = min(min_iy, iy1), max(max_iy, iy2)
+                    for iy in range(iy1, iy2 + 1):
+                        for ix in range(ix1, ix2 + 1):
+                            cell_edges.setdefault(iy * columns + ix, array("f")).extend((x1, y1, x2, y2))
+                    # where the edge crosses the southern grid line of each row it spans
+                    for iy in range(iy1 + 1, iy2 + 1):
+                        y0 = _ORIGIN_Y + iy * cell_degrees
+                        if (y1 > y0) != (y2 > y0):
+                            row_crossings.setdefault(iy, []).append(x1 + (y0 - y1) * (x2 - x1) / (y2 - y1))
+            if min_ix is math.inf:
+                continue
+            for iy in range(min_iy, max_iy + 1):
+                crossings = sorted(row_crossings.get(iy, ()))
+                for ix in range(min_ix, max_ix + 1):
+                    east = _ORIGIN_X + (ix + 1) * cell_degrees
+                    inside = (len(crossings) - bisect.bisect_right(crossings, east)) % 2 == 1
+                    edges = cell_edges.get(iy * columns + ix)
+                    if edges is not None or inside:
+                        cells.setdefault(iy * columns + ix, []).append((zone_id, inside, edges))
+        logger.debug(f"Indexed {len(zones)} timezones into {len(cells)} grid cells")
+        return cls(zones, cells, cell_degrees)
+
+    @classmethod
+    def load(cls, path: str, cell_degrees: float = TZ_CELL_DEGREES) -> "TimezoneResolver":
+        """Load boundary data from a GeoJSON file or a zip holding one.
+
+        The built index is saved next to the data as `<path>.idx` and mapped by later runs for as long
+        as the data file doesn't change, so the GeoJSON is only parsed once.
+        """
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns, float(cell_degrees))
+        index_path = path + ".idx"
+        index = _read_index(index_path, key)
+        if index is not None:
+            return cls(*index, cell_degrees)
+
+        logger.info(f"Building the timezone index from {path}, this only happens once")
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                name = next(n for n in archive.namelist() if n.endswith((".json", ".geojson")))
+                with archive.open(name) as f:
+                    geojson = json.load(f)
+        else:
+            with open(path, "r") as f:
+                geojson = json.load(f)
+        resolver = cls.from_geojson(geojson, cell_degrees)
+        del geojson
+        try:
+            _write_index(index_path, key, resolver.zones, resolver.cells)
+        except OSError as e:
+            logger.debug(f"Couldn't save the timezone index to {index_path}: {e}")
+            return resolver
+        # map the saved index instead of keeping the whole one in memory
+        index = _read_index(index_path, key)
+        return cls(*index, cell_degrees) if index is not None else resolver
+
+    def zone_at(self, latitude: float, longitude: float) -> Union[str, None]:
+        """Return the IANA zone name at a coordinate, or None if no zone covers it."""
+        return self._zone_at(float(latitude), float(longitude))
+
+    def _find_zone(self, latitude: float, longitude: float) -> Union[str, None]:
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return None
+        ix = int((longitude - _ORIGIN_X) // self.cell_degrees)
+        iy = int((latitude - _ORIGIN_Y) // self.cell_degrees)
+        east = _ORIGIN_X + (ix + 1) * self.cell_degrees
+        south = _ORIGIN_Y + iy * self.cell_degrees
+        for zone_id, inside, edges in self.cells.get(iy * self._columns + ix, ()):
+            if edges is not None:
+                # a ray from the point east to the cell edge, then north along the cell edge from its
+                # south-east corner: each boundary crossed flips inside/outside
+                for i in range(0, len(edges), 4):
+                    x1, y1, x2, y2 = edges[i], edges[i + 1], edges[i + 2], edges[i + 3]
+                    if (y1 > latitude) != (y2 > latitude):
+                        x = x1 + (latitude - y1) * (x2 - x1) / (y2 - y1)
+                        if longitude < x <= east:
+                            inside = not inside
+                    if (x1 > east) != (x2 > east):
+                        y = y1 + (east - x1) * (y2 - y1) / (x2 - x1)
+                        if south < y <= latitude:
+                            inside = not inside
+            if inside:
+                return self.zones[zone_id]
+        return None
+
+    def utc_offset(self, zone: str, timestamp: int) -> timedelta:
+        """The UTC offset in `zone` at a unix timestamp, daylight saving time included."""
+        hour = timestamp // 3600
+        offset = self._offsets.get((zone, hour))
+        if offset is not None:
+            return offset
+        tzinfo = self._zoneinfos.get(zone)
+        if tzinfo is None:
+            tzinfo = self._zoneinfos[zone] = ZoneInfo(zone)
+        start = datetime.fromtimestamp(hour * 3600, timezone.utc).astimezone(tzinfo).utcoffset()
+        end = datetime.fromtimestamp(hour * 3600 + 3599, timezone.utc).astimezone(tzinfo).utcoffset()
+        if start != end:
+            # the offset changes within this hour (zones a half hour off UTC), so it can't be cached
+            return datetime.fromtimestamp(timestamp, timezone.utc).astimezone(tzinfo).utcoffset()
+        self._offsets[(zone, hour)] = start
+        return start
+
+
+def load_timezones(path: str) -> Union[TimezoneResolver, None]:
+    """Load the timezone boundaries at `path`, or return None (with a warning) if they aren't there."""
+    if not path or not os.path.exists(path):
+        logger.warning(f"No timezone boundary data at {path}, times will be written in UTC")
+        return None
+    try:
+        return TimezoneResolver.load(path)
+    except (OSError, ValueError, KeyError, StopIteration, zipfile.BadZipFile) as e:
+        logger.warning(f"Couldn't load timezone boundary data from {path} ({e}), times will be written in UTC")
+        return None
+
+
+def format_offset(offset: timedelta) -> str:
+    """Format a UTC offset the way EXIF OffsetTime tags hold it, like "+05:30"."""
+    minutes = int(offset.total_seconds()) // 60
+    sign = "+" if minutes >= 0 else "-"
+    return f"{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+
+
+def local_time(timestamp: int, zone: Union[str, None], resolver: Union[TimezoneResolver, None]) -> datetime:
+    """The wall-clock time of a unix timestamp in `zone`, or in UTC when the zone isn't known."""
+    offset = timedelta(0)
+    if zone is not None and resolver is not None:
+        try:
+            offset = resolver.utc_offset(zone, timestamp)
+        except ZoneInfoNotFoundError:
+            logger.warning(f"Unknown timezone {zone}, writing times in UTC")
+    return datetime.fromtimestamp(timestamp, timezone(offset))
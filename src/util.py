@@ -1,5 +1,5 @@
 from typing import Union, List, Tuple
-import logging, os, json, pickle
+import logging, os, json, pickle, hashlib
 from datetime import timedelta, datetime, timezone
 import subprocess
 logger = logging.getLogger(__name__)
@@ -10,19 +10,6 @@ def run_command(command:str, verbose:bool=False):
     result = subprocess.run(command, capture_output=True, text=True, shell=True)
     return result.stdout, result.stderr, result.returncode
 
-# Check if date is in DST range (second Sunday in March to first Sunday in November)
-def is_dst(date) -> bool:
-    # Get the year
-    year = date.year
-    # Second Sunday in March
-    dst_start = datetime(year, 3, 8, 2, 0, 0, tzinfo=timezone.utc)
-    while dst_start.weekday() != 6:  # 6 is Sunday
-        dst_start = dst_start + timedelta(days=1)
-    # First Sunday in November
-    dst_end = datetime(year, 11, 1, 2, 0, 0, tzinfo=timezone.utc)
-    while dst_end.weekday() != 6:  # 6 is Sunday
-        dst_end = dst_end + timedelta(days=1)
-    return dst_start <= date <= dst_end
 def _format_list(li) -> str:
     out = ""
     max_digits = len(str(len(li) - 1))
@@ -30,6 +17,28 @@ def _format_list(li) -> str:
         out += f"{i:0{max_digits}d}: {l}\n"
     return out[:-2]
 
+def _format_bytes(num_bytes:float) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(num_bytes) < 1024 or unit == "TB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+def _is_inside(path:str, root:str) -> bool:
+    """Whether `path` is `root` or below it once symlinks and `..` are resolved."""
+    root = os.path.realpath(root)
+    path = os.path.realpath(path)
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+def _hash_ends(path:str, size:int, block:int) -> str:
+    """Hash of the first and last `block` bytes of a file of `size` bytes, which tells apart almost all files of that size."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(block))
+        if size > block:
+            f.seek(max(size - block, block))
+            digest.update(f.read(block))
+    return digest.hexdigest()
+
 def _find_in_matched(l: List[Tuple[str]], item:str, key=True) -> Tuple[str]:
     """
     Search through a list of (media_file, json_file) tuples to find a match containing the given item.
@@ -0,0 +1,158 @@
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+from exif_interface import _run_exiftool
+from exif_native import parse_date
+from exiftool_pool import ExifToolPool
+from quicktime import QUICKTIME_TYPES
+from xmp import XMP_EXTENSION
+from metrics import REGISTRY
+from __init__ import VERIFY_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+VERIFIED_TAGS = ("DateTimeOriginal", "CreateDate", "OffsetTime", "OffsetTimeOriginal", "OffsetTimeDigitized")
+_DATE_TAGS = ("DateTimeOriginal", "CreateDate")
+_FOUND_DATE = re.compile(r"^(\d{4}:\d\d:\d\d \d\d:\d\d:\d\d)(?:\.\d+)?(Z|[+-]\d\d:\d\d)?$")
+_UTC_GROUPS = {"QuickTime"}  # groups whose dates are stored in UTC without an offset
+
+
+def expected_tags(exif_data: dict, file_type: str) -> Dict[str, str]:
+    """The tags of `exif_data` a file of `file_type` should end up with.
+
+    Videos only have a `CreateDate` field of their own, and XMP sidecars and GIFs (which exiftool
+    gives XMP) have no offset tags.
+    """
+    if file_type in QUICKTIME_TYPES:
+        names = ("CreateDate",)
+    elif file_type in (XMP_EXTENSION, ".gif"):
+        names = _DATE_TAGS
+    else:
+        names = VERIFIED_TAGS
+    return {name: exif_data[name] for name in names if name in exif_data}
+
+
+def _same_date(expected: str, found: str, utc: bool) -> bool:
+    """Whether exiftool's `found` is the date `expected` (with its offset) was written as.
+
+    EXIF dates are compared as wall-clock times, the offset is in its own tag. Dates that come with
+    an offset, or are stored in UTC, are compared as instants.
+    """
+    match = _FOUND_DATE.match(found.strip())
+    if match is None:
+        return False
+    wall, zone = match.groups()
+    if zone is None and not utc:
+        return wall == expected[:19]
+    zone = "+00:00" if zone in (None, "Z") else zone
+    return datetime.strptime(wall + zone, "%Y:%m:%d %H:%M:%S%z") == parse_date(expected)
+
+
+def compare_tags(expected: Dict[str, str], found: dict) -> List[Tuple[str, str, str]]:
+    """Compare the tags from `expected_tags` with exiftool's `-j -G1` output for the same file.
+
+    Returns:
+        List[Tuple[str, str, str]]: (tag, expected value, value found or None) for every tag that differs
+    """
+    values = {}
+    for key, value in found.items():
+        group, _, tag = key.rpartition(":")
+        values.setdefault(tag, (group, str(value)))
+    mismatches = []
+    for tag, value in expected.items():
+        group, actual = values.get(tag, (None, None))
+        if actual is None:
+            mismatches.append((tag, value, None))
+        elif tag in _DATE_TAGS:
+            if not _same_date(value, actual, group in _UTC_GROUPS):
+                mismatches.append((tag, value, actual))
+        elif actual != value:
+            mismatches.append((tag, value, actual))
+    return mismatches
+
+
+class Verifier:
+    """
+    Read back the tags of written files and compare them with what should have been written.
+
+    Files are collected into batches of `batch_size` and every batch is read by one exiftool command
+    that asks for the verified tags only, with `-fast2` so exiftool stops before the image data.
+    Batches run in parallel on `jobs` threads, so verification keeps up with the merge it runs next to.
+    """
+
+    def __init__(self, pool: ExifToolPool, batch_size: int = VERIFY_BATCH_SIZE, jobs: int = None):
+        self.pool = pool
+        self.batch_size = batch_size
+        jobs = jobs or pool.size
+        self._executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="verify")
+        self._slots = threading.Semaphore(2 * jobs)  # batches waiting or running
+        self._lock = threading.Lock()
+        self._batch: Dict[str, Dict[str, str]] = {}
+        self._futures = []
+        self.checked = 0
+        self.mismatches: List[dict] = []
+
+    def add(self, file_path: str, expected: Dict[str, str]):
+        """Queue a file to be checked for the `expected` tags. Waits while too many batches are pending."""
+        with self._lock:
+            self._batch[file_path] = expected
+            if len(self._batch) < self.batch_size:
+                return
+            batch, self._batch = self._batch, {}
+        self._submit(batch)
+
+    def _submit(self, batch: Dict[str, Dict[str, str]]):
+        self._slots.acquire()
+        future = self._executor.submit(self._check, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _check(self, batch: Dict[str, Dict[str, str]]):
+        args = ["-j", "-fast2", "-G1", *(f"-{tag}" for tag in VERIFIED_TAGS), *batch]
+        with REGISTRY.timer("verify_seconds"):
+            out, err, rc = _run_exiftool(args, self.pool)
+        try:
+            found = {entry["SourceFile"]: entry for entry in json.loads(out)} if out.strip() else {}
+        except json.JSONDecodeError as e:
+            logger.error(f"Couldn't parse the tags exiftool read from {len(batch)} files: {e}")
+            found = {}
+        mismatches = []
+        for file_path, expected in batch.items():
+            if file_path not in found:
+                error = next((line for line in err.splitlines() if file_path in line), "exiftool didn't read the file")
+                mismatches.append({"file": file_path, "error": error})
+                continue
+            mismatches += [{"file": file_path, "tag": tag, "expected": value, "found": actual}
+                           for tag, value, actual in compare_tags(expected, found[file_path])]
+        REGISTRY.inc("verified_files_total", len(batch))
+        REGISTRY.inc("verify_mismatches_total", len(mismatches))
+        with self._lock:
+            self.checked += len(batch)
+            self.mismatches.extend(mismatches)
+
+    def finish(self) -> dict:
+        """Check the files still waiting, wait for every batch and return the report."""
+        with self._lock:
+            batch, self._batch = self._batch, {}
+        if batch:
+            self._submit(batch)
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown()
+        return self.report()
+
+    def close(self):
+        """Drop the batches that haven't started, for a run that stops early."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def report(self) -> dict:
+        with self._lock:
+            mismatches = sorted(self.mismatches, key=lambda mismatch: (mismatch["file"], mismatch.get("tag", "")))
+            return {"checked": self.checked, "mismatched_files": len({mismatch["file"] for mismatch in mismatches}),
+                    "mismatches": mismatches}
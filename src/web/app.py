@@ -1,55 +1,33 @@
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
 from flask_socketio import SocketIO, emit
 import os
 import logging
 from datetime import datetime
 import json
 import sys
-import threading
-import queue
-import copy
-import signal
 
 # Add the project root to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from src.main import merge_metadata
+from src.web.jobs import JobManager, BatchedLogHandler, FINISHED_STATES
+from src.web.streaming import Coalescer, LogBuffer
+from src.web.browse import page_directory
+from src.__init__ import WEB_POLL_SECONDS, WEB_LOG_DIR, WEB_BROWSE_PAGE_SIZE
+from metrics import Metrics
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*")
 
-# Global variable to store the current processing task
-current_task = None
+def send_server_logs(kind, entries):
+    # the server's own log lines, a batch at a time
+    server_logs.extend(entries)
+    socketio.emit('log_batch', {'logs': entries}, namespace='/')
 
-class WebSocketLogHandler(logging.Handler):
-    """Custom log handler that sends logs to WebSocket clients"""
-    def __init__(self):
-        super().__init__()
-        self.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s: %(message)s', datefmt='%Y-%m-%d_%H:%M:%S'))
-        # Store logs for download
-        self.log_queue = queue.Queue()
-
-    def emit(self, record):
-        try:
-            # Create a copy of the record to avoid modifying the original
-            record_copy = copy.copy(record)
-            # Format the log message
-            log_entry = self.format(record_copy)
-            # Store in queue for download
-            self.log_queue.put(log_entry)
-            # Send to WebSocket clients with level information
-            socketio.emit('log_update', {
-                'log': log_entry,
-                'level': record_copy.levelname,
-                'timestamp': datetime.fromtimestamp(record_copy.created).strftime('%Y-%m-%d_%H:%M:%S')
-            }, namespace='/')
-        except Exception as e:
-            logger.error(f"Error in WebSocketLogHandler: {str(e)}")
-            self.handleError(record)
+server_logs = LogBuffer(os.path.join(WEB_LOG_DIR, "server.log"))
 
 # Configure logging
 logging.basicConfig(
@@ -58,8 +36,8 @@ logging.basicConfig(
     datefmt='%Y-%m-%d_%H:%M:%S'
 )
 
-# Create and configure the WebSocket handler
-websocket_handler = WebSocketLogHandler()
+# Send log lines to WebSocket clients in batches, a few times a second
+websocket_handler = BatchedLogHandler(Coalescer(send_server_logs).start())
 websocket_handler.setLevel(logging.DEBUG)  # Capture all levels
 
 # Get the root logger and add our handler
@@ -88,36 +66,27 @@ def browse_directory():
     current_path = data.get('path', '/')
     
     try:
+        offset = int(data.get('offset', 0))
+        limit = min(int(data.get('limit', WEB_BROWSE_PAGE_SIZE)), 10 * WEB_BROWSE_PAGE_SIZE)
+
         # Ensure the path exists and is a directory
-        if not os.path.exists(current_path) or not os.path.isdir(current_path):
+        if not os.path.isdir(current_path):
             return jsonify({'error': 'Invalid directory path'}), 400
 
         # Get parent directory
         parent_dir = os.path.dirname(current_path) if current_path != '/' else None
 
-        # List directories and files
-        items = []
-        for item in os.listdir(current_path):
-            full_path = os.path.join(current_path, item)
-            try:
-                is_dir = os.path.isdir(full_path)
-                # Skip hidden files and directories
-                if not item.startswith('.'):
-                    items.append({
-                        'name': item,
-                        'path': full_path,
-                        'is_dir': is_dir
-                    })
-            except PermissionError:
-                continue
-
-        # Sort: directories first, then files, both alphabetically
-        items.sort(key=lambda x: (not x['is_dir'], x['name'].lower()))
+        # One page of the directories (and files, when asked for) whose names start with the prefix
+        entries, total = page_directory(current_path, offset, limit, data.get('prefix', ''), data.get('dirsOnly', True))
+        items = [{'name': name, 'path': os.path.join(current_path, name), 'is_dir': is_dir} for name, is_dir in entries]
 
         return jsonify({
             'current_path': current_path,
             'parent_dir': parent_dir,
-            'items': items
+            'items': items,
+            'offset': offset,
+            'total': total,
+            'has_more': offset + len(items) < total
         })
 
     except Exception as e:
@@ -131,38 +100,34 @@ def select_directory():
         return jsonify({'error': 'Directory does not exist'}), 400
     return jsonify({'success': True, 'path': directory})
 
-def background_process(input_dir, output_dir, dry_run, overwrite, log_level):
-    global current_task
-    current_task = eventlet.getcurrent()
-    
-    try:
-        def progress_callback(progress_data):
-            try:
-                socketio.emit('progress_update', progress_data, namespace='/')
-                eventlet.sleep(0)  # Give Socket.IO a chance to send the message
-            except Exception as e:
-                logger.error(f"Error emitting progress update: {str(e)}")
-            
-        success = merge_metadata(input_dir, output_dir, dry_run, overwrite, progress_callback)
-        try:
-            socketio.emit('process_complete', {'success': success}, namespace='/')
-        except Exception as e:
-            logger.error(f"Error emitting process complete: {str(e)}")
-    except eventlet.greenlet.GreenletExit:
-        logger.info("Processing aborted by user")
-        try:
-            socketio.emit('process_complete', {'success': False, 'error': 'Processing aborted by user'}, namespace='/')
-        except Exception as e:
-            logger.error(f"Error emitting process abort: {str(e)}")
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Processing error: {error_msg}")
+def job_event(kind, job, data):
+    # relay what happens in the job workers to the browser, tagged with the job
+    if kind == 'logs':
+        socketio.emit('log_batch', {'job_id': job.id, 'logs': data}, namespace='/')
+    elif kind == 'progress':
+        socketio.emit('progress_update', dict(data, job_id=job.id), namespace='/')
+    else:
+        socketio.emit('job_update', job.to_dict(), namespace='/')
+        if job.state in FINISHED_STATES:
+            socketio.emit('process_complete', {'job_id': job.id, 'success': job.success, 'error': job.error}, namespace='/')
+
+jobs = JobManager(on_event=job_event)
+
+def poll_jobs():
+    while True:
         try:
-            socketio.emit('process_complete', {'success': False, 'error': error_msg}, namespace='/')
+            jobs.poll()
         except Exception as e:
-            logger.error(f"Error emitting process error: {str(e)}")
-    finally:
-        current_task = None
+            logger.error(f"Error polling jobs: {str(e)}")
+        eventlet.sleep(WEB_POLL_SECONDS)
+
+eventlet.spawn(poll_jobs)
+
+def job_or_404(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return None, (jsonify({'error': f'No job {job_id}'}), 404)
+    return job, None
 
 @app.route('/process', methods=['POST'])
 def process():
@@ -174,41 +139,94 @@ def process():
     overwrite = data.get('overwriteIfExists', False)
 
     # Validate directories
-    if not os.path.exists(input_dir):
+    if not input_dir or not os.path.exists(input_dir):
         return jsonify({'error': 'Input directory does not exist'}), 400
-    if input_dir == output_dir:
+    if not output_dir or os.path.normpath(input_dir) == os.path.normpath(output_dir):
         return jsonify({'error': 'Input and output directories must be different'}), 400
-
-    # Set log level for both loggers
-    root_logger.setLevel(getattr(logging, log_level))
-
-    # Start processing in a background task
-    eventlet.spawn(background_process, input_dir, output_dir, dry_run, overwrite, log_level)
-    return jsonify({'message': 'Processing started'})
+    for job in jobs.running():
+        if os.path.normpath(job.params['outputDir']) == os.path.normpath(output_dir):
+            return jsonify({'error': f'Job {job.id} is already writing to {output_dir}'}), 409
+
+    # Run in a worker process, or wait in the queue until one is free
+    job = jobs.submit({'inputDir': input_dir, 'outputDir': output_dir, 'dryRun': dry_run,
+                       'overwrite_if_exists': overwrite, 'log_level': log_level})
+    return jsonify({'message': f'Job {job.state}', 'job': job.to_dict()})
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify({'jobs': [job.to_dict() for job in jobs.jobs()]})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job, error = job_or_404(job_id)
+    return error or jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/logs')
+def get_job_logs(job_id):
+    # lines from `since` on, so a reloaded page can catch up without fetching everything again
+    # older lines than the ones kept in memory are only in the downloadable log file
+    job, error = job_or_404(job_id)
+    if error:
+        return error
+    logs, first = job.logs.since(request.args.get('since', 0, type=int))
+    return jsonify({'logs': logs, 'first': first, 'next': first + len(logs)})
+
+@app.route('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job, error = job_or_404(job_id)
+    if error:
+        return error
+    if job.state not in FINISHED_STATES:
+        return jsonify({'error': f'Job {job_id} is {job.state}'}), 409
+    report = Metrics()
+    if job.metrics is not None:
+        report.absorb(job.metrics)
+    metrics = {key: value for key, value in report.report().items() if key in ('counters', 'gauges', 'histograms')}
+    return jsonify({'id': job.id, 'state': job.state, 'success': job.success, 'error': job.error,
+                    'progress': job.progress, 'metrics': metrics})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job, error = job_or_404(job_id)
+    if error:
+        return error
+    if not jobs.cancel(job_id):
+        return jsonify({'message': f'Job {job_id} already {job.state}'})
+    logger.info(f"Cancelling job {job_id}")
+    return jsonify({'message': f'Cancelling job {job_id}', 'job': job.to_dict()})
 
 @app.route('/download_logs')
 def download_logs():
-    # Create a temporary file with all logs
-    log_file = f"logs_{datetime.now().strftime('%Y%m%d_%H%M:%S')}.txt"
-    with open(log_file, 'w') as f:
-        while not websocket_handler.log_queue.empty():
-            f.write(websocket_handler.log_queue.get() + '\n')
-    
-    return send_file(log_file, as_attachment=True)
+    # stream the whole log file of a job, or of the server without ?job=
+    logs = server_logs
+    job_id = request.args.get('job')
+    if job_id:
+        job, error = job_or_404(job_id)
+        if error:
+            return error
+        logs = job.logs
+    name = f"logs_{job_id or 'server'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    return send_file(logs.path, mimetype='text/plain', as_attachment=True, download_name=name, max_age=0)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format, for scraping while jobs are running. Every job's numbers carry its id
+    combined = Metrics()
+    for job in jobs.jobs():
+        if job.metrics is not None:
+            combined.absorb(job.metrics, job=job.id)
+    return Response(combined.to_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/abort', methods=['POST'])
 def abort():
-    global current_task
-    if current_task is not None:
-        try:
-            current_task.kill()
-            logger.info("Processing task aborted")
-            return jsonify({'message': 'Processing aborted'})
-        except Exception as e:
-            logger.error(f"Error aborting task: {str(e)}")
-            return jsonify({'error': str(e)}), 500
-    else:
+    # stops the given job, or every running one
+    job_id = (request.get_json(silent=True) or {}).get('jobId')
+    targets = [job_id] if job_id else [job.id for job in jobs.running()]
+    cancelled = [target for target in targets if jobs.cancel(target)]
+    if not cancelled:
         return jsonify({'message': 'No task running'})
+    logger.info(f"Aborting jobs {', '.join(cancelled)}")
+    return jsonify({'message': 'Processing aborted', 'jobs': cancelled})
 
 if __name__ == '__main__':
     # Test log when server starts
@@ -0,0 +1,46 @@
+import os
+from functools import lru_cache
+from typing import List, Tuple
+from src.__init__ import WEB_BROWSE_CACHE_SIZE
+
+Entry = Tuple[str, bool]  # name, is a directory
+
+
+@lru_cache(maxsize=WEB_BROWSE_CACHE_SIZE)
+def _scan(path: str, mtime_ns: int, dirs_only: bool) -> Tuple[Entry, ...]:
+    # the mtime is only part of the key: a directory changes it when an entry is added, removed or renamed
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith('.'):  # Skip hidden files and directories
+                continue
+            try:
+                is_dir = entry.is_dir()  # from d_type, only symlinks need a stat
+            except OSError:
+                continue
+            if is_dir or not dirs_only:
+                entries.append((entry.name, is_dir))
+    # Sort: directories first, then files, both alphabetically
+    entries.sort(key=lambda e: (not e[1], e[0].lower()))
+    return tuple(entries)
+
+
+def list_directory(path: str, dirs_only: bool = True) -> Tuple[Entry, ...]:
+    """List the visible entries of a directory, directories first, with repeat visits served from a cache
+    until the directory changes.
+
+    Raises:
+        OSError: If the directory can't be listed
+    """
+    return _scan(path, os.stat(path).st_mtime_ns, dirs_only)
+
+
+def page_directory(path: str, offset: int = 0, limit: int = 200, prefix: str = "", dirs_only: bool = True) -> Tuple[List[Entry], int]:
+    """Return the entries of one page of a directory listing whose names start with `prefix` (ignoring
+    case), and how many entries match in total."""
+    entries = list_directory(path, dirs_only)
+    if prefix:
+        prefix = prefix.lower()
+        entries = [entry for entry in entries if entry[0].lower().startswith(prefix)]
+    offset = max(offset, 0)
+    return list(entries[offset:offset + max(limit, 0)]), len(entries)
@@ -0,0 +1,259 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List
+from src.__init__ import WEB_MAX_JOBS, WEB_JOB_HISTORY, WEB_JOB_LOG_LINES, WEB_LOG_DIR, WEB_METRICS_SECONDS
+from src.web.streaming import Coalescer, LogBuffer
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+CANCELLING = "cancelling"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_LOG_FORMAT = '%(asctime)s:%(levelname)s: %(message)s'
+_DATE_FORMAT = '%Y-%m-%d_%H:%M:%S'
+
+
+def log_entry(handler: logging.Handler, record: logging.LogRecord) -> dict:
+    """A log record the way the page shows it."""
+    return {
+        'log': handler.format(record),
+        'level': record.levelname,
+        'timestamp': datetime.fromtimestamp(record.created).strftime(_DATE_FORMAT)
+    }
+
+
+class BatchedLogHandler(logging.Handler):
+    """Hand every log record to a Coalescer, formatted like the web app's own logs."""
+    def __init__(self, coalescer: Coalescer):
+        super().__init__()
+        self.coalescer = coalescer
+        self.setFormatter(logging.Formatter(_LOG_FORMAT, datefmt=_DATE_FORMAT))
+
+    def emit(self, record):
+        try:
+            self.coalescer.log(log_entry(self, record))
+        except Exception:
+            self.handleError(record)
+
+
+def _interrupt(signum, frame):
+    # iter_merge cleans up the files it was writing when interrupted
+    raise KeyboardInterrupt()
+
+
+def run_job(conn, params: dict):
+    """Entry point of a job worker process: run `iter_merge` with `params` and report back over `conn`.
+
+    Sends batches of ("logs", entries), the latest ("progress", update) and ("metrics", snapshot) messages
+    a few times a second while running, then ("done", success, error). SIGTERM aborts the run.
+    """
+    signal.signal(signal.SIGTERM, _interrupt)
+    lock = threading.Lock()
+
+    def send(*message):
+        with lock:
+            conn.send(message)
+
+    coalescer = Coalescer(send).start()
+    root_logger = logging.getLogger()
+    root_logger.handlers = [BatchedLogHandler(coalescer)]
+    root_logger.setLevel(getattr(logging, params.pop("log_level", "INFO")))
+
+    from src.main import iter_merge, merge_progress
+    from metrics import REGISTRY  # main records into the module on its flat path
+    last_metrics = 0.0
+    summary = {}
+    results = iter_merge(summary=summary, **params)
+    try:
+        for result in results:
+            coalescer.progress(merge_progress(result, summary))
+            if time.monotonic() - last_metrics > WEB_METRICS_SECONDS:
+                last_metrics = time.monotonic()
+                send("metrics", REGISTRY.snapshot())
+        success = summary["ok"]
+        error = None if success else "Some files failed, see the log"
+    except KeyboardInterrupt:
+        success, error = False, "Processing aborted by user"
+    except Exception as e:
+        success, error = False, str(e)
+    finally:
+        results.close()
+    coalescer.close()
+    send("metrics", REGISTRY.snapshot())
+    send("done", success, error)
+    conn.close()
+
+
+@dataclass(slots=True)
+class Job:
+    """One merge run requested through the web app."""
+    id: str
+    params: dict
+    state: str = QUEUED
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    progress: dict = field(default_factory=dict)
+    logs: LogBuffer = None
+    success: bool = None
+    error: str = None
+    metrics: dict = None  # latest metrics snapshot from the worker
+    cancel_requested: bool = False
+    process: multiprocessing.Process = None
+    conn: object = None  # reading end of the pipe from the worker
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "state": self.state, "params": self.params, "created": self.created,
+                "started": self.started, "finished": self.finished, "progress": self.progress,
+                "success": self.success, "error": self.error, "log_lines": self.logs.total}
+
+
+class JobManager:
+    """
+    Run merge jobs in their own worker processes, at most `max_running` at a time, the rest queued in
+    submission order. A worker process keeps the exiftool work off the web server's event loop, and
+    can be stopped without taking the server down.
+
+    Nothing here blocks: `poll()` is called periodically (the web app does it from a greenlet) to pick
+    up logs and progress from the workers, notice finished ones and start queued jobs. Everything that
+    happens is passed to `on_event(kind, job, data)` as well, with kind "logs" (a batch of entries),
+    "progress" or "state". Every job's log is also written to a file in `log_dir`.
+    """
+
+    def __init__(self, max_running: int = WEB_MAX_JOBS, history: int = WEB_JOB_HISTORY, log_lines: int = WEB_JOB_LOG_LINES,
+                 log_dir: str = WEB_LOG_DIR, target: Callable = run_job, on_event: Callable = None):
+        self.max_running = max(max_running, 1)
+        self.history = history
+        self.log_lines = log_lines
+        self.log_dir = log_dir
+        self.target = target
+        self.on_event = on_event or (lambda kind, job, data: None)
+        self._jobs: Dict[str, Job] = {}  # in submission order
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+
+    def submit(self, params: dict) -> Job:
+        job_id = uuid.uuid4().hex[:12]
+        job = Job(id=job_id, params=dict(params), logs=LogBuffer(os.path.join(self.log_dir, f"job-{job_id}.log"), self.log_lines))
+        with self._lock:
+            self._jobs[job.id] = job
+        self._event("state", job)
+        self._start_queued()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        """All known jobs, newest first."""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def running(self) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.state in (RUNNING, CANCELLING)]
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job, or stop a running one. Returns False for unknown or finished jobs."""
+        job = self._jobs.get(job_id)
+        if job is None or job.state in FINISHED_STATES:
+            return False
+        job.cancel_requested = True
+        if job.state == QUEUED:
+            self._finish(job, CANCELLED, False, "Cancelled before it started")
+        elif job.state == RUNNING:
+            job.state = CANCELLING
+            self._event("state", job)
+            job.process.terminate()
+        return True
+
+    def poll(self):
+        """Relay what the workers sent, wrap up the ones that exited and start queued jobs."""
+        for job in self.running():
+            self._drain(job)
+            if not job.process.is_alive():
+                self._drain(job)
+                job.process.join()
+                job.conn.close()
+                if job.cancel_requested:
+                    self._finish(job, CANCELLED, False, "Processing aborted by user")
+                elif job.success is None:
+                    self._finish(job, FAILED, False, f"Worker exited with code {job.process.exitcode}")
+                else:
+                    self._finish(job, DONE if job.success else FAILED, job.success, job.error)
+        self._start_queued()
+
+    def shutdown(self, timeout: float = 10):
+        """Cancel every job and wait for the workers to exit."""
+        for job in self.jobs():
+            self.cancel(job.id)
+        deadline = time.monotonic() + timeout
+        while self.running() and time.monotonic() < deadline:
+            self.poll()
+            time.sleep(0.05)
+        for job in self.running():
+            job.process.kill()
+        self.poll()
+
+    def _drain(self, job: Job):
+        try:
+            while job.conn.poll():
+                kind, *data = job.conn.recv()
+                if kind == "logs":
+                    job.logs.extend(data[0])
+                    self._event("logs", job, data[0])
+                elif kind == "progress":
+                    job.progress = data[0]
+                    self._event("progress", job, data[0])
+                elif kind == "metrics":
+                    job.metrics = data[0]
+                elif kind == "done":
+                    job.success, job.error = data
+        except (EOFError, OSError):
+            pass  # the worker exited, poll() notices
+
+    def _start_queued(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.state in (RUNNING, CANCELLING))
+            starting = [job for job in self._jobs.values() if job.state == QUEUED][:max(self.max_running - running, 0)]
+            for job in starting:
+                job.state = RUNNING
+        for job in starting:
+            job.conn, child_conn = self._context.Pipe(duplex=False)
+            job.process = self._context.Process(target=self.target, args=(child_conn, dict(job.params)),
+                                                name=f"job-{job.id}", daemon=True)
+            job.started = time.time()
+            job.process.start()
+            child_conn.close()
+            logger.info(f"Started job {job.id} (pid {job.process.pid})")
+            self._event("state", job)
+
+    def _finish(self, job: Job, state: str, success: bool, error: str):
+        job.state, job.success, job.error, job.finished = state, success, error, time.time()
+        job.process = job.conn = None
+        job.logs.close()
+        logger.info(f"Job {job.id} {state}" + (f": {error}" if error else ""))
+        self._event("state", job)
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.state in FINISHED_STATES]
+            for old in finished[:max(len(finished) - self.history, 0)]:
+                del self._jobs[old.id]
+                old.logs.remove()
+
+    def _event(self, kind: str, job: Job, data: dict = None):
+        try:
+            self.on_event(kind, job, data)
+        except Exception as e:
+            logger.error(f"Error handling {kind} event of job {job.id}: {e}")
@@ -5,10 +5,18 @@ import argparse
 # Add the project root to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from src.web.app import app, socketio
+from src.__init__ import WEB_MAX_JOBS
 
 if __name__ == '__main__':
+    # job worker processes import this file again, and mustn't set up a server of their own
+    from src.web.app import app, socketio, jobs
+
     parser = argparse.ArgumentParser(description='Run the web app')
     parser.add_argument('--port', type=int, default=5000, help='Port to run the app on')
+    parser.add_argument('--maxJobs', type=int, default=WEB_MAX_JOBS, help='Jobs to run at the same time, the rest wait in a queue')
     args = parser.parse_args()
-    socketio.run(app, host='0.0.0.0', port=args.port, debug=True) 
\ No newline at end of file
+    jobs.max_running = max(args.maxJobs, 1)
+    try:
+        socketio.run(app, host='0.0.0.0', port=args.port, debug=True)
+    finally:
+        jobs.shutdown() 
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import threading
+from collections import deque
+from typing import Callable, List, Tuple
+from src.__init__ import WEB_FLUSH_SECONDS, WEB_LOG_BATCH, WEB_JOB_LOG_LINES
+
+
+class Coalescer:
+    """
+    Collect log entries and progress updates and pass them on in batches, at most every `interval`
+    seconds, as `send("logs", entries)` and `send("progress", update)`.
+
+    Progress updates replace each other, so only the latest one is sent. Log entries are all sent,
+    in order, and a batch is sent early once it holds `max_batch` entries. The caller of `log` and
+    `progress` never waits on the receiving end, except to hand over a full batch.
+    """
+
+    def __init__(self, send: Callable, interval: float = WEB_FLUSH_SECONDS, max_batch: int = WEB_LOG_BATCH):
+        self.send = send
+        self.interval = interval
+        self.max_batch = max_batch
+        self._logs = []
+        self._progress = None
+        self._lock = threading.Lock()  # guards the pending entries
+        self._flush_lock = threading.Lock()  # keeps batches in order
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "Coalescer":
+        self._thread = threading.Thread(target=self._run, name="coalescer", daemon=True)
+        self._thread.start()
+        return self
+
+    def log(self, entry):
+        with self._lock:
+            self._logs.append(entry)
+            full = len(self._logs) >= self.max_batch
+        if full:
+            self.flush()
+
+    def progress(self, update):
+        with self._lock:
+            self._progress = update
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                logs, self._logs = self._logs, []
+                progress, self._progress = self._progress, None
+            if logs:
+                self.send("logs", logs)
+            if progress is not None:
+                self.send("progress", progress)
+
+    def close(self):
+        """Stop the timer and send whatever is still pending."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+class LogBuffer:
+    """
+    The log lines of one job or of the server: the last `max_lines` in memory for the page, and every
+    line in a spill file on disk for downloading.
+
+    Lines are numbered from 0 in the order they were added, so a client that has seen `n` of them
+    asks for `since(n)` and gets the rest, as far as they are still in memory.
+    """
+
+    def __init__(self, path: str, max_lines: int = WEB_JOB_LOG_LINES):
+        self.path = path
+        self.total = 0
+        self._lines = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def extend(self, entries: List[dict]):
+        with self._lock:
+            self._lines.extend(entries)
+            self.total += len(entries)
+            if not self._file.closed:
+                self._file.writelines(entry['log'] + '\n' for entry in entries)
+                self._file.flush()
+
+    def since(self, index: int) -> Tuple[List[dict], int]:
+        """Return the lines from `index` on that are still in memory, and the index of the first one."""
+        with self._lock:
+            first = self.total - len(self._lines)
+            start = max(index, first)
+            return list(self._lines)[start - first:], start
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
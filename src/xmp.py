@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+from typing import Callable, Dict, Tuple, Union
+from xml.sax.saxutils import quoteattr
+
+XMP_EXTENSION = ".xmp"
+
+# XMP properties written for each parsed tag, the ones exiftool maps the EXIF tags to
+_PROPERTIES = {
+    "DateTimeOriginal": ["exif:DateTimeOriginal", "photoshop:DateCreated"],
+    "CreateDate": ["exif:DateTimeDigitized", "xmp:CreateDate"],
+}
+_NAMESPACES = {
+    "exif": "http://ns.adobe.com/exif/1.0/",
+    "photoshop": "http://ns.adobe.com/photoshop/1.0/",
+    "xmp": "http://ns.adobe.com/xap/1.0/",
+}
+
+
+def _xmp_date(value: str) -> str:
+    """Turn an EXIF date with offset ("2019:04:05 10:11:12+02:00") into the ISO 8601 form XMP uses."""
+    return value[:10].replace(":", "-") + "T" + value[11:]
+
+
+def render_xmp(exif_data: dict) -> str:
+    """Render the tags from `parse_exif_data_from_sidecar` as an XMP sidecar packet.
+
+    The offsets end up in the dates themselves, XMP has no separate OffsetTime tags. The file dates
+    aren't written, they belong to the filesystem rather than the metadata.
+    """
+    attributes = [f"{prop}={quoteattr(_xmp_date(exif_data[tag]))}"
+                  for tag, props in _PROPERTIES.items() if tag in exif_data for prop in props]
+    namespaces = [f"xmlns:{prefix}={quoteattr(uri)}" for prefix, uri in _NAMESPACES.items()]
+    description = "\n    ".join(['rdf:about=""', *namespaces, *attributes])
+    return (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="google-photos-exif-merger">\n'
+        ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+        f'  <rdf:Description {description}/>\n'
+        ' </rdf:RDF>\n'
+        '</x:xmpmeta>\n'
+        '<?xpacket end="w"?>\n'
+    )
+
+
+def xmp_path(media_path: str) -> str:
+    """`IMG_0001.jpg` gets `IMG_0001.xmp`, the name Lightroom, digiKam and darktable all look for."""
+    return os.path.splitext(media_path)[0] + XMP_EXTENSION
+
+
+class XmpWriter:
+    """
+    Write XMP sidecars instead of tagged copies of the media files.
+
+    Two media files that only differ in extension, like the HEIC and MP4 of a live photo, map to the
+    same `.xmp`. The first one gets it. A later one with different tags gets `IMG_0001.MP4.xmp` instead
+    of overwriting it. A sidecar left over from an earlier run is replaced, unless `owner_of` (the
+    journal's) says it was written for another media file, like the half of a live photo that a resumed
+    run skips as done; then it counts as that file's and is only compared with.
+
+    The paths written by this writer are kept with a hash of their contents, and claimed and written
+    under a lock, so two write workers handling both halves of a live photo can't both take the same
+    `.xmp`. The sidecars are a few KB, so holding the lock while one is written costs little.
+    """
+
+    def __init__(self, owner_of: Callable[[str], Union[str, None]] = None):
+        self.owner_of = owner_of
+        # path claimed in this run -> digest of its contents and the media file it was claimed for
+        self._claimed: Dict[str, Tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+
+    def write(self, media_path: str, exif_data: dict, source: str = None) -> str:
+        """Write the sidecar for the media file that would have been written to `media_path`.
+
+        Args:
+            source: the media file, as `owner_of` knows it
+
+        Returns:
+            str: path of the sidecar
+
+        Raises:
+            ValueError: If the dates are missing
+        """
+        missing = {"DateTimeOriginal", "CreateDate"} - exif_data.keys()
+        if missing:
+            raise ValueError(f"Missing required EXIF fields: {missing}")
+        data = render_xmp(exif_data).encode("utf-8")
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        path = xmp_path(media_path)
+        with self._lock:
+            claimed = self._claimed.get(path)
+            if claimed is None:
+                claimed = self._claim_existing(path, source)
+                if claimed is not None:
+                    self._claimed[path] = claimed
+            if claimed is not None and claimed[0] == digest:
+                return path
+            if claimed is not None and (claimed[1] is None or claimed[1] != source):
+                path = media_path + XMP_EXTENSION
+            self._claimed[path] = (digest, source)
+            # replaces a sidecar left over from an earlier run
+            with open(path, "wb") as f:
+                f.write(data)
+        return path
+
+    def _claim_existing(self, path: str, source: str) -> Union[Tuple[bytes, str], None]:
+        """The claim of another media file on a sidecar an earlier run left at `path`, if it has one."""
+        if self.owner_of is None or not os.path.exists(path):
+            return None
+        owner = self.owner_of(path)
+        if owner is None or owner == source:
+            return None
+        with open(path, "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).digest(), owner
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""A tiny stand-in for exiftool, used by the tests when the real one isn't around.
+
+It understands the subset of the command line this project sends:
+`-TAG=VALUE` writes, `-j` reads (flat `GROUP:TAG` keys with `-G1`), `-overwrite_original`, `-o OUTFILE`, and the
+`-stay_open True -@ -` protocol with `-echo4` and `-executeNUM`. Tags are kept in
+a JSON file next to the media file instead of inside it.
+
+Errors go to stderr before the output, the way exiftool's warnings do, and a file named `*.hang`
+makes the command hang. Set FAKE_EXIFTOOL_LATENCY to make every command take that many seconds, and
+FAKE_EXIFTOOL_STARTUP to add a startup cost per process, to stand in for a real
+exiftool in benchmarks.
+"""
+import json
+import os
+import shutil
+import sys
+import time
+
+STORE_SUFFIX = ".fake-exif.json"
+LATENCY = float(os.environ.get("FAKE_EXIFTOOL_LATENCY", 0))
+STARTUP = float(os.environ.get("FAKE_EXIFTOOL_STARTUP", 0))
+
+
+def _store_path(file_path):
+    return file_path + STORE_SUFFIX
+
+
+def _load_tags(file_path):
+    try:
+        with open(_store_path(file_path), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def run(args):
+    """Run one command and return (stdout, stderr, status)."""
+    if LATENCY:
+        time.sleep(LATENCY)
+    writes, files, read_json, output, flat = {}, [], False, None, False
+    args = iter(args)
+    for arg in args:
+        if arg == "-o":
+            output = next(args)
+        elif arg.startswith("-") and "=" in arg:
+            key, value = arg[1:].split("=", 1)
+            writes[key] = value
+        elif arg == "-j":
+            read_json = True
+        elif arg == "-G1":
+            flat = True
+        elif arg.startswith("-"):
+            continue
+        else:
+            files.append(arg)
+
+    out, err, status = [], [], 0
+    for file_path in files:
+        if file_path.endswith(".hang"):
+            time.sleep(3600)
+        if not os.path.isfile(file_path):
+            err.append(f"Error: File not found - {file_path}\n")
+            status = 1
+            continue
+        if writes:
+            tags = _load_tags(file_path)
+            tags.update(writes)
+            if output is not None:
+                if os.path.exists(output):
+                    err.append(f"Error: '{output}' already exists - {file_path}\n")
+                    status = 1
+                    continue
+                shutil.copyfile(file_path, output)
+                file_path = output
+            with open(_store_path(file_path), "w") as f:
+                json.dump(tags, f)
+            out.append("    1 image files updated\n")
+        elif read_json:
+            extension = os.path.splitext(file_path)[1][1:].lower()
+            if flat:
+                out.append({"SourceFile": file_path, "File:FileTypeExtension": extension,
+                            **{f"ExifIFD:{tag}": value for tag, value in _load_tags(file_path).items()}})
+            else:
+                out.append({"SourceFile": file_path, "File": {"FileTypeExtension": extension},
+                            "ExifIFD": _load_tags(file_path)})
+    if read_json:
+        out = [json.dumps(out, indent=2) + "\n"]
+    return "".join(out), "".join(err), status
+
+
+def stay_open():
+    args = []
+    for line in sys.stdin:
+        line = line.rstrip("\n")
+        if line == "-stay_open":
+            continue
+        if line == "False":
+            break
+        if line.startswith("-execute"):
+            echo = [a for i, a in enumerate(args) if i > 0 and args[i - 1] == "-echo4"]
+            command = [a for i, a in enumerate(args) if a != "-echo4" and not (i > 0 and args[i - 1] == "-echo4")]
+            out, err, status = run(command)
+            sys.stderr.write(err)
+            sys.stderr.flush()
+            sys.stdout.write(out + "{ready" + line[len("-execute"):] + "}\n")
+            sys.stdout.flush()
+            sys.stderr.write("".join(e.replace("${status}", str(status)) + "\n" for e in echo))
+            sys.stderr.flush()
+            args = []
+        else:
+            args.append(line)
+
+
+if __name__ == "__main__":
+    if STARTUP:
+        time.sleep(STARTUP)
+    if sys.argv[1:3] == ["-stay_open", "True"]:
+        stay_open()
+    else:
+        out, err, status = run(sys.argv[1:])
+        sys.stdout.write(out)
+        sys.stderr.write(err)
+        sys.exit(status)
@@ -0,0 +1,145 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+import zlib
+from os.path import join
+from bench.synthetic_takeout import write_takeout
+from src.archive import TakeoutArchive, archive_parts, is_archive, open_archive
+from src.main import _iter_archive_items
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        self.source = join(self.root, "src")
+        self.expected = write_takeout(join(self.source, "Takeout", "Google Photos"), 20, albums=2, media_bytes=100_000)
+        members = sorted(os.path.relpath(join(directory, name), self.source)
+                         for directory, _, names in os.walk(self.source) for name in names)
+        sidecars = [name for name in members if name.endswith(".json")]
+        # media files in the first part, their sidecars split over both
+        self.part_members = [[name for name in members if not name.endswith(".json")] + sidecars[::2], sidecars[1::2]]
+        for extension in ["zip", "tgz"]:
+            for i, names in enumerate(self.part_members, 1):
+                path = join(self.root, f"takeout-20240101T000000Z-00{i}.{extension}")
+                if extension == "zip":
+                    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                        for name in names:
+                            archive.write(join(self.source, name), name)
+                else:
+                    with tarfile.open(path, "w:gz") as archive:
+                        for name in names:
+                            archive.add(join(self.source, name), name)
+        open(join(self.root, "takeout-20240101T000000Z-003.txt"), "w").close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_parts(self):
+        part = join(self.root, "takeout-20240101T000000Z-002.zip")
+        self.assertTrue(is_archive(part))
+        self.assertFalse(is_archive(self.source))
+        self.assertEqual(archive_parts(part), [join(self.root, "takeout-20240101T000000Z-001.zip"), part])
+        self.assertEqual(archive_parts(join(self.source, "other.zip")), [join(self.source, "other.zip")])
+
+    def test_items_match_across_parts_and_extract(self):
+        for extension in ["zip", "tgz"]:
+            archive = open_archive(join(self.root, f"takeout-20240101T000000Z-001.{extension}"))
+            summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+            out = join(self.root, f"out-{extension}")
+            try:
+                items = list(_iter_archive_items(archive, out, False, summary))
+                self.assertEqual({item.file: item.json_name for item in items}, self.expected, extension)
+                self.assertEqual(summary["total"], len(self.expected))
+                for item in items:
+                    self.assertEqual(item.size, os.path.getsize(join(self.source, item.input_file)))
+                    if archive.sequential:
+                        # streamed: extracted already, and carrying the sidecar
+                        self.assertEqual(item.copy_strategy, "archive")
+                        self.assertIn(b"photoTakenTime", zlib.decompress(item.sidecar))
+                    else:
+                        self.assertIn(b"photoTakenTime", archive.read(item.json_file))
+                        self.assertEqual(archive.extract(item.input_file, item.output_file), item.size)
+                    with open(item.output_file, "rb") as a, open(join(self.source, item.input_file), "rb") as b:
+                        self.assertEqual(a.read(), b.read(), item.file)
+                # asking for an earlier member again reads the part again
+                first = items[0]
+                self.assertEqual(archive.extract(first.input_file, join(self.root, f"again.{extension}")), first.size)
+            finally:
+                archive.close()
+
+    def test_tar_items_come_while_it_is_streamed(self):
+        path = join(self.root, "adjacent.tgz")
+        with tarfile.open(path, "w:gz") as archive:
+            for media, sidecar in sorted(self.expected.items()):
+                for name in (media, sidecar):
+                    archive.add(join(self.source, "Takeout", "Google Photos", name), join("Takeout", "Google Photos", name))
+        out = join(self.root, "streamed")
+        archive = open_archive(path)
+        try:
+            items = _iter_archive_items(archive, out, False, {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0},
+                                        skip=lambda item: item.file.endswith(".mp4"))
+            first = next(items)
+            extracted = sum(len(names) for _, _, names in os.walk(out))
+            self.assertEqual(extracted, 1, "the first item comes right after its media file and sidecar")
+            self.assertEqual(first.file, sorted(self.expected)[0])
+            rest = list(items)
+        finally:
+            archive.close()
+        self.assertEqual(len(rest) + 1, len(self.expected))
+        for item in [first] + rest:
+            self.assertEqual(os.path.exists(item.output_file), not item.file.endswith(".mp4"), item.file)
+
+    def test_members_outside_the_output_are_skipped(self):
+        media = sorted(self.expected)[0]
+        photo = join(self.source, "Takeout", "Google Photos", media)
+        sidecar = join(self.source, "Takeout", "Google Photos", self.expected[media])
+        out = join(self.root, "slip", "out")
+        os.makedirs(out)
+        for extension in ["zip", "tar"]:
+            path = join(self.root, f"slip.{extension}")
+            names = ["Photos/../../escaped/IMG_1.jpg", "Photos/../../escaped/IMG_1.jpg.json", "/absolute/IMG_2.jpg",
+                     "Photos/IMG_3.jpg", "Photos/IMG_3.jpg.json"]
+            with open(photo, "rb") as f:
+                photo_data = f.read()
+            with open(sidecar, "rb") as f:
+                sidecar_data = f.read()
+            # written member by member, zipfile and tarfile would strip a leading / themselves
+            if extension == "zip":
+                with zipfile.ZipFile(path, "w") as archive:
+                    for name in names:
+                        archive.writestr(zipfile.ZipInfo(name), sidecar_data if name.endswith(".json") else photo_data)
+            else:
+                with tarfile.open(path, "w") as archive:
+                    for name in names:
+                        data = sidecar_data if name.endswith(".json") else photo_data
+                        info = tarfile.TarInfo(name)
+                        info.size = len(data)
+                        archive.addfile(info, io.BytesIO(data))
+            archive = open_archive(path)
+            try:
+                self.assertEqual(sorted(archive.members), ["Photos/IMG_3.jpg", "Photos/IMG_3.jpg.json"], extension)
+                summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+                items = list(_iter_archive_items(archive, out, False, summary))
+                for item in items:
+                    archive.extract(item.input_file, item.output_file)
+            finally:
+                archive.close()
+            self.assertEqual([item.file for item in items], ["IMG_3.jpg"])
+            self.assertEqual(os.listdir(out), [os.path.basename(items[0].output_file)])
+            self.assertFalse(os.path.exists(join(self.root, "escaped")))
+
+    def test_incomplete_archive_kinds_fail_when_opened(self):
+        class NoExtract(TakeoutArchive):
+            def read(self, name):
+                return b""
+
+            def file_type(self, name):
+                return None
+        with self.assertRaises(TypeError):
+            NoExtract([])
+
+if __name__ == '__main__':
+    unittest.main()
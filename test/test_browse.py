@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+from src.web.browse import list_directory, page_directory
+
+class TestBrowse(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        for name in ["Photos from 2019", "photos from 2020", "Archive", ".hidden"]:
+            os.mkdir(join(self.root, name))
+        for name in ["b.jpg", "a.json", ".DS_Store"]:
+            open(join(self.root, name), "w").close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_directories_first_and_sorted(self):
+        self.assertEqual(list_directory(self.root),
+                         (("Archive", True), ("Photos from 2019", True), ("photos from 2020", True)))
+        self.assertEqual(list_directory(self.root, dirs_only=False)[3:], (("a.json", False), ("b.jpg", False)))
+
+    def test_pages_and_prefix(self):
+        entries, total = page_directory(self.root, offset=1, limit=1, dirs_only=False)
+        self.assertEqual((entries, total), ([("Photos from 2019", True)], 5))
+        entries, total = page_directory(self.root, prefix="PHOTOS")
+        self.assertEqual([name for name, _ in entries], ["Photos from 2019", "photos from 2020"])
+        self.assertEqual(page_directory(self.root, offset=10), ([], 3))
+
+    def test_cache_notices_changes(self):
+        list_directory(self.root)
+        os.mkdir(join(self.root, "New"))
+        stat = os.stat(self.root)
+        os.utime(self.root, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))  # coarse mtime filesystems
+        self.assertIn(("New", True), list_directory(self.root))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import pickle
+import tempfile
+import unittest
+from os.path import join
+from src.catalog import FileCatalog, MEDIA, SIDECAR, OTHER, walk_catalogs
+
+class TestFileCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        os.makedirs(join(self.root, "Photos from 2019", "Trip"))
+        for name, data in [("b.jpg", b"12345"), ("b.jpg.json", b"{}"), ("a.MP4", b"123"), ("notes.txt", b"x"),
+                           (join("Photos from 2019", "c.jpg"), b"1"), (join("Photos from 2019", "Trip", "d.jpg"), b"")]:
+            with open(join(self.root, name), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_scan_stats_media_only(self):
+        catalog, subdirs = FileCatalog.scan(self.root)
+        self.assertEqual(subdirs, ["Photos from 2019"])
+        self.assertEqual(sorted(catalog.names), ["a.MP4", "b.jpg", "b.jpg.json", "notes.txt"])
+        self.assertEqual(sorted(catalog.names_of(MEDIA)), ["a.MP4", "b.jpg"])
+        self.assertEqual(catalog.names_of(SIDECAR), ["b.jpg.json"])
+        self.assertEqual(catalog.names_of(OTHER), ["notes.txt"])
+        stat = os.stat(join(self.root, "b.jpg"))
+        self.assertEqual(catalog.stat("b.jpg"), (5, stat.st_mtime_ns, stat.st_ino))
+        self.assertEqual(catalog.stat("b.jpg.json")[0], 0)
+        self.assertEqual(catalog.total_bytes(), 8)
+        self.assertEqual(catalog.device, os.stat(self.root).st_dev)
+
+    def test_lookups(self):
+        names = [f"IMG_{i:05d}.jpg" for i in range(10_000, 0, -1)] + ["ü.jpg"]
+        catalog = FileCatalog.from_names(self.root, names)
+        self.assertEqual(len(catalog), len(names))
+        self.assertEqual(catalog.names, names)
+        self.assertEqual(catalog.find("IMG_10000.jpg"), 0)
+        self.assertEqual(catalog.find("ü.jpg"), len(names) - 1)
+        self.assertIn("IMG_00001.jpg", catalog)
+        self.assertNotIn("IMG_00000.jpg", catalog)
+        with self.assertRaises(KeyError):
+            catalog.stat("missing.jpg")
+        catalog.add("late.jpg", MEDIA, 7)
+        self.assertEqual(catalog.stat("late.jpg"), (7, 0, 0))
+
+    def test_pickles(self):
+        catalog, _ = FileCatalog.scan(self.root)
+        copy = pickle.loads(pickle.dumps(catalog))
+        self.assertEqual(copy.names, catalog.names)
+        self.assertEqual(copy.stat("b.jpg"), catalog.stat("b.jpg"))
+        self.assertEqual(copy.directory, catalog.directory)
+
+    def test_walk(self):
+        walked = {relative_dir: catalog.names for relative_dir, catalog in walk_catalogs(self.root)}
+        self.assertEqual(list(walked), ["", "Photos from 2019", join("Photos from 2019", "Trip")])
+        self.assertEqual(walked[join("Photos from 2019", "Trip")], ["d.jpg"])
+
+if __name__ == '__main__':
+    unittest.main()
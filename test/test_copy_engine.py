@@ -0,0 +1,63 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join
+from src.copy_engine import CopyEngine, BUFFERED, HARDLINK
+
+class TestCopyEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.src = join(self.tmpdir.name, "src.mp4")
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+        os.chmod(self.src, 0o640)
+        self.dst = join(self.tmpdir.name, "dst.mp4")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _read_dst(self):
+        with open(self.dst, "rb") as f:
+            return f.read()
+
+    def test_modes_copy_same_bytes(self):
+        for mode in ["auto", "kernel", "buffered"]:
+            engine = CopyEngine(mode, buffer_size=1024 * 1024)
+            result = engine.copy(self.src, self.dst)
+            self.assertEqual(self._read_dst(), self.data, mode)
+            self.assertEqual(result.bytes_copied, len(self.data), mode)
+            self.assertEqual(os.stat(self.dst).st_mode & 0o777, 0o640, mode)
+            self.assertEqual(sum(engine.strategy_counts.values()), 1)
+
+    def test_checksum_while_copying(self):
+        result = CopyEngine(checksum="sha256", buffer_size=1024 * 1024).copy(self.src, self.dst)
+        self.assertEqual(result.strategy, BUFFERED)
+        self.assertEqual(result.checksum, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self._read_dst(), self.data)
+
+    def test_hardlink_only_unchanged_files(self):
+        engine = CopyEngine(hardlink_unchanged=True)
+        self.assertNotEqual(engine.copy(self.src, self.dst).strategy, HARDLINK)
+        self.assertEqual(engine.copy(self.src, self.dst, modified=False).strategy, HARDLINK)
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+
+    def test_copy_over_a_hardlink_of_the_source(self):
+        # left behind by --hardlinkUnchanged or --dedupe hardlink, then copied over by a later run
+        for mode in ["auto", "kernel", "buffered"]:
+            os.link(self.src, self.dst)
+            result = CopyEngine(mode).copy(self.src, self.dst)
+            self.assertEqual(result.bytes_copied, len(self.data), mode)
+            self.assertEqual(self._read_dst(), self.data, mode)
+            self.assertFalse(os.path.samefile(self.src, self.dst), mode)
+            with open(self.src, "rb") as f:
+                self.assertEqual(f.read(), self.data, mode)
+            os.remove(self.dst)
+        with self.assertRaises(shutil.SameFileError):
+            CopyEngine().copy(self.src, self.src)
+        self.assertEqual(os.path.getsize(self.src), len(self.data))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+from metrics import REGISTRY
+from src.copy_engine import CopyEngine
+from src.dedupe import Deduplicator, HashCache, HARDLINK, SKIP
+from src.pipeline import MergeItem
+
+class TestDeduplicator(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        os.makedirs(join(self.root, "out"))
+        head, middle = os.urandom(100_000), os.urandom(200_000)
+        self.files = {"a.jpg": head + middle + head, "album/a.jpg": head + middle + head,
+                      "b.jpg": head + os.urandom(200_000) + head, "c.jpg": os.urandom(400_000)}
+        for name, data in self.files.items():
+            os.makedirs(os.path.dirname(join(self.root, name)), exist_ok=True)
+            with open(join(self.root, name), "wb") as f:
+                f.write(data)
+        REGISTRY.reset()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def item(self, name: str) -> MergeItem:
+        path = join(self.root, name)
+        stat = os.stat(path)
+        return MergeItem(file=name, json_name=name + ".json", input_file=path, json_file=path + ".json",
+                         output_file=join(self.root, "out", name.replace("/", "_")),
+                         size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    def test_same_size_then_partial_then_full_hash(self):
+        cache = HashCache(join(self.root, "hashes.sqlite"))
+        deduplicator = Deduplicator(HARDLINK, CopyEngine(), cache)
+        items = [self.item(name) for name in ["a.jpg", "b.jpg", "c.jpg", "album/a.jpg"]]
+        for item in items:
+            deduplicator.mark(item)
+        self.assertEqual([item.duplicate_of is not None for item in items], [False, False, False, True])
+        self.assertIs(items[3].duplicate_of, items[0].content)
+        # c.jpg has the same size but different ends, so only the others were read in full
+        self.assertEqual(REGISTRY.counter("dedupe_hashed_bytes_total", kind="full"), 3 * 400_000)
+        cache.close()
+
+        REGISTRY.reset()
+        cache = HashCache(join(self.root, "hashes.sqlite"))
+        deduplicator = Deduplicator(HARDLINK, CopyEngine(), cache)
+        for name in ["a.jpg", "b.jpg", "album/a.jpg"]:
+            deduplicator.mark(self.item(name))
+        self.assertEqual(REGISTRY.counter("dedupe_hashed_bytes_total", kind="full"), 0)
+        self.assertEqual(REGISTRY.counter("dedupe_cache_hits_total"), 3)
+        cache.close()
+
+    def test_same_contents_with_other_tags_are_not_duplicates(self):
+        deduplicator = Deduplicator(HARDLINK, CopyEngine())
+        first, album, other = self.item("a.jpg"), self.item("album/a.jpg"), self.item("album/a.jpg")
+        first.exif_data = album.exif_data = {"DateTimeOriginal": "2020:01:01 12:00:00+01:00"}
+        other.exif_data = {"DateTimeOriginal": "2021:06:01 09:30:00+02:00"}
+        for item in (first, album, other):
+            deduplicator.mark(item)
+        self.assertIs(album.duplicate_of, first.content)
+        self.assertIsNone(other.duplicate_of, "its sidecar has other dates, so it is tagged on its own")
+        self.assertIsNotNone(other.content)
+
+    def test_duplicates_wait_for_the_first_file(self):
+        deduplicator = Deduplicator(HARDLINK, CopyEngine())
+        first, duplicate = self.item("a.jpg"), self.item("album/a.jpg")
+        deduplicator.mark(first)
+        deduplicator.mark(duplicate)
+        self.assertEqual(deduplicator.resolve(duplicate), [])
+        with open(first.output_file, "wb") as f:
+            f.write(b"tagged")
+        self.assertEqual(deduplicator.resolve(first), [first, duplicate])
+        self.assertTrue(os.path.samefile(first.output_file, duplicate.output_file))
+        self.assertEqual(duplicate.copy_strategy, HARDLINK)
+        self.assertEqual(deduplicator.report()["decisions"], {"album/a.jpg": "a.jpg"})
+        self.assertEqual(deduplicator.saved_bytes, duplicate.size)
+
+    def test_skip_and_failed_first_file(self):
+        deduplicator = Deduplicator(SKIP, CopyEngine())
+        first, duplicate = self.item("a.jpg"), self.item("album/a.jpg")
+        deduplicator.mark(first)
+        deduplicator.mark(duplicate)
+        deduplicator.resolve(first)
+        self.assertEqual(deduplicator.resolve(duplicate), [duplicate])
+        self.assertEqual(duplicate.output_file, first.output_file)
+
+        deduplicator = Deduplicator(SKIP, CopyEngine())
+        first, duplicate = self.item("a.jpg"), self.item("album/a.jpg")
+        deduplicator.mark(first)
+        deduplicator.mark(duplicate)
+        first.error = RuntimeError("boom")
+        deduplicator.resolve(first)
+        self.assertIn("which failed", str(deduplicator.resolve(duplicate)[0].error))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+import zlib
+from os.path import join, abspath
+from bench.synthetic_takeout import _content
+from src.exif_native import read_exif_native, update_tiff, write_exif_native, _read_ifd
+from src.exif_interface import write_exif_data_to_new_file
+from src.exiftool_pool import ExifToolPool
+
+FAKE_EXIFTOOL = abspath(join("test", "fake_exiftool.py"))
+EXIF_DATA = {
+    "DateTimeOriginal": "2019:04:05 10:11:12+02:00",
+    "CreateDate": "2019:04:06 08:00:00+02:00",
+    "FileCreateDate": "2019:04:06 08:00:00+02:00",
+    "FileModifyDate": "2019:04:06 08:00:00+02:00",
+    "OffsetTime": "+02:00",
+    "OffsetTimeOriginal": "+02:00",
+    "OffsetTimeDigitized": "+02:00",
+}
+# what exiftool shows for EXIF_DATA once it is written, dates lose their offset
+EXPECTED = {"DateTimeOriginal": "2019:04:05 10:11:12", "CreateDate": "2019:04:06 08:00:00",
+            "OffsetTime": "+02:00", "OffsetTimeOriginal": "+02:00", "OffsetTimeDigitized": "+02:00"}
+
+
+def _riff_chunk(fourcc: bytes, data: bytes) -> bytes:
+    return struct.pack("<4sI", fourcc, len(data)) + data + b"\x00" * (len(data) % 2)
+
+
+def _webp(*chunks: bytes) -> bytes:
+    body = b"WEBP" + b"".join(chunks)
+    return struct.pack("<4sI", b"RIFF", len(body)) + body
+
+
+def _camera_tiff() -> bytes:
+    """A big-endian TIFF block like a camera writes: a Make in IFD0, an exposure time and date in the Exif IFD, and a thumbnail IFD."""
+    make = b"Example Camera Co\x00"
+    ifd0 = 8
+    exif = ifd0 + 2 + 2 * 12 + 4
+    ifd1 = exif + 2 + 2 * 12 + 4
+    data = ifd1 + 2 + 4
+    tiff = b"MM\x00\x2a" + struct.pack(">I", ifd0)
+    tiff += struct.pack(">H", 2) + struct.pack(">HHII", 0x010F, 2, len(make), data) \
+        + struct.pack(">HHII", 0x8769, 4, 1, exif) + struct.pack(">I", ifd1)
+    tiff += struct.pack(">H", 2) + struct.pack(">HHII", 0x829A, 5, 1, data + len(make)) \
+        + struct.pack(">HHII", 0x9003, 2, 20, data + len(make) + 8) + struct.pack(">I", 0)
+    tiff += struct.pack(">H", 0) + struct.pack(">I", 0)
+    return tiff + make + struct.pack(">II", 1, 125) + b"2001:01:01 01:01:01\x00"
+
+
+class TestNativeExif(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name: str, data: bytes) -> str:
+        path = join(self.root, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_containers(self):
+        vp8l = b"\x2f" + struct.pack("<I", (99) | (49 << 14) | (1 << 28)) + b"\x00" * 20
+        vp8 = b"\x30\x01\x00\x9d\x01\x2a" + struct.pack("<HH", 640, 480) + b"\x00" * 21
+        vp8x = struct.pack("<B3x", 0x04) + (639).to_bytes(3, "little") + (479).to_bytes(3, "little")
+        sources = {
+            "photo.jpg": _content("jpeg", 4096),
+            "photo.png": _content("png", 4096),
+            "lossless.webp": _webp(_riff_chunk(b"VP8L", vp8l)),
+            "lossy.webp": _webp(_riff_chunk(b"VP8 ", vp8)),
+            "extended.webp": _webp(_riff_chunk(b"VP8X", vp8x), _riff_chunk(b"VP8 ", vp8),
+                                   _riff_chunk(b"EXIF", b"Exif\x00\x00" + _camera_tiff()), _riff_chunk(b"XMP ", b"<x/>")),
+        }
+        for name, data in sources.items():
+            source = self.write(name, data)
+            output = join(self.root, "out-" + name)
+            self.assertEqual(write_exif_native(source, output, EXIF_DATA), output)
+            self.assertEqual(read_exif_native(output), EXPECTED, name)
+            self.assertEqual(os.path.getmtime(output), 1554530400)
+            with open(output, "rb") as f:
+                written = f.read()
+            if name.endswith(".jpg"):
+                self.assertTrue(written.endswith(data[20:]), "the image data is copied unchanged")
+            elif name.endswith(".png"):
+                position, kinds = 8, []
+                while position < len(written):
+                    length, kind = struct.unpack_from(">I4s", written, position)
+                    crc, = struct.unpack_from(">I", written, position + 8 + length)
+                    self.assertEqual(crc, zlib.crc32(written[position + 4:position + 8 + length]))
+                    kinds.append(kind)
+                    position += 12 + length
+                self.assertEqual(kinds, [b"IHDR", b"eXIf", b"IDAT", b"IEND"])
+            else:
+                self.assertEqual(struct.unpack_from("<I", written, 4)[0], len(written) - 8)
+                self.assertEqual(written[12:16], b"VP8X")
+                self.assertTrue(written[20] & 0x08, "the EXIF flag is set")
+                self.assertLess(written.index(b"EXIF"), written.index(b"XMP ") if b"XMP " in written else len(written))
+            # writing again replaces the tags instead of adding more
+            again = dict(EXIF_DATA, DateTimeOriginal="2020:01:01 00:00:00+00:00")
+            write_exif_native(output, output + ".again", again)
+            self.assertEqual(read_exif_native(output + ".again")["DateTimeOriginal"], "2020:01:01 00:00:00")
+            self.assertEqual(len(read_exif_native(output + ".again")), len(EXPECTED))
+
+        self.assertEqual(read_exif_native(join(self.root, "out-lossless.webp")), EXPECTED)
+        with open(join(self.root, "out-lossless.webp"), "rb") as f:
+            header = f.read(30)
+        self.assertEqual(int.from_bytes(header[24:27], "little") + 1, 100)
+        self.assertEqual(int.from_bytes(header[27:30], "little") + 1, 50)
+        self.assertTrue(header[20] & 0x10, "alpha from the VP8L header")
+
+    def test_existing_entries_are_kept(self):
+        tiff = update_tiff(_camera_tiff(), {0x9003: b"2019:04:05 10:11:12\x00"})
+        self.assertTrue(tiff.startswith(_camera_tiff()[:8]))
+        ifd0, ifd1 = _read_ifd(tiff, 8, ">")
+        self.assertEqual(ifd1, _read_ifd(_camera_tiff(), 8, ">")[1], "the thumbnail IFD is still linked")
+        make = ifd0[0]
+        offset, = struct.unpack(">I", make[3])
+        self.assertEqual(tiff[offset:offset + make[2]], b"Example Camera Co\x00")
+        exif, _ = _read_ifd(tiff, struct.unpack(">I", ifd0[1][3])[0], ">")
+        exposure = next(entry for entry in exif if entry[0] == 0x829A)
+        offset, = struct.unpack(">I", exposure[3])
+        self.assertEqual(struct.unpack_from(">II", tiff, offset), (1, 125))
+
+    def test_unsupported_files_are_left_to_exiftool(self):
+        output = join(self.root, "out")
+        for name, data in {"video.mp4": _content("mp4", 4096), "broken.jpg": b"\xff\xd8\xff\xe0\x00\x10JF"}.items():
+            with self.assertRaises(ValueError):
+                write_exif_native(self.write(name, data), output, EXIF_DATA)
+            self.assertFalse(os.path.exists(output))
+        with self.assertRaises(ValueError):
+            write_exif_native(self.write("photo.jpg", _content("jpeg", 4096)), output, {"DateTimeOriginal": "2019:04:05 10:11:12"})
+
+    def test_same_tags_as_exiftool(self):
+        source = self.write("IMG_0001.jpg", _content("jpeg", 256 * 1024))
+        write_exif_native(source, source + ".native.jpg", EXIF_DATA)
+        with ExifToolPool(1, executable=FAKE_EXIFTOOL) as pool:
+            write_exif_data_to_new_file(source, source + ".exiftool.jpg", EXIF_DATA, pool=pool)
+        with open(source + ".exiftool.jpg.fake-exif.json") as f:
+            requested = json.load(f)
+        shown = {name: value[:19] if name in ("DateTimeOriginal", "CreateDate") else value
+                 for name, value in requested.items() if name in EXPECTED}
+        self.assertEqual(read_exif_native(source + ".native.jpg"), shown)
+
+    def test_output_hardlinked_to_the_source(self):
+        # what --hardlinkUnchanged leaves behind when a single write fails, retried with --nativeExif
+        data = _content("jpeg", 2_000_000)
+        source = self.write("IMG_0001.jpg", data)
+        output = join(self.root, "out.jpg")
+        os.link(source, output)
+        write_exif_native(source, output, EXIF_DATA)
+        with open(source, "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertFalse(os.path.samefile(source, output))
+        self.assertEqual(read_exif_native(output)["OffsetTime"], "+02:00")
+        self.assertEqual(sorted(os.listdir(self.root)), ["IMG_0001.jpg", "out.jpg"], "no temporary file is left")
+
+    @unittest.skipUnless(shutil.which("exiftool"), "exiftool isn't installed")
+    def test_exiftool_reads_the_tags(self):
+        for name, content_type in [("photo.jpg", "jpeg"), ("photo.png", "png")]:
+            output = join(self.root, "out-" + name)
+            write_exif_native(self.write(name, _content(content_type, 4096)), output, EXIF_DATA)
+            shown = json.loads(subprocess.run(["exiftool", "-j", "-ExifIFD:all", output], capture_output=True, text=True).stdout)[0]
+            self.assertEqual({name: shown[name] for name in EXPECTED}, EXPECTED)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from os.path import join, abspath
+from src.exiftool_pool import ExifToolError, ExifToolPool, _frame_arguments
+from src.exif_interface import read_exif_data_on_file, write_exif_data_to_file, write_exif_data_to_new_file
+
+FAKE_EXIFTOOL = abspath(join("test", "fake_exiftool.py"))
+EXIF_DATA = {
+    "DateTimeOriginal": "2022:05:13 11:24:07+00:00",
+    "CreateDate": "2022:05:13 11:24:07+00:00",
+    "OffsetTime": "+00:00",
+    "OffsetTimeOriginal": "+00:00",
+    "OffsetTimeDigitized": "+00:00",
+}
+
+class TestExifToolPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.media = join(self.tmpdir.name, "IMG 0001 'quoted'.jpg")
+        with open(self.media, "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
+        self.pool = ExifToolPool(2, executable=FAKE_EXIFTOOL)
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmpdir.cleanup()
+
+    def test_write_then_read(self):
+        write_exif_data_to_file(self.media, EXIF_DATA, pool=self.pool)
+        tags = read_exif_data_on_file(self.media, pool=self.pool)
+        self.assertEqual(tags["ExifIFD"]["DateTimeOriginal"], EXIF_DATA["DateTimeOriginal"])
+
+    def test_single_write_leaves_source_untouched(self):
+        output = join(self.tmpdir.name, "out.jpg")
+        self.assertEqual(write_exif_data_to_new_file(self.media, output, EXIF_DATA, pool=self.pool), output)
+        self.assertEqual(read_exif_data_on_file(output, pool=self.pool)["ExifIFD"]["CreateDate"], EXIF_DATA["CreateDate"])
+        self.assertEqual(read_exif_data_on_file(self.media, pool=self.pool)["ExifIFD"], {})
+        # an existing output is replaced
+        self.assertEqual(write_exif_data_to_new_file(self.media, output, EXIF_DATA, pool=self.pool), output)
+
+    def test_results_follow_sequence(self):
+        for i in range(5):
+            out, err, rc = self.pool.execute(["-j", self.media])
+            self.assertEqual(rc, 0)
+            self.assertIn(self.media, out)
+        out, err, rc = self.pool.execute(["-j", self.media + ".missing"])
+        self.assertEqual(rc, 1)
+        self.assertIn("File not found", err)
+
+    def test_restart_after_crash(self):
+        self.pool.execute(["-j", self.media])
+        for worker in self.pool._workers:
+            if worker.running:
+                worker._process.kill()
+                worker._process.wait()
+        out, err, rc = self.pool.execute(["-j", self.media])
+        self.assertEqual(rc, 0)
+
+    def test_lots_of_errors_dont_block(self):
+        # more than a pipe buffer of errors, written before the output like exiftool's warnings
+        missing = [join(self.tmpdir.name, f"missing-{i:05d}-{'x' * 40}.jpg") for i in range(2000)]
+        out, err, rc = self.pool.execute(["-j", self.media] + missing)
+        self.assertEqual(rc, 1)
+        self.assertIn(self.media, out)
+        self.assertEqual(err.count("File not found"), len(missing))
+
+    def test_hung_command_restarts_the_worker(self):
+        hang = join(self.tmpdir.name, "stuck.hang")
+        with ExifToolPool(1, executable=FAKE_EXIFTOOL, timeout=0.5) as pool:
+            pool.execute(["-j", self.media])
+            first = pool._workers[0]._process
+            with self.assertRaises(ExifToolError):
+                pool.execute(["-j", hang])
+            self.assertIsNotNone(first.poll(), "the hung worker was killed")
+            out, err, rc = pool.execute(["-j", self.media])
+        self.assertEqual(rc, 0)
+        self.assertIn(self.media, out)
+
+    def test_unframeable_arguments(self):
+        with self.assertRaises(ValueError):
+            _frame_arguments(["-j", "bad\nname.jpg"])
+        with self.assertRaises(ValueError):
+            _frame_arguments(["#comment.jpg"])
+
+if __name__ == '__main__':
+    unittest.main()
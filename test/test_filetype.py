@@ -0,0 +1,42 @@
+import unittest
+from src.filetype import sniff_bytes, corrected_path
+
+def _ftyp(major, *compatible):
+    body = major + b"\x00\x00\x00\x00" + b"".join(compatible)
+    return (8 + len(body)).to_bytes(4, "big") + b"ftyp" + body
+
+class TestFileType(unittest.TestCase):
+    def test_signatures(self):
+        cases = {
+            b"\xff\xd8\xff\xe1\x00\x10Exif": ".jpg",
+            b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR": ".png",
+            b"GIF89a\x01\x00": ".gif",
+            b"RIFF\x10\x00\x00\x00WEBPVP8X": ".webp",
+            b"RIFF\x10\x00\x00\x00AVI LIST": ".avi",
+            _ftyp(b"heic", b"mif1", b"heic"): ".heic",
+            _ftyp(b"mif1", b"mif1", b"heic"): ".heic",
+            _ftyp(b"mif1", b"mif1", b"miaf"): ".heif",
+            _ftyp(b"avif", b"avif", b"mif1"): ".avif",
+            _ftyp(b"qt  ", b"qt  "): ".mov",
+            _ftyp(b"M4V ", b"M4V ", b"mp42"): ".m4v",
+            _ftyp(b"isom", b"isom", b"mp41"): ".mp4",
+            b"\x00\x00\x00\x08wide\x00\x00\x00\x00mdat": ".mov",
+            b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\x82\x84webm": ".webm",
+            b"\x1a\x45\xdf\xa3\xa3\x42\x86\x81\x01\x42\x82\x88matroska": ".mkv",
+            bytes.fromhex("3026B2758E66CF11A6D900AA0062CE6C") + b"\x00" * 8: ".wmv",
+            b"FLV\x01\x05\x00\x00\x00\x09": ".flv",
+            b"plain text": None,
+        }
+        for head, expected in cases.items():
+            self.assertEqual(sniff_bytes(head), expected, head)
+
+    def test_only_different_containers_are_renamed(self):
+        self.assertEqual(corrected_path("a/IMG_1.jpg", ".heic"), "a/IMG_1.heic")
+        self.assertEqual(corrected_path("IMG_1.JPG", ".jpg"), "IMG_1.JPG")
+        self.assertEqual(corrected_path("IMG_1.jpeg", ".jpg"), "IMG_1.jpeg")
+        self.assertEqual(corrected_path("IMG_1.MP4", ".mov"), "IMG_1.MP4")
+        self.assertEqual(corrected_path("IMG_1.heic", ".avif"), "IMG_1.heic")
+        self.assertEqual(corrected_path("IMG_1.png", None), "IMG_1.png")
+
+if __name__ == '__main__':
+    unittest.main()
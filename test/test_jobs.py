@@ -0,0 +1,95 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from os.path import abspath, join
+from bench.synthetic_takeout import write_takeout
+from src.web.jobs import JobManager, QUEUED, RUNNING, DONE, FAILED, CANCELLED, FINISHED_STATES
+
+FAKE_EXIFTOOL = abspath(join("test", "fake_exiftool.py"))
+
+
+def sleepy_job(conn, params):
+    conn.send(("progress", {"current": 1, "total": 2, "percent": 50, "file": params["file"]}))
+    if params.get("crash"):
+        os._exit(3)
+    time.sleep(60)
+
+
+def wait_for(manager, job, states, timeout=60):
+    deadline = time.monotonic() + timeout
+    while job.state not in states and time.monotonic() < deadline:
+        manager.poll()
+        time.sleep(0.05)
+    return job.state
+
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        environ = mock.patch.dict(os.environ, {"EXIFTOOL": FAKE_EXIFTOOL})  # inherited by the workers
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.log_dir = join(self.tmpdir.name, "logs")
+
+    def record(self, kind, job, data):
+        self.events.append((kind, job.id, job.state))
+
+    def test_queue_cap_and_cancel(self):
+        manager = JobManager(max_running=1, log_dir=self.log_dir, target=sleepy_job, on_event=self.record)
+        try:
+            first = manager.submit({"file": "a.jpg"})
+            second = manager.submit({"file": "b.jpg"})
+            third = manager.submit({"file": "c.jpg"})
+            self.assertEqual((first.state, second.state, third.state), (RUNNING, QUEUED, QUEUED))
+
+            self.assertTrue(manager.cancel(second.id))
+            self.assertEqual(second.state, CANCELLED)
+            self.assertFalse(manager.cancel(second.id))
+            self.assertFalse(manager.cancel("nope"))
+
+            deadline = time.monotonic() + 30
+            while not first.progress and time.monotonic() < deadline:
+                manager.poll()
+                time.sleep(0.05)
+            self.assertEqual(first.progress["file"], "a.jpg")
+            self.assertIn(("progress", first.id, RUNNING), self.events)
+
+            manager.cancel(first.id)
+            self.assertEqual(wait_for(manager, first, FINISHED_STATES), CANCELLED)
+            self.assertEqual(third.state, RUNNING)  # the free slot goes to the next queued job
+            self.assertEqual([job.id for job in manager.jobs()], [third.id, second.id, first.id])
+        finally:
+            manager.shutdown()
+        self.assertEqual(third.state, CANCELLED)
+
+    def test_crashed_worker_fails_its_job(self):
+        manager = JobManager(log_dir=self.log_dir, target=sleepy_job)
+        job = manager.submit({"file": "a.jpg", "crash": True})
+        self.assertEqual(wait_for(manager, job, FINISHED_STATES), FAILED)
+        self.assertIn("code 3", job.error)
+
+    def test_merge_job_reports_logs_progress_and_metrics(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_dir = join(tmpdir, "in")
+            write_takeout(input_dir, 20, media_bytes=1024)
+            manager = JobManager(log_dir=self.log_dir, on_event=self.record)
+            job = manager.submit({"inputDir": input_dir, "outputDir": join(tmpdir, "out"), "dryRun": True,
+                                  "log_level": "INFO"})
+            self.assertEqual(wait_for(manager, job, FINISHED_STATES), DONE, job.error)
+        self.assertTrue(job.success)
+        self.assertEqual(job.progress["current"], 20)
+        logs, first = job.logs.since(0)
+        self.assertEqual(first, 0)
+        self.assertTrue(any("Successfully merged metadata" in entry["log"] for entry in logs))
+        with open(job.logs.path) as f:
+            self.assertEqual(f.read().splitlines(), [entry["log"] for entry in logs])
+        self.assertIn("logs", {kind for kind, _, _ in self.events})
+        self.assertIn("files_total", {name for name, _ in job.metrics["counters"]})
+        self.assertEqual(self.events[-1], ("state", job.id, DONE))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from functools import partial
+from os.path import abspath, join
+from unittest.mock import patch
+from bench.synthetic_takeout import write_takeout
+from src.exiftool_pool import ExifToolPool
+from src.journal import Journal, checksum_hash, source_hash, PLANNED, VERIFIED, FAILED
+from src.main import iter_merge
+
+FAKE_EXIFTOOL = abspath(join("test", "fake_exiftool.py"))
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = join(self.tmpdir.name, "out.journal.sqlite")
+        self.output = join(self.tmpdir.name, "IMG_0001.jpg")
+        open(self.output, "wb").close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_done_needs_verified_unchanged_and_existing_output(self):
+        with Journal(self.path) as journal:
+            journal.record("IMG_0001.jpg", 10, 123, PLANNED, self.output)
+            journal.record("IMG_0001.jpg", 10, 123, VERIFIED)
+            journal.record("IMG_0002.jpg", 10, 123, FAILED, join(self.tmpdir.name, "IMG_0002.jpg"), "boom")
+
+        with Journal(self.path) as journal:
+            self.assertTrue(journal.is_done("IMG_0001.jpg", 10, 123))
+            self.assertFalse(journal.is_done("IMG_0001.jpg", 11, 123))
+            self.assertFalse(journal.is_done("IMG_0001.jpg", 10, 124))
+            self.assertFalse(journal.is_done("IMG_0002.jpg", 10, 123))
+            self.assertFalse(journal.is_done("IMG_0003.jpg", 10, 123))
+            self.assertEqual(journal.counts(), {VERIFIED: 1, FAILED: 1})
+            os.remove(self.output)
+            self.assertFalse(journal.is_done("IMG_0001.jpg", 10, 123))
+
+    def test_same_file_with_a_new_mtime_is_done(self):
+        source = join(self.tmpdir.name, "source.jpg")
+        with open(source, "wb") as f:
+            f.write(os.urandom(200_000))
+        size = os.path.getsize(source)
+        with Journal(self.path) as journal:
+            journal.record("IMG_0001.jpg", size, 123, VERIFIED, self.output, content_hash=source_hash(source, size))
+            journal.record("IMG_0002.jpg", size, 123, VERIFIED, self.output)  # from a run without hashes
+            with open(source, "rb") as f:
+                checksum = hashlib.sha256(f.read()).hexdigest()
+            journal.record("IMG_0003.jpg", size, 123, VERIFIED, self.output, content_hash=checksum_hash("sha256", checksum))
+
+        os.utime(source, ns=(456, 456))  # extracted again from a later export
+        with Journal(self.path) as journal:
+            self.assertTrue(journal.is_done("IMG_0001.jpg", size, 456, source))
+            self.assertFalse(journal.is_done("IMG_0001.jpg", size, 456), "without the file only the mtime counts")
+            self.assertFalse(journal.is_done("IMG_0002.jpg", size, 456, source))
+            self.assertTrue(journal.is_done("IMG_0003.jpg", size, 456, source))
+            with open(source, "r+b") as f:
+                f.seek(size - 10)
+                f.write(b"edited....")
+            self.assertFalse(journal.is_done("IMG_0001.jpg", size, 456, source))
+            self.assertFalse(journal.is_done("IMG_0003.jpg", size, 456, source))
+            os.remove(source)
+            self.assertFalse(journal.is_done("IMG_0001.jpg", size, 456, source))
+
+    @patch("src.main.ExifToolPool", partial(ExifToolPool, executable=FAKE_EXIFTOOL))
+    def test_resume_a_re_extracted_export(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_dir, output_dir = join(tmpdir, "in"), join(tmpdir, "out")
+            expected = write_takeout(input_dir, 20, media_bytes=1024)
+            summary = {}
+            # the copy engine's checksums are what the files are recognised by later
+            self.assertEqual(len(list(iter_merge(input_dir, output_dir, checksum="blake2b", summary=summary))), 20)
+            self.assertEqual(summary["failed"], 0)
+            for media in expected:
+                os.utime(join(input_dir, media), ns=(10**18, 10**18))
+            changed = sorted(expected)[0]
+            with open(join(input_dir, changed), "r+b") as f:
+                f.write(b"\x00" * 8)
+            results = list(iter_merge(input_dir, output_dir, resume=True, summary=summary))
+            self.assertEqual([result.file for result in results], [changed])
+            self.assertEqual(summary["skipped"], 19)
+
+            # a run that had no hashes only has the mtimes to go by, and nothing is read for one
+            other_dir = join(tmpdir, "other")
+            list(iter_merge(input_dir, other_dir, xmp_only=True))
+            for media in expected:
+                os.utime(join(input_dir, media), ns=(2 * 10**18, 2 * 10**18))
+            self.assertEqual(len(list(iter_merge(input_dir, other_dir, xmp_only=True, resume=True))), 20)
+
+    def test_writes_are_batched(self):
+        journal = Journal(self.path, batch_size=3, flush_seconds=3600)
+        journal.record("a.jpg", 1, 1, PLANNED)
+        journal.record("b.jpg", 1, 1, PLANNED)
+        self.assertIsNone(journal.lookup("a.jpg"))
+        journal.record("c.jpg", 1, 1, PLANNED)
+        self.assertEqual(journal.lookup("a.jpg")[2], PLANNED)
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
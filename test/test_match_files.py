@@ -0,0 +1,87 @@
+import logging
+import random
+import unittest
+from src.match_files import SidecarIndex, MatchedIndex, match_files_from_file_list
+
+LONG_NAME = "Screenshot_20190405-101112_A Really Long App Name"  # 49 characters
+
+class TestSidecarIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SidecarIndex(["IMG_1.jpg.json", "IMG_10.jpg.json", "IMG_1.jpg.supplemental-metadata.json",
+                                   "IMG_1.jpg.supplemental-metadata(1).json", "IMG_1-edited.jpg.json",
+                                   LONG_NAME[:46] + ".json", LONG_NAME[:47] + ".json"])
+
+    def test_prefixes_of_other_names(self):
+        self.assertEqual(self.index.with_prefix("IMG_1.jpg."),
+                         ["IMG_1.jpg.json", "IMG_1.jpg.supplemental-metadata(1).json", "IMG_1.jpg.supplemental-metadata.json"])
+        self.assertEqual(self.index.with_prefix("IMG_1"),
+                         ["IMG_1-edited.jpg.json", "IMG_1.jpg.json", "IMG_1.jpg.supplemental-metadata(1).json",
+                          "IMG_1.jpg.supplemental-metadata.json", "IMG_10.jpg.json"])
+        self.assertEqual(self.index.with_prefix("IMG_10.jpg.json"), ["IMG_10.jpg.json"])
+        self.assertEqual(self.index.with_prefix("IMG_100"), [])
+        self.assertEqual(self.index.with_prefix("~"), [], "past the last name")
+        self.assertIn("IMG_1.jpg.json", self.index)
+        self.assertNotIn("IMG_1.jpg", self.index)
+
+    def test_truncated_names(self):
+        # only a json cut at exactly 46 characters counts, whatever the length of the media name past it
+        self.assertEqual(self.index.truncated_sidecar(LONG_NAME), LONG_NAME[:46] + ".json")
+        self.assertEqual(self.index.truncated_sidecar(LONG_NAME[:47]), LONG_NAME[:46] + ".json")
+        self.assertIsNone(self.index.truncated_sidecar(LONG_NAME[:46]), "not longer than the cut")
+        self.assertIsNone(self.index.truncated_sidecar("x" * 47))
+        self.assertNotIn(LONG_NAME[:47] + ".json", self.index.truncated)
+
+
+class TestMatchedIndex(unittest.TestCase):
+    def test_first_match_like_a_linear_scan(self):
+        matched = [("IMG_10.jpg", "IMG_10.jpg.json"), ("IMG_1.jpg", "IMG_1.jpg.json"),
+                   ("IMG_1(1).jpg", "IMG_1.jpg(1).json"), ("IMG_1-edited.jpg", "IMG_1.jpg.json")]
+        index = MatchedIndex(matched)
+        self.assertEqual(index.find("IMG_1"), matched[0], "a prefix of a later name finds the earlier one")
+        self.assertEqual(index.find("IMG_1."), matched[1])
+        self.assertEqual(index.find("IMG_1(1)"), matched[2])
+        self.assertEqual(index.find("-edited"), matched[3])
+        self.assertEqual(index.find("_1"), matched[0], "shorter than a trigram")
+        self.assertIsNone(index.find("IMG_2"))
+        self.assertIsNone(index.find("jpgIMG"), "every trigram is there, but not together")
+        self.assertIsNone(MatchedIndex([]).find("IMG_1"))
+
+    def test_random_names(self):
+        rng = random.Random(5)
+        names = ["".join(rng.choice("ab_(1)") for _ in range(rng.randint(1, 12))) for _ in range(300)]
+        index = MatchedIndex([(name, name + ".json") for name in names])
+        for _ in range(500):
+            item = "".join(rng.choice("ab_(1)") for _ in range(rng.randint(1, 6)))
+            expected = next(((name, name + ".json") for name in names if item in name), None)
+            self.assertEqual(index.find(item), expected, item)
+
+
+class TestMatchFiles(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger().setLevel(logging.ERROR)
+        self.addCleanup(logging.getLogger().setLevel, logging.INFO)
+
+    def test_counters_edited_and_prefixes(self):
+        matched, missing, ambiguous = match_files_from_file_list([
+            "IMG_1.jpg", "IMG_1-edited.jpg", "IMG_1(1).jpg", "IMG_10.jpg",
+            "IMG_1.jpg.supplemental-metadata.json", "IMG_1.jpg.supplemental-metadata(1).json", "IMG_10.jpg.json",
+        ], show_progress=False)
+        self.assertEqual(dict(matched), {
+            "IMG_1.jpg": "IMG_1.jpg.supplemental-metadata.json",
+            "IMG_1-edited.jpg": "IMG_1.jpg.supplemental-metadata.json",
+            "IMG_1(1).jpg": "IMG_1.jpg.supplemental-metadata(1).json",
+            "IMG_10.jpg": "IMG_10.jpg.json",
+        })
+        self.assertEqual((missing, ambiguous), ([], []))
+
+    def test_truncated_sidecars(self):
+        matched, missing, _ = match_files_from_file_list([
+            LONG_NAME + ".jpg", LONG_NAME[:46] + ".json",
+            "x" * 47 + ".png", "x" * 47 + ".json",
+        ], show_progress=False)
+        self.assertEqual(dict(matched)[LONG_NAME + ".jpg"], LONG_NAME[:46] + ".json")
+        self.assertEqual(dict(matched)["x" * 47 + ".png"], "x" * 47 + ".json")
+        self.assertEqual(missing, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+from os.path import join
+from src.metrics import Metrics, Histogram, eta_seconds
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_quantiles(self):
+        histogram = Histogram([0.01, 0.1, 1])
+        for _ in range(90):
+            histogram.observe(0.005)
+        for _ in range(10):
+            histogram.observe(0.5)
+        self.assertEqual(histogram.counts, [90, 0, 10, 0])
+        self.assertLessEqual(histogram.quantile(0.5), 0.01)
+        self.assertGreater(histogram.quantile(0.95), 0.1)
+        self.assertLessEqual(histogram.quantile(0.99), 0.5)
+        self.assertEqual(histogram.to_dict()["max"], 0.5)
+        self.assertEqual(Histogram().to_dict(), {"count": 0})
+
+    def test_prometheus_text(self):
+        metrics = Metrics("test")
+        metrics.describe("files_total", "counter", "Files finished")
+        metrics.inc("files_total", result="ok")
+        metrics.inc("files_total", 2, result="ok")
+        metrics.set("eta_seconds", 12.5)
+        metrics.observe("stage_seconds", 0.003, buckets=[0.001, 0.01], stage="copy")
+        lines = metrics.to_prometheus().splitlines()
+        self.assertIn("# HELP test_files_total Files finished", lines)
+        self.assertIn("# TYPE test_files_total counter", lines)
+        self.assertIn('test_files_total{result="ok"} 3', lines)
+        self.assertIn("test_eta_seconds 12.5", lines)
+        self.assertIn('test_stage_seconds_bucket{stage="copy",le="0.001"} 0', lines)
+        self.assertIn('test_stage_seconds_bucket{stage="copy",le="0.01"} 1', lines)
+        self.assertIn('test_stage_seconds_bucket{stage="copy",le="+Inf"} 1', lines)
+        self.assertIn('test_stage_seconds_count{stage="copy"} 1', lines)
+        self.assertEqual(Metrics().to_prometheus(), "")
+
+    def test_report(self):
+        metrics = Metrics()
+        with metrics.timer("stage_seconds", stage="write"):
+            pass
+        metrics.inc("exiftool_retries_total", reason="extension")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, "out.report.json")
+            metrics.write_report(path, summary={"total": 1})
+            with open(path) as f:
+                report = json.load(f)
+        self.assertEqual(report["summary"], {"total": 1})
+        self.assertEqual(report["counters"], {"exiftool_retries_total{reason=extension}": 1})
+        self.assertEqual(report["histograms"]["stage_seconds{stage=write}"]["count"], 1)
+        metrics.reset()
+        self.assertEqual(metrics.report()["counters"], {})
+
+    def test_eta_goes_by_bytes(self):
+        self.assertIsNone(eta_seconds(0, 100, 5))
+        self.assertEqual(eta_seconds(25, 100, 10), 30)
+        self.assertEqual(eta_seconds(100, 100, 10), 0)
+
+if __name__ == '__main__':
+    unittest.main()
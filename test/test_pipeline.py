@@ -0,0 +1,65 @@
+import threading
+import time
+import unittest
+from src.pipeline import MergeItem, Pipeline, Stage
+
+def _item(name):
+    return MergeItem(file=name, json_name=name + ".json", input_file=name, json_file=name + ".json", output_file=name)
+
+class TestPipeline(unittest.TestCase):
+    def test_all_items_come_out_with_failures_marked(self):
+        seen = []
+        def fail_on_three(item):
+            if item.file == "3":
+                raise ValueError("bad file")
+        stages = [Stage("first", fail_on_three, 2), Stage("second", lambda item: seen.append(item.file), 3)]
+        results = list(Pipeline(stages, queue_size=2).run(_item(str(i)) for i in range(20)))
+
+        self.assertEqual(sorted(item.file for item in results), sorted(str(i) for i in range(20)))
+        failed = [item for item in results if item.error is not None]
+        self.assertEqual([(item.file, item.stage) for item in failed], [("3", "first")])
+        self.assertNotIn("3", seen)
+
+    def test_stop_returns_unfinished_items(self):
+        release = threading.Event()
+        pipeline = Pipeline([Stage("slow", lambda item: release.wait(5), 1)], queue_size=1)
+        results = pipeline.run(_item(str(i)) for i in range(100))
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        first = next(results)
+        unfinished = pipeline.stop()
+        timer.cancel()
+
+        self.assertEqual(first.file, "0")
+        self.assertTrue(0 < len(unfinished) < 100)
+
+    def test_feed_errors_are_raised(self):
+        def items():
+            yield _item("a")
+            raise RuntimeError("walk failed")
+        results = []
+        with self.assertRaises(RuntimeError):
+            for item in Pipeline([Stage("noop", lambda item: None)]).run(items()):
+                results.append(item)
+        self.assertEqual([item.file for item in results], ["a"])
+
+    def test_stages_need_a_worker(self):
+        with self.assertRaises(ValueError):
+            Pipeline([Stage("parse", lambda item: None, 1), Stage("copy", lambda item: None, 0)])
+
+    def test_stop_does_not_wait_for_a_stuck_input(self):
+        walked = threading.Event()
+        def items():
+            yield _item("a")
+            walked.wait(10)  # a directory walk that doesn't come back
+            yield _item("b")
+        pipeline = Pipeline([Stage("noop", lambda item: None)])
+        results = pipeline.run(items())
+        self.assertEqual(next(results).file, "a")
+        started = time.monotonic()
+        self.assertEqual(pipeline.stop(timeout=0.2), [])
+        self.assertLess(time.monotonic() - started, 2)
+        walked.set()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+from src.pipeline import MergeItem
+from src.plan import write_plan, read_plan_header, iter_plan
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_dir = join(self.tmpdir.name, "in")
+        self.output_dir = join(self.tmpdir.name, "out")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _items(self, summary):
+        for i in range(3):
+            summary["missing"] += 1
+            yield MergeItem(
+                file=f"album/IMG_{i}.jpg",
+                json_name=f"album/IMG_{i}.jpg.json",
+                input_file=join(self.input_dir, f"album/IMG_{i}.jpg"),
+                json_file=join(self.input_dir, f"album/IMG_{i}.jpg.json"),
+                output_file=join(self.output_dir, f"album/IMG_{i}.png"),
+                size=100 + i, mtime_ns=5, file_type=".png",
+                exif_data={"OffsetTime": "+02:00", "DateTimeOriginal": "2020:01:01 00:00:00+02:00"},
+            )
+
+    def test_round_trip(self):
+        for name in ["plan.jsonl", "plan.jsonl.gz"]:
+            path = join(self.tmpdir.name, name)
+            summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+            self.assertEqual(write_plan(path, self.input_dir, self.output_dir, self._items(summary), summary), 3)
+            self.assertEqual(read_plan_header(path)["outputDir"], os.path.abspath(self.output_dir))
+
+            moved = join(self.tmpdir.name, "moved")
+            summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+            items = list(iter_plan(path, moved, self.output_dir, summary))
+            self.assertEqual(summary["total"], 3)
+            self.assertEqual(summary["missing"], 3)
+            self.assertEqual(items[1].input_file, join(moved, "album/IMG_1.jpg"))
+            self.assertEqual(items[1].output_file, join(self.output_dir, "album/IMG_1.png"))
+            self.assertEqual(items[1].size, 101)
+            self.assertEqual(items[1].exif_data["OffsetTime"], "+02:00")
+
+    def test_incomplete_plan_is_rejected(self):
+        path = join(self.tmpdir.name, "plan.jsonl")
+        summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+        write_plan(path, self.input_dir, self.output_dir, self._items(summary), summary)
+        with open(path) as f:
+            lines = f.readlines()
+        with open(path, "w") as f:
+            f.writelines(lines[:-1])
+        with self.assertRaises(ValueError):
+            list(iter_plan(path, self.input_dir, self.output_dir, summary))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import struct
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from os.path import join
+from bench.synthetic_takeout import _content, _mp4_box
+from src.quicktime import apply_date_patches, plan_date_patches, read_dates
+
+EXIF_DATA = {
+    "DateTimeOriginal": "2019:04:05 10:11:12+02:00",
+    "CreateDate": "2019:04:06 08:00:00+02:00",
+    "FileModifyDate": "2019:04:06 08:00:00+02:00",
+    "OffsetTime": "+02:00",
+    "OffsetTimeOriginal": "+02:00",
+    "OffsetTimeDigitized": "+02:00",
+}
+CREATED = datetime(2019, 4, 6, 6, 0, tzinfo=timezone.utc)
+
+
+def _movie(*extra: bytes, version: int = 0) -> bytes:
+    times = bytes(8) if version == 0 else bytes(16)
+    mvhd = _mp4_box(b"mvhd", bytes([version]) + bytes(3) + times + struct.pack(">II", 1000, 0) + bytes(80))
+    mdhd = _mp4_box(b"mdhd", bytes([version]) + bytes(3) + times + struct.pack(">II", 1000, 0) + bytes(4))
+    return _mp4_box(b"moov", mvhd + _mp4_box(b"trak", _mp4_box(b"tkhd", bytes(84)) + _mp4_box(b"mdia", mdhd)) + b"".join(extra))
+
+
+class TestQuickTime(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name: str, data: bytes) -> str:
+        path = join(self.root, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_patch_in_place(self):
+        original = _content("mp4", 100_000)
+        path = self.write("video.mp4", original)
+        patches = plan_date_patches(path, EXIF_DATA)
+        self.assertEqual(apply_date_patches(path, patches, EXIF_DATA), 24)
+        self.assertEqual([(box, created, modified) for box, created, modified in read_dates(path)],
+                         [(box, CREATED, CREATED) for box in ["mvhd", "tkhd", "mdhd"]])
+        with open(path, "rb") as f:
+            patched = f.read()
+        self.assertEqual(len(patched), len(original))
+        changed = [i for i, (a, b) in enumerate(zip(original, patched)) if a != b]
+        self.assertTrue(all(any(offset <= i < offset + len(data) for offset, data in patches) for i in changed))
+        self.assertEqual(os.path.getmtime(path), CREATED.timestamp())
+
+    def test_64_bit_layout_after_the_media_data(self):
+        # a multi-GB mdat with a 64-bit size in front of the movie header, sparse so it costs no disk
+        path = join(self.root, "big.mov")
+        mdat_size = 3 * 2 ** 30
+        with open(path, "wb") as f:
+            f.write(_content("mp4", 0)[:24])
+            f.write(struct.pack(">I4sQ", 1, b"mdat", mdat_size))
+            f.seek(24 + mdat_size)
+            f.write(_movie(version=1))
+        patches = plan_date_patches(path, EXIF_DATA)
+        apply_date_patches(path, patches, EXIF_DATA)
+        self.assertEqual([box for box, created, _ in read_dates(path) if created == CREATED], ["mvhd", "tkhd", "mdhd"])
+        self.assertEqual([len(data) for _, data in patches], [16, 8, 16])
+
+    def test_other_dates_are_left_to_exiftool(self):
+        keys = _mp4_box(b"meta", _mp4_box(b"hdlr", bytes(24)) + _mp4_box(b"keys", bytes(8)))
+        ilst = _mp4_box(b"udta", _mp4_box(b"meta", bytes(4) + _mp4_box(b"hdlr", bytes(24)) + _mp4_box(b"ilst", _mp4_box(b"\xa9day", bytes(8)))))
+        xmp = _mp4_box(b"uuid", bytes.fromhex("BE7ACFCB97A942E89C71999491E3AFAC") + b"<x:xmpmeta/>")
+        cases = {
+            "keys": _content("mp4", 0)[:24] + _movie(keys),
+            "itunes": _content("mp4", 0)[:24] + _movie(ilst),
+            "xmp": _content("mp4", 0)[:24] + _movie() + xmp,
+            "no movie": _content("mp4", 0)[:24] + _mp4_box(b"mdat", bytes(100)),
+            "truncated": _content("mp4", 1000)[:500],
+        }
+        for name, data in cases.items():
+            with self.assertRaises(ValueError, msg=name):
+                plan_date_patches(self.write(name, data), EXIF_DATA)
+        with self.assertRaises(ValueError):
+            plan_date_patches(self.write("late.mp4", _content("mp4", 1000)), dict(EXIF_DATA, CreateDate="2050:01:01 00:00:00+00:00"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from functools import partial
+from unittest.mock import patch
+from os.path import abspath, join
+from bench.synthetic_takeout import write_takeout
+from src.exif_interface import parse_exif_data_from_sidecar
+from src.main import iter_merge, merge_metadata
+from src.exiftool_pool import ExifToolPool
+from src.results import read_failures
+
+FAKE_EXIFTOOL = abspath(join("test", "fake_exiftool.py"))
+
+
+class TestIterMerge(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.input_dir, self.output_dir = join(self.tmpdir.name, "in"), join(self.tmpdir.name, "out")
+        self.expected = write_takeout(self.input_dir, 30, media_bytes=1024)
+        self.broken = sorted(self.expected)[:2]
+        for media in self.broken:
+            with open(join(self.input_dir, self.expected[media]), "w") as f:
+                f.write("{not json")
+
+    def test_results_and_failures_stream(self):
+        # XMP sidecars need no exiftool
+        summary = {}
+        results = list(iter_merge(self.input_dir, self.output_dir, xmp_only=True, summary=summary))
+
+        self.assertEqual(sorted(result.file for result in results), sorted(self.expected))
+        self.assertEqual((summary["done"], summary["failed"], summary["ok"]), (30, 2, False))
+        self.assertFalse(hasattr(results[0], "__dict__"), "results are slotted")
+        merged = next(result for result in results if not result.failed)
+        self.assertEqual((merged.status, merged.error), ("merged", None))
+        self.assertTrue(merged.output_file.endswith(".xmp") and os.path.isfile(merged.output_file))
+        self.assertGreater(merged.seconds, 0)
+
+        failures = list(read_failures(self.output_dir + ".failures.jsonl"))
+        self.assertEqual(sorted(failure.file for failure in failures), self.broken)
+        self.assertEqual({(failure.status, failure.stage, failure.error_type) for failure in failures},
+                         {("failed", "parse", "JSONDecodeError")})
+        with open(self.output_dir + ".report.json") as f:
+            report = json.load(f)
+        self.assertEqual(report["failures"], self.output_dir + ".failures.jsonl")
+        self.assertEqual(report["summary"]["failed"], 2)
+
+    def test_merge_metadata_consumes_it(self):
+        updates = []
+        self.assertFalse(merge_metadata(self.input_dir, self.output_dir, progress_callback=updates.append,
+                                        show_progress=False, xmp_only=True))
+        self.assertEqual([update["current"] for update in updates], list(range(1, 31)))
+        self.assertEqual(updates[-1]["percent"], 100)
+        self.assertFalse(merge_metadata(self.input_dir, self.output_dir, show_progress=False, xmp_only=True),
+                         "the output directory exists")
+
+    @patch("src.main.ExifToolPool", partial(ExifToolPool, executable=FAKE_EXIFTOOL))
+    def test_closing_early_keeps_outputs_it_didnt_write(self):
+        self.assertFalse(merge_metadata(self.input_dir, self.output_dir, show_progress=False))
+        earlier = {join(root, name) for root, _, names in os.walk(self.output_dir) for name in names}
+
+        # a rerun stopped after its first merged file must not delete what it never got to
+        def slow_parse(*args):
+            time.sleep(0.01)
+            return parse_exif_data_from_sidecar(*args)
+        with patch("src.main.parse_exif_data_from_sidecar", slow_parse):
+            results = iter_merge(self.input_dir, self.output_dir, overwrite_if_exists=True, xmp_only=True)
+            merged = next(result for result in results if not result.failed)
+            results.close()
+        self.assertEqual({path for path in earlier if not os.path.exists(path)}, set())
+        self.assertTrue(os.path.exists(merged.output_file), "a file that came out is finished")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import multiprocessing
+import unittest
+from os.path import join
+from src.pipeline import MergeItem
+from src.plan import write_plan, iter_plan
+from src.shard import split_plan, ShardBoard, Coordinator, run_worker, run_sharded, PENDING, LEASED, DONE
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestShard(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_dir = join(self.tmpdir.name, "in")
+        self.output_dir = join(self.tmpdir.name, "out")
+        self.plan_path = join(self.tmpdir.name, "plan.jsonl")
+        sizes = [8 * 1024 ** 3] + [20 * 1024 ** 2] * 40
+        summary = {"total": 0, "missing": 2, "ambiguous": 1, "skipped": 0}
+        items = (MergeItem(file=f"IMG_{i}.jpg", json_name=f"IMG_{i}.jpg.json",
+                           input_file=join(self.input_dir, f"IMG_{i}.jpg"), json_file=join(self.input_dir, f"IMG_{i}.jpg.json"),
+                           output_file=join(self.output_dir, f"IMG_{i}.jpg"), size=size, exif_data={"OffsetTime": "+00:00"})
+                 for i, size in enumerate(sizes))
+        write_plan(self.plan_path, self.input_dir, self.output_dir, items, summary)
+        self.shard_dir = join(self.tmpdir.name, "shards")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_split_is_byte_balanced(self):
+        shards, totals = split_plan(self.plan_path, 3, self.shard_dir)
+        self.assertEqual(totals, {"missing": 2, "ambiguous": 1})
+        self.assertEqual(sum(shard.files for shard in shards), 41)
+        # the big video gets a shard to itself, the small files are spread over the others
+        self.assertEqual(sorted(shard.files for shard in shards), [1, 20, 20])
+        files = set()
+        for shard in shards:
+            summary = {"total": 0, "missing": 0, "ambiguous": 0, "skipped": 0}
+            shard_files = [item.file for item in iter_plan(shard.plan_path, self.input_dir, self.output_dir, summary)]
+            self.assertEqual(len(shard_files), shard.files)
+            self.assertEqual(shard_files, sorted(shard_files, key=lambda f: int(f[4:-4])))  # plan order is kept
+            files.update(shard_files)
+        self.assertEqual(len(files), 41)
+
+    def test_expired_lease_is_handed_on(self):
+        shards, _ = split_plan(self.plan_path, 2, self.shard_dir)
+        clock = FakeClock()
+        board = ShardBoard(shards, lease_seconds=10, max_attempts=2, clock=clock)
+        first = board.lease("a")
+        self.assertEqual(board.lease("b").index, 1)
+        self.assertIsNone(board.lease("c"))
+
+        clock.now = 5
+        self.assertTrue(board.heartbeat("a", first.index, 3))
+        self.assertEqual(board.progress(), (3, 41))
+        clock.now = 16  # "a" has gone quiet, "b" never sent a heartbeat
+        self.assertEqual(board.lease("c").index, 0)
+        self.assertFalse(board.heartbeat("a", first.index))
+        self.assertEqual(board.shards[1].state, PENDING)
+
+        board.complete("c", 0, failed={"IMG_1.jpg": "boom"})
+        self.assertEqual(board.shards[0].state, DONE)
+        board.lease("d")
+        clock.now = 40  # out of attempts for shard 1
+        board.expire()
+        self.assertTrue(board.done)
+        self.assertIsNotNone(board.shards[1].error)
+        self.assertEqual(board.shards[0].failed, {"IMG_1.jpg": "boom"})
+
+    def test_worker_takes_over_dead_workers_shard(self):
+        shards, _ = split_plan(self.plan_path, 2, self.shard_dir)
+        board = ShardBoard(shards, lease_seconds=0.5)
+        self.assertEqual(board.lease("dead").state, LEASED)  # never heartbeats or completes
+        coordinator = Coordinator(board, {"inputDir": self.input_dir, "outputDir": self.output_dir, "dryRun": True},
+                                  heartbeat_seconds=0.1).start()
+        try:
+            worker = multiprocessing.get_context("spawn").Process(target=run_worker, args=(coordinator.url, "alive"))
+            worker.start()
+            worker.join(timeout=60)
+            self.assertEqual(worker.exitcode, 0)
+        finally:
+            coordinator.close()
+        self.assertTrue(board.done)
+        self.assertEqual([shard.worker for shard in board.shards], ["alive", "alive"])
+        self.assertEqual(board.shards[0].attempts, 2)
+        self.assertIsNone(board.shards[0].error)
+
+    def test_dry_run_leaves_the_output_alone(self):
+        self.assertTrue(run_sharded(self.plan_path, self.input_dir, self.output_dir, 2, 1, shard_dir=self.shard_dir,
+                                    dryRun=True))
+        self.assertFalse(os.path.exists(self.output_dir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import tempfile
+import threading
+import unittest
+from os.path import join
+from src.web.streaming import Coalescer, LogBuffer
+
+class TestCoalescer(unittest.TestCase):
+    def test_batches_logs_and_keeps_latest_progress(self):
+        sent = []
+        coalescer = Coalescer(lambda kind, data: sent.append((kind, data)), interval=3600, max_batch=3)
+        for i in range(5):
+            coalescer.log(i)
+            coalescer.progress({"current": i})
+        self.assertEqual(sent, [("logs", [0, 1, 2]), ("progress", {"current": 1})])  # a full batch goes early
+        coalescer.close()
+        self.assertEqual(sent[2:], [("logs", [3, 4]), ("progress", {"current": 4})])
+        coalescer.flush()
+        self.assertEqual(len(sent), 4)
+
+    def test_timer_sends_pending_entries(self):
+        flushed = threading.Event()
+        coalescer = Coalescer(lambda kind, data: flushed.set(), interval=0.01).start()
+        coalescer.log("line")
+        self.assertTrue(flushed.wait(5))
+        coalescer.close()
+
+class TestLogBuffer(unittest.TestCase):
+    def test_keeps_the_last_lines_and_spills_all(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logs = LogBuffer(join(tmpdir, "logs", "job.log"), max_lines=3)
+            logs.extend([{"log": f"line {i}"} for i in range(5)])
+            self.assertEqual(logs.total, 5)
+            lines, first = logs.since(0)
+            self.assertEqual((first, [line["log"] for line in lines]), (2, ["line 2", "line 3", "line 4"]))
+            self.assertEqual(logs.since(4), ([{"log": "line 4"}], 4))
+            self.assertEqual(logs.since(5), ([], 5))
+            logs.close()
+            with open(logs.path) as f:
+                self.assertEqual(f.read().splitlines(), [f"line {i}" for i in range(5)])
+            logs.remove()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import logging
+import os
+import tempfile
+import unittest
+from os.path import join
+from bench.synthetic_takeout import generate_listing, write_takeout
+from src.match_files import match_files_from_file_list
+from src.filetype import sniff_file_type
+
+class TestSyntheticTakeout(unittest.TestCase):
+    def test_matcher_finds_every_generated_sidecar(self):
+        listing, expected = generate_listing(3000, seed=5)
+        logging.getLogger().setLevel(logging.ERROR)
+        matched_files, missing_files, ambiguous_files = match_files_from_file_list(listing, show_progress=False)
+        logging.getLogger().setLevel(logging.INFO)
+        self.assertEqual(missing_files, [])
+        self.assertEqual(ambiguous_files, [])
+        self.assertDictEqual(dict(matched_files), expected)
+
+    def test_written_files_have_their_real_type(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            expected = write_takeout(tmpdir, 200, albums=3, media_bytes=1024, seed=2)
+            self.assertEqual(len(expected), 200)
+            types = {sniff_file_type(join(tmpdir, media)) for media in expected}
+            self.assertTrue({".jpg", ".png", ".heic", ".mp4"} <= types)
+            for media, sidecar in expected.items():
+                self.assertTrue(os.path.isfile(join(tmpdir, sidecar)), sidecar)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import math
+import os
+import random
+import tempfile
+import unittest
+from array import array
+from datetime import datetime, timedelta, timezone
+from os.path import join
+from src.timezones import TimezoneResolver, format_offset
+from src.exif_interface import parse_exif_data_from_sidecar
+
+def _square(x1, y1, x2, y2):
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]]
+
+def _feature(tzid, geometry_type, coordinates):
+    return {"type": "Feature", "properties": {"tzid": tzid},
+            "geometry": {"type": geometry_type, "coordinates": coordinates}}
+
+def _star(cx, cy, points=40, seed=3):
+    rng = random.Random(seed)
+    ring = []
+    for i in range(points):
+        angle = 2 * math.pi * i / points
+        radius = rng.uniform(1.5, 9)
+        ring.append([cx + radius * math.cos(angle), cy + radius * math.sin(angle)])
+    return ring + [ring[0]]
+
+def _ray_cast(ring, x, y):
+    ring = array("f", [value for point in ring for value in point]).tolist()
+    inside = False
+    for i in range(0, len(ring) - 2, 2):
+        x1, y1, x2, y2 = ring[i:i + 4]
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+GEOJSON = {"type": "FeatureCollection", "features": [
+    # New York with a hole cut out of it, and Paris filling the hole
+    _feature("America/New_York", "Polygon", [_square(-80, 35, -70, 45), _square(-76, 39, -74, 41)]),
+    _feature("Europe/Paris", "Polygon", [_square(-76, 39, -74, 41)]),
+    _feature("Asia/Kolkata", "MultiPolygon", [[_square(70, 10, 80, 20)], [_square(85, 10, 86.5, 11.5)]]),
+    _feature("Australia/Lord_Howe", "Polygon", [_star(150, -30)]),
+]}
+
+class TestTimezones(unittest.TestCase):
+    def setUp(self):
+        self.resolver = TimezoneResolver.from_geojson(GEOJSON, cell_degrees=1.0)
+
+    def test_zone_at(self):
+        self.assertEqual(self.resolver.zone_at(40.71, -74.01 - 2), "America/New_York")
+        self.assertEqual(self.resolver.zone_at(40.0, -75.0), "Europe/Paris")  # inside the hole
+        self.assertEqual(self.resolver.zone_at(15.5, 75.25), "Asia/Kolkata")
+        self.assertEqual(self.resolver.zone_at(11.0, 86.0), "Asia/Kolkata")
+        self.assertIsNone(self.resolver.zone_at(11.0, 87.0))
+        self.assertIsNone(self.resolver.zone_at(0.0, 0.0))
+        self.assertIsNone(self.resolver.zone_at(95.0, 0.0))
+
+    def test_matches_plain_ray_casting(self):
+        ring = GEOJSON["features"][3]["geometry"]["coordinates"][0]
+        for cell_degrees in [0.25, 1.0, 4.0]:
+            resolver = TimezoneResolver.from_geojson(GEOJSON, cell_degrees=cell_degrees)
+            rng = random.Random(7)
+            points = [(rng.uniform(-40, -20), rng.uniform(140, 160)) for _ in range(3000)]
+            for latitude, longitude in points:
+                zone = resolver.zone_at(latitude, longitude)
+                expected = "Australia/Lord_Howe" if _ray_cast(ring, longitude, latitude) else None
+                self.assertEqual(zone, expected, (cell_degrees, latitude, longitude))
+
+    def test_utc_offset_follows_dst(self):
+        summer = int(datetime(2021, 7, 1, 12, tzinfo=timezone.utc).timestamp())
+        winter = int(datetime(2021, 1, 1, 12, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(self.resolver.utc_offset("America/New_York", summer), timedelta(hours=-4))
+        self.assertEqual(self.resolver.utc_offset("America/New_York", winter), timedelta(hours=-5))
+        self.assertEqual(self.resolver.utc_offset("Asia/Kolkata", summer), timedelta(hours=5, minutes=30))
+        # Lord Howe moves its clocks half an hour at 15:30 UTC, in the middle of a cached hour
+        before = int(datetime(2020, 10, 3, 15, 15, tzinfo=timezone.utc).timestamp())
+        after = int(datetime(2020, 10, 3, 15, 45, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(self.resolver.utc_offset("Australia/Lord_Howe", before), timedelta(hours=10, minutes=30))
+        self.assertEqual(self.resolver.utc_offset("Australia/Lord_Howe", after), timedelta(hours=11))
+
+    def test_format_offset(self):
+        self.assertEqual(format_offset(timedelta(0)), "+00:00")
+        self.assertEqual(format_offset(timedelta(hours=5, minutes=30)), "+05:30")
+        self.assertEqual(format_offset(timedelta(hours=-3, minutes=-30)), "-03:30")
+
+    def test_sidecar_times_are_local(self):
+        timestamp = str(int(datetime(2021, 7, 1, 16, tzinfo=timezone.utc).timestamp()))
+        sidecar = {"title": "IMG_0001.jpg", "photoTakenTime": {"timestamp": timestamp},
+                   "creationTime": {"timestamp": timestamp},
+                   "geoData": {"latitude": 42.0, "longitude": -78.0, "altitude": 0.0}}
+        exif_data = parse_exif_data_from_sidecar(sidecar, self.resolver)
+        self.assertEqual(exif_data["DateTimeOriginal"], "2021:07:01 12:00:00-04:00")
+        self.assertEqual(exif_data["OffsetTimeOriginal"], "-04:00")
+
+        sidecar["geoData"] = {"latitude": 0.0, "longitude": 0.0, "altitude": 0.0}
+        exif_data = parse_exif_data_from_sidecar(sidecar, self.resolver)
+        self.assertEqual(exif_data["DateTimeOriginal"], "2021:07:01 16:00:00+00:00")
+
+    def test_load_reuses_built_index(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, "timezones.geojson")
+            with open(path, "w") as f:
+                json.dump(GEOJSON, f)
+            self.assertEqual(TimezoneResolver.load(path).zone_at(15.5, 75.25), "Asia/Kolkata")
+            self.assertTrue(os.path.exists(path + ".idx"))
+            with open(path + ".idx", "rb") as f:
+                self.assertEqual(f.read(8), b"GPTZIDX\0")
+            loaded = TimezoneResolver.load(path)
+            self.assertEqual(loaded.zone_at(40.0, -75.0), "Europe/Paris")
+            self.assertEqual(len(loaded.cells), len(self.resolver.cells))
+            # the mapped index answers like the one built in memory
+            rng = random.Random(11)
+            for _ in range(2000):
+                latitude, longitude = rng.uniform(-45, 50), rng.uniform(-85, 160)
+                self.assertEqual(loaded.zone_at(latitude, longitude), self.resolver.zone_at(latitude, longitude))
+
+            # an index of another format, like the pickles of older versions, is rebuilt
+            with open(path + ".idx", "wb") as f:
+                f.write(b"\x80\x05not an index")
+            self.assertEqual(TimezoneResolver.load(path).zone_at(11.0, 86.0), "Asia/Kolkata")
+            with open(path + ".idx", "rb") as f:
+                self.assertEqual(f.read(8), b"GPTZIDX\0")
+
+if __name__ == '__main__':
+    unittest.main()
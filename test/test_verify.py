@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import unittest
+from os.path import join, abspath
+from metrics import REGISTRY
+from src.exiftool_pool import ExifToolPool
+from src.verify import Verifier, compare_tags, expected_tags
+
+FAKE_EXIFTOOL = abspath(join("test", "fake_exiftool.py"))
+EXIF_DATA = {
+    "DateTimeOriginal": "2019:04:05 10:11:12+02:00",
+    "CreateDate": "2019:04:06 08:00:00+02:00",
+    "FileModifyDate": "2019:04:06 08:00:00+02:00",
+    "OffsetTime": "+02:00",
+    "OffsetTimeOriginal": "+02:00",
+    "OffsetTimeDigitized": "+02:00",
+}
+
+class TestVerify(unittest.TestCase):
+    def test_compare_tags(self):
+        expected = expected_tags(EXIF_DATA, ".jpg")
+        self.assertEqual(set(expected), {"DateTimeOriginal", "CreateDate", "OffsetTime", "OffsetTimeOriginal", "OffsetTimeDigitized"})
+        # how exiftool shows a photo it wrote: wall-clock dates, the offsets in their own tags
+        written = {"SourceFile": "a.jpg", "ExifIFD:DateTimeOriginal": "2019:04:05 10:11:12", "ExifIFD:CreateDate": "2019:04:06 08:00:00",
+                   "ExifIFD:OffsetTime": "+02:00", "ExifIFD:OffsetTimeOriginal": "+02:00", "ExifIFD:OffsetTimeDigitized": "+02:00"}
+        self.assertEqual(compare_tags(expected, written), [])
+        self.assertEqual(compare_tags(expected, dict(written, **{"ExifIFD:OffsetTime": "+01:00"})), [("OffsetTime", "+02:00", "+01:00")])
+        del written["ExifIFD:CreateDate"]
+        self.assertEqual(compare_tags(expected, written), [("CreateDate", "2019:04:06 08:00:00+02:00", None)])
+
+        # videos keep CreateDate in UTC
+        expected = expected_tags(EXIF_DATA, ".mp4")
+        self.assertEqual(list(expected), ["CreateDate"])
+        self.assertEqual(compare_tags(expected, {"QuickTime:CreateDate": "2019:04:06 06:00:00"}), [])
+        self.assertEqual(len(compare_tags(expected, {"QuickTime:CreateDate": "2019:04:06 08:00:00"})), 1)
+        # XMP dates come with their offset
+        expected = expected_tags(EXIF_DATA, ".xmp")
+        self.assertEqual(compare_tags(expected, {"XMP-exif:DateTimeOriginal": "2019:04:05 08:11:12Z",
+                                                 "XMP-xmp:CreateDate": "2019:04:06 08:00:00.123+02:00"}), [])
+
+    def test_batches(self):
+        REGISTRY.reset()
+        with tempfile.TemporaryDirectory() as tmpdir, ExifToolPool(2, executable=FAKE_EXIFTOOL) as pool:
+            verifier = Verifier(pool, batch_size=100)
+            for i in range(250):
+                path = join(tmpdir, f"IMG_{i:04d}.jpg")
+                open(path, "wb").close()
+                tags = dict(EXIF_DATA, DateTimeOriginal="2001:01:01 00:00:00+00:00") if i == 7 else EXIF_DATA
+                with open(path + ".fake-exif.json", "w") as f:
+                    json.dump(tags, f)  # what the fake exiftool reads back
+                verifier.add(path, expected_tags(EXIF_DATA, ".jpg"))
+            verifier.add(join(tmpdir, "gone.jpg"), expected_tags(EXIF_DATA, ".jpg"))
+            report = verifier.finish()
+        self.assertEqual(report["checked"], 251)
+        self.assertEqual(REGISTRY.counter("exiftool_calls_total", mode="pool"), 3)
+        self.assertEqual(report["mismatched_files"], 2)
+        wrong, gone = report["mismatches"]
+        self.assertIn("gone.jpg", gone["error"])
+        self.assertEqual((os.path.basename(wrong["file"]), wrong["tag"], wrong["found"]),
+                         ("IMG_0007.jpg", "DateTimeOriginal", "2001:01:01 00:00:00+00:00"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import xml.etree.ElementTree as ET
+from os.path import join
+from bench.synthetic_takeout import _content
+from src.main import iter_merge
+from src.xmp import XmpWriter, render_xmp
+
+EXIF_DATA = {"DateTimeOriginal": "2019:04:05 10:11:12+02:00", "CreateDate": "2019:04:06 08:00:00+02:00",
+             "FileModifyDate": "2019:04:06 08:00:00+02:00", "OffsetTime": "+02:00"}
+RDF = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+
+class TestXmp(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_render_is_valid_xmp(self):
+        packet = render_xmp(EXIF_DATA)
+        xmpmeta = packet[packet.index("<x:xmpmeta"):packet.index("<?xpacket end")]
+        description = ET.fromstring(xmpmeta).find(f"{RDF}RDF/{RDF}Description")
+        self.assertEqual(description.get("{http://ns.adobe.com/exif/1.0/}DateTimeOriginal"), "2019-04-05T10:11:12+02:00")
+        self.assertEqual(description.get("{http://ns.adobe.com/photoshop/1.0/}DateCreated"), "2019-04-05T10:11:12+02:00")
+        self.assertEqual(description.get("{http://ns.adobe.com/xap/1.0/}CreateDate"), "2019-04-06T08:00:00+02:00")
+
+    def test_names_and_collisions(self):
+        writer = XmpWriter()
+        self.assertEqual(writer.write(join(self.root, "IMG_1.HEIC"), EXIF_DATA), join(self.root, "IMG_1.xmp"))
+        # a live photo's video has the same sidecar, so it shares the xmp
+        self.assertEqual(writer.write(join(self.root, "IMG_1.MP4"), EXIF_DATA), join(self.root, "IMG_1.xmp"))
+        other = dict(EXIF_DATA, DateTimeOriginal="2020:01:01 00:00:00+00:00")
+        self.assertEqual(writer.write(join(self.root, "IMG_1.png"), other), join(self.root, "IMG_1.png.xmp"))
+        self.assertEqual(sorted(os.listdir(self.root)), ["IMG_1.png.xmp", "IMG_1.xmp"])
+
+        # a sidecar from an earlier run is replaced
+        self.assertEqual(XmpWriter().write(join(self.root, "IMG_1.jpg"), other), join(self.root, "IMG_1.xmp"))
+        with open(join(self.root, "IMG_1.xmp")) as f:
+            self.assertIn("2020-01-01T00:00:00+00:00", f.read())
+
+        with self.assertRaises(ValueError):
+            writer.write(join(self.root, "IMG_2.jpg"), {})
+
+    def test_concurrent_writers_of_one_sidecar(self):
+        writer = XmpWriter()
+        other = dict(EXIF_DATA, DateTimeOriginal="2020:01:01 00:00:00+00:00")
+        for n in range(50):
+            # both halves of a live photo at once, and a file with other dates that maps to the same xmp
+            jobs = [(f"IMG_{n}.HEIC", EXIF_DATA), (f"IMG_{n}.MP4", EXIF_DATA), (f"IMG_{n}.png", other)]
+            barrier = threading.Barrier(len(jobs))
+            paths = {}
+            def write(name, exif_data):
+                barrier.wait()
+                paths[name] = writer.write(join(self.root, name), exif_data)
+            threads = [threading.Thread(target=write, args=job) for job in jobs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # whichever comes first gets IMG_n.xmp, but no file ends up with another's dates
+            self.assertNotEqual(paths[f"IMG_{n}.HEIC"], paths[f"IMG_{n}.png"])
+            self.assertNotEqual(paths[f"IMG_{n}.MP4"], paths[f"IMG_{n}.png"])
+            for name, exif_data in jobs:
+                with open(paths[name]) as f:
+                    self.assertIn(exif_data["DateTimeOriginal"][:10].replace(":", "-"), f.read())
+
+    def test_resume_keeps_the_other_half_of_a_live_photo(self):
+        input_dir, output_dir = join(self.root, "in"), join(self.root, "out")
+        os.makedirs(input_dir)
+        def add(name, kind, timestamp):
+            with open(join(input_dir, name), "wb") as f:
+                f.write(_content(kind, 1000))
+            with open(join(input_dir, name + ".supplemental-metadata.json"), "w") as f:
+                json.dump({"title": name, "photoTakenTime": {"timestamp": str(timestamp)},
+                           "creationTime": {"timestamp": str(timestamp)},
+                           "geoData": {"latitude": 0.0, "longitude": 0.0, "altitude": 0.0}}, f)
+        add("IMG_1.HEIC", "heic", 1554458000)
+        list(iter_merge(input_dir, output_dir, xmp_only=True))
+        with open(join(output_dir, "IMG_1.xmp")) as f:
+            heic_sidecar = f.read()
+
+        # a later export brings the video, with other dates; the photo is skipped as done
+        add("IMG_1.MP4", "mp4", 1600000000)
+        summary = {}
+        results = list(iter_merge(input_dir, output_dir, resume=True, xmp_only=True, summary=summary))
+        self.assertEqual(summary["skipped"], 1)
+        self.assertEqual([result.output_file for result in results], [join(output_dir, "IMG_1.MP4.xmp")])
+        with open(join(output_dir, "IMG_1.xmp")) as f:
+            self.assertEqual(f.read(), heic_sidecar)
+
+if __name__ == '__main__':
+    unittest.main()